@@ -0,0 +1,224 @@
+import os
+import gzip
+import json
+import logging
+
+try:
+    import lib.utils as utils
+except ImportError:
+    import vaultmanager.lib.utils as utils
+
+
+class KVArchive:
+    """
+    Export file of a Vault K/V tree
+
+    The file is gzip compressed text: a header line followed by one line by
+    secret holding its path relative to the exported path and its content
+    as JSON, and a trailer line with the number of secrets and whether the
+    export is complete. When encrypted, each secret line is a Fernet token
+    so secrets can be encrypted and decrypted independently while the file
+    is streamed. The file is only readable by its owner
+    """
+    logger = None
+    archive_file = None
+    env_variable = "VAULT_MANAGER_EXPORT_KEY"
+    format_name = "vault-manager-kv-export"
+    format_version = 1
+    fd = None
+    raw_fd = None
+    fernet = None
+    header = None
+    trailer = None
+
+    def __init__(self, base_logger=None, archive_file=None):
+        """
+        :param base_logger: main class name
+        :type base_logger: string
+        :param archive_file: path of the export file
+        :type archive_file: str
+        """
+        if base_logger:
+            self.logger = logging.getLogger(
+                base_logger + "." + self.__class__.__name__
+            )
+        else:
+            self.logger = logging.getLogger()
+        self.archive_file = archive_file
+
+    def create(self, exported_path, encrypt=False):
+        """
+        Create the export file and write its header
+
+        :param exported_path: path the secrets are exported from
+        :type exported_path: str
+        :param encrypt: encrypt secrets with the key of env_variable
+        :type encrypt: bool
+        """
+        if encrypt:
+            self.fernet = utils.get_fernet(self.env_variable)
+        self.header = {"format": self.format_name,
+                       "version": self.format_version,
+                       "path": exported_path,
+                       "encrypted": encrypt}
+        self.logger.debug("Creating export file '%s'" % self.archive_file)
+        try:
+            # created with owner only permissions, whatever the umask
+            self.raw_fd = os.fdopen(os.open(
+                self.archive_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600
+            ), "wb")
+        except FileExistsError:
+            raise ValueError("'%s' already exists" % self.archive_file)
+        except OSError as e:
+            raise ValueError("Can't create '%s': %s" %
+                             (self.archive_file, str(e)))
+        self.fd = gzip.open(self.raw_fd, "wt")
+        self.fd.write(json.dumps(self.header) + "\n")
+
+    def open(self):
+        """
+        Open the export file and read its header
+        """
+        self.logger.debug("Opening export file '%s'" % self.archive_file)
+        try:
+            self.fd = gzip.open(self.archive_file, "rt")
+            self.header = json.loads(self.fd.readline())
+        except (OSError, ValueError) as e:
+            self.close()
+            raise ValueError("'%s' is not a valid export file: %s" %
+                             (self.archive_file, str(e)))
+        if not isinstance(self.header, dict) or \
+                self.header.get("format") != self.format_name:
+            self.close()
+            raise ValueError("'%s' is not a valid export file" %
+                             self.archive_file)
+        if self.header.get("version") != self.format_version:
+            self.close()
+            raise ValueError("Unsupported export file version: %s" %
+                             self.header.get("version"))
+        if self.header.get("encrypted"):
+            self.fernet = utils.get_fernet(self.env_variable)
+
+    def encode(self, path, secret):
+        """
+        Return the line of a secret
+
+        :param path: secret path relative to the exported path
+        :type path: str
+        :param secret: secret content
+        :type secret: dict
+
+        :return: str
+        """
+        line = json.dumps({"path": path, "data": secret},
+                          separators=(",", ":"))
+        if self.fernet:
+            return self.fernet.encrypt(line.encode()).decode()
+        return line
+
+    def decode(self, line):
+        """
+        Return the relative path and content of a secret line
+
+        :param line: line read from the export file
+        :type line: str
+
+        :return: tuple(str, dict)
+        """
+        if self.fernet:
+            try:
+                from cryptography.fernet import InvalidToken
+            except ImportError:
+                InvalidToken = ValueError
+            try:
+                line = self.fernet.decrypt(line.encode()).decode()
+            except InvalidToken:
+                raise ValueError("'%s' can't be decrypted with this key" %
+                                 self.archive_file)
+        record = json.loads(line)
+        return record["path"], record["data"]
+
+    def write(self, line):
+        """
+        Append an encoded secret line
+
+        :param line: line returned by encode
+        :type line: str
+        """
+        self.fd.write(line + "\n")
+
+    def write_trailer(self, secrets_count, complete=True):
+        """
+        End the export file with the number of secrets written
+
+        :param secrets_count: number of secret lines written
+        :type secrets_count: int
+        :param complete: False if the export was stopped early
+        :type complete: bool
+        """
+        self.trailer = {"secrets": secrets_count, "complete": complete}
+        self.fd.write(json.dumps({"trailer": self.trailer}) + "\n")
+
+    def lines(self):
+        """
+        Yield encoded secret lines, the file being read as it is consumed.
+        The trailer is kept in trailer
+
+        :return: generator(str)
+        """
+        try:
+            for line in self.fd:
+                line = line.strip()
+                if line.startswith('{"trailer"'):
+                    self.trailer = json.loads(line)["trailer"]
+                    return
+                if line:
+                    yield line
+        except (OSError, EOFError) as e:
+            raise ValueError("'%s' is truncated: %s" %
+                             (self.archive_file, str(e)))
+
+    def verify(self, force=False):
+        """
+        Read the whole export file and check that it ends with the trailer
+        of a complete export holding as many secrets as the file. The file
+        must be opened again to be read
+
+        :param force: only log problems instead of raising them
+        :type force: bool
+
+        :return: int number of secret lines
+        """
+        secrets_count = 0
+        problem = None
+        try:
+            for _ in self.lines():
+                secrets_count += 1
+        except ValueError as e:
+            problem = str(e)
+        if problem is None and self.trailer is None:
+            problem = "'%s' has no trailer, the export didn't end" % \
+                self.archive_file
+        elif problem is None and not self.trailer.get("complete"):
+            problem = "'%s' is an incomplete export" % self.archive_file
+        elif problem is None and self.trailer.get("secrets") != secrets_count:
+            problem = "'%s' holds %s secrets instead of %s" % (
+                self.archive_file, secrets_count, self.trailer.get("secrets")
+            )
+        if problem is not None:
+            if not force:
+                raise ValueError(problem)
+            self.logger.warning(problem)
+        return secrets_count
+
+    def close(self):
+        """
+        Close the export file
+        """
+        if self.fd:
+            self.fd.close()
+            self.fd = None
+        if self.raw_fd:
+            # gzip doesn't close a file object it was given
+            self.raw_fd.close()
+            self.raw_fd = None
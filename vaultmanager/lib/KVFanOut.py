@@ -0,0 +1,201 @@
+import queue
+import logging
+import threading
+
+try:
+    from lib.RateLimiter import RateLimiter
+except ImportError:
+    from vaultmanager.lib.RateLimiter import RateLimiter
+
+
+class KVFanOut:
+    """
+    Write secrets read once to several Vault instances
+
+    Each target has its own bounded queue, writer threads and rate limit, so
+    a slow target doesn't slow down the others until its queue is full.
+    A write waiting more than submit_timeout seconds for room in the queue
+    of a target is dropped, and the next writes to this target are dropped
+    without waiting until its queue is half empty, so a slow target never
+    stalls the others for long.
+    A failed write is recorded in the target report and doesn't stop the
+    other writes. A target which can't be reached is reported with its
+    error and all its writes are counted as failed
+    """
+    logger = None
+    targets = None
+    writers = None
+    queue_size = None
+    submit_timeout = None
+    max_errors = 10
+    done = object()
+
+    def __init__(self, base_logger=None, writers=1, queue_size=100,
+                 submit_timeout=30):
+        """
+        :param base_logger: main class name
+        :type base_logger: string
+        :param writers: number of writer threads per target
+        :type writers: int
+        :param queue_size: maximum number of secrets waiting per target
+        :type queue_size: int
+        :param submit_timeout: seconds waited for room in the queue of a
+                               target before dropping a write
+        :type submit_timeout: float
+        """
+        if base_logger:
+            self.logger = logging.getLogger(
+                base_logger + "." + self.__class__.__name__
+            )
+        else:
+            self.logger = logging.getLogger()
+        self.writers = writers
+        self.queue_size = queue_size
+        self.submit_timeout = submit_timeout
+        self.targets = []
+
+    def add_target(self, name, vault_client, rate=None):
+        """
+        Add a target and start its writers
+
+        :param name: target name used in the report
+        :type name: str
+        :param vault_client: client of the target
+        :type vault_client: VaultClient
+        :param rate: maximum number of writes per second
+        :type rate: float
+        """
+        self.logger.debug("Adding target '%s' - rate limit: %s" % (name, rate))
+        target = {
+            "name": name,
+            "client": vault_client,
+            "limiter": RateLimiter(rate),
+            "queue": queue.Queue(self.queue_size),
+            "lock": threading.Lock(),
+            "lagging": False,
+            "report": {"written": 0, "failed": 0, "dropped": 0,
+                       "errors": []}
+        }
+        target["threads"] = [
+            threading.Thread(target=self.write, args=(target,), daemon=True)
+            for _ in range(self.writers)
+        ]
+        for thread in target["threads"]:
+            thread.start()
+        self.targets.append(target)
+
+    def add_failed_target(self, name, error):
+        """
+        Add a target which couldn't be connected to
+
+        :param name: target name used in the report
+        :type name: str
+        :param error: connection or authentication error
+        :type error: str
+        """
+        self.logger.debug("Target '%s' is unavailable: %s" % (name, error))
+        self.targets.append({
+            "name": name,
+            "queue": None,
+            "threads": [],
+            "lock": threading.Lock(),
+            "report": {"written": 0, "failed": 0, "dropped": 0,
+                       "errors": [], "error": error}
+        })
+
+    def healthy_targets(self):
+        """
+        Return the number of targets which can be written to
+
+        :return: int
+        """
+        return len([target for target in self.targets
+                    if target["queue"] is not None])
+
+    def write(self, target):
+        """
+        Writer thread of a target
+
+        :param target: target description
+        :type target: dict
+        """
+        while True:
+            item = target["queue"].get()
+            if item is self.done:
+                return
+            path, secret = item
+            target["limiter"].acquire()
+            try:
+                target["client"].write(path, secret, hide_all=True)
+            except Exception as e:
+                self.logger.debug("Failed to write '%s' on '%s': %s" %
+                                  (path, target["name"], str(e)))
+                with target["lock"]:
+                    target["report"]["failed"] += 1
+                    self.record_error(target, path, str(e))
+                continue
+            with target["lock"]:
+                target["report"]["written"] += 1
+
+    def record_error(self, target, path, error):
+        """
+        Record the error of a write in the report of a target
+
+        :param target: target description
+        :type target: dict
+        :param path: target secret path
+        :type path: str
+        :param error: error message
+        :type error: str
+        """
+        if len(target["report"]["errors"]) < self.max_errors:
+            target["report"]["errors"].append("%s: %s" % (path, error))
+
+    def submit(self, path, secret):
+        """
+        Queue a secret to write on all targets
+
+        :param path: target secret path
+        :type path: str
+        :param secret: secret content
+        :type secret: dict
+        """
+        for target in self.targets:
+            if target["queue"] is None:
+                with target["lock"]:
+                    target["report"]["failed"] += 1
+                continue
+            if target["lagging"] and \
+                    target["queue"].qsize() <= self.queue_size // 2:
+                # the target caught up with half of its queue
+                target["lagging"] = False
+            try:
+                if target["lagging"]:
+                    target["queue"].put_nowait((path, secret))
+                else:
+                    target["queue"].put((path, secret),
+                                        timeout=self.submit_timeout)
+            except queue.Full:
+                if not target["lagging"]:
+                    self.logger.warning("'%s' is too slow, dropping writes "
+                                        "until its queue is half empty" %
+                                        target["name"])
+                target["lagging"] = True
+                with target["lock"]:
+                    target["report"]["dropped"] += 1
+                    self.record_error(target, path,
+                                      "dropped, target queue full")
+
+    def close(self):
+        """
+        Wait for all queued writes and return the report of each target
+
+        :return: dict
+        """
+        for target in self.targets:
+            for _ in target["threads"]:
+                target["queue"].put(self.done)
+        for target in self.targets:
+            for thread in target["threads"]:
+                thread.join()
+        return {target["name"]: target["report"] for target in self.targets}
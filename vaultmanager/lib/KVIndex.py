@@ -0,0 +1,313 @@
+import os
+import hmac
+import json
+import zlib
+import time
+import hashlib
+import logging
+
+try:
+    import lib.utils as utils
+except ImportError:
+    import vaultmanager.lib.utils as utils
+
+
+class KVIndex:
+    """
+    Encrypted inverted index of a Vault K/V tree for repeated searches
+
+    Path segments and key names point to the secrets and keys holding them.
+    Values can be indexed as salted digests of their lower case n-grams,
+    never in clear. The whole index is compressed and encrypted with Fernet
+    before being written to disk
+    """
+    logger = None
+    index_file = None
+    ngram_size = 3
+    digest_size = 8
+    roots = None
+    salt = None
+    secrets = None
+    keys = None
+    segments = None
+    key_names = None
+    values = None
+    keys_by_secret = None
+
+    def __init__(self, base_logger=None, index_file=None):
+        """
+        :param base_logger: main class name
+        :type base_logger: string
+        :param index_file: path of the encrypted index file
+        :type index_file: str
+        """
+        if base_logger:
+            self.logger = logging.getLogger(
+                base_logger + "." + self.__class__.__name__
+            )
+        else:
+            self.logger = logging.getLogger()
+        self.index_file = index_file
+        self.logger.debug("Instantiating KVIndex class")
+
+    @staticmethod
+    def fernet(env_variable="VAULT_MANAGER_INDEX_KEY"):
+        """
+        Return the Fernet instance encrypting the index, the key being read
+        from an environment variable
+
+        :param env_variable: Environment variable containing the Fernet key
+        :type env_variable: str
+
+        :return: cryptography.fernet.Fernet
+        """
+        return utils.get_fernet(env_variable)
+
+    def create(self, roots, index_values=False):
+        """
+        Initialize an empty index
+
+        :param roots: paths covered by the index
+        :type roots: list(str)
+        :param index_values: also index digests of values n-grams
+        :type index_values: bool
+        """
+        self.roots = list(roots)
+        self.salt = os.urandom(16)
+        self.secrets = []
+        self.keys = []
+        self.segments = {}
+        self.key_names = {}
+        self.values = {} if index_values else None
+
+    def ngram_digests(self, text):
+        """
+        Return salted digests of the lower case n-grams of a text
+
+        :param text: text to split in n-grams
+        :type text: str
+
+        :return: set(str)
+        """
+        text = text.lower()
+        return set(
+            hmac.new(self.salt, text[i:i + self.ngram_size].encode(),
+                     hashlib.sha256).hexdigest()[:2 * self.digest_size]
+            for i in range(len(text) - self.ngram_size + 1)
+        )
+
+    def add(self, path, secret):
+        """
+        Add a secret to the index
+
+        :param path: secret path
+        :type path: str
+        :param secret: secret content, only its keys are used if values
+                       are not indexed
+        :type secret: dict
+        """
+        secret_id = len(self.secrets)
+        self.secrets.append(path)
+        for segment in set(path.split("/")):
+            self.segments.setdefault(segment, []).append(secret_id)
+        for key in secret:
+            key_id = len(self.keys)
+            self.keys.append([secret_id, key])
+            self.key_names.setdefault(key, []).append(key_id)
+            if self.values is None:
+                continue
+            value = secret[key]
+            if not isinstance(value, str):
+                value = json.dumps(value, sort_keys=True)
+            for digest in self.ngram_digests(value):
+                self.values.setdefault(digest, []).append(key_id)
+
+    def save(self):
+        """
+        Compress, encrypt and write the index to its file
+        """
+        document = json.dumps({
+            "created": int(time.time()),
+            "roots": self.roots,
+            "salt": self.salt.hex(),
+            "secrets": self.secrets,
+            "keys": self.keys,
+            "segments": self.segments,
+            "key_names": self.key_names,
+            "values": self.values
+        }, separators=(",", ":"))
+        encrypted = self.fernet().encrypt(zlib.compress(document.encode()))
+        with open(self.index_file, "wb") as fd:
+            fd.write(encrypted)
+        self.logger.debug("Index of %s secrets written to '%s'" %
+                          (len(self.secrets), self.index_file))
+
+    def load(self):
+        """
+        Read and decrypt the index file
+        """
+        self.logger.debug("Loading index '%s'" % self.index_file)
+        if not os.path.isfile(self.index_file):
+            raise ValueError("Index '%s' not found" % self.index_file)
+        with open(self.index_file, "rb") as fd:
+            encrypted = fd.read()
+        try:
+            from cryptography.fernet import InvalidToken
+        except ImportError:
+            InvalidToken = ValueError
+        try:
+            compressed = self.fernet().decrypt(encrypted)
+        except InvalidToken:
+            raise ValueError("Index '%s' can't be decrypted with this key" %
+                             self.index_file)
+        try:
+            document = json.loads(zlib.decompress(compressed).decode())
+            self.roots = document["roots"]
+            self.salt = bytes.fromhex(document["salt"])
+            self.secrets = document["secrets"]
+            self.keys = document["keys"]
+            self.segments = document["segments"]
+            self.key_names = document["key_names"]
+            self.values = document["values"]
+        except (zlib.error, ValueError, KeyError, TypeError) as e:
+            raise ValueError("Index '%s' is corrupt: %s" %
+                             (self.index_file, str(e)))
+
+    def covers(self, path):
+        """
+        Return True if path is under a root of the index
+
+        :param path: path to check
+        :type path: str
+
+        :return: bool
+        """
+        path = path.strip("/")
+        return any(not root or path == root or path.startswith(root + "/")
+                   for root in self.roots)
+
+    def lookup(self, vocabulary, matcher):
+        """
+        Match the words of a vocabulary and return their postings by term
+
+        :param vocabulary: postings by word
+        :type vocabulary: dict
+        :param matcher: compiled terms
+        :type matcher: KVMatcher
+
+        :return: dict of set(int) by term index
+        """
+        postings = {}
+        for word in vocabulary:
+            for term in matcher.match(word):
+                postings.setdefault(term, set()).update(vocabulary[word])
+        return postings
+
+    def value_candidates(self, matcher):
+        """
+        Return keys whose value may contain each literal term, all n-grams of
+        the term being found in the value. Terms shorter than the n-grams,
+        and regular expressions, can't be looked up
+
+        :param matcher: compiled terms
+        :type matcher: KVMatcher
+
+        :return: dict of set(int) by term index
+        """
+        candidates = {}
+        if self.values is None or matcher.regex:
+            return candidates
+        for index, term in enumerate(matcher.terms):
+            if len(term) < self.ngram_size:
+                self.logger.warning("'%s' is too short to be searched in "
+                                    "indexed values" % term)
+                continue
+            keys = None
+            for digest in self.ngram_digests(term):
+                found = set(self.values.get(digest, []))
+                keys = found if keys is None else keys & found
+                if not len(keys):
+                    break
+            if keys:
+                candidates[index] = keys
+        return candidates
+
+    def search(self, matcher, scope="all"):
+        """
+        Search terms in the index
+
+        Terms are matched against the vocabulary of path segments and key
+        names, so terms spanning several segments must be searched without
+        index. Values found from n-grams digests may not contain the term
+        and are returned apart as candidates, unless the key already
+        matches the term
+
+        :param matcher: compiled terms
+        :type matcher: KVMatcher
+        :param scope: 'all', 'keys' or 'paths'
+        :type scope: str
+
+        :return: tuple(dict, dict) matched 'path/key', or 'path' with the
+                 'paths' scope, with the terms found, and candidate
+                 'path/key' with the terms they may contain
+        """
+        found = {}
+        candidates = {}
+
+        def add(results, full_path, term):
+            results.setdefault(full_path, set()).add(term)
+
+        if scope in ["all", "paths"]:
+            for term, secret_ids in self.lookup(self.segments,
+                                                matcher).items():
+                for secret_id in secret_ids:
+                    if scope == "paths":
+                        add(found, self.secrets[secret_id], term)
+                        continue
+                    # a matching path matches all keys of the secret
+                    for key_id in self.secret_keys(secret_id):
+                        add(found, self.key_path(key_id), term)
+        if scope in ["all", "keys"]:
+            for term, key_ids in self.lookup(self.key_names, matcher).items():
+                for key_id in key_ids:
+                    add(found, self.key_path(key_id), term)
+        if scope == "all":
+            for term, key_ids in self.value_candidates(matcher).items():
+                for key_id in key_ids:
+                    full_path = self.key_path(key_id)
+                    if term not in found.get(full_path, ()):
+                        add(candidates, full_path, term)
+
+        def ordered(results):
+            return {full_path: [matcher.terms[i]
+                                for i in sorted(results[full_path])]
+                    for full_path in sorted(results)}
+
+        return ordered(found), ordered(candidates)
+
+    def secret_keys(self, secret_id):
+        """
+        Return ids of the keys of a secret
+
+        :param secret_id: secret id
+        :type secret_id: int
+
+        :return: list(int)
+        """
+        if self.keys_by_secret is None:
+            self.keys_by_secret = {}
+            for key_id, (owner, key) in enumerate(self.keys):
+                self.keys_by_secret.setdefault(owner, []).append(key_id)
+        return self.keys_by_secret.get(secret_id, [])
+
+    def key_path(self, key_id):
+        """
+        Return the 'path/key' of a key id
+
+        :param key_id: key id
+        :type key_id: int
+
+        :return: str
+        """
+        secret_id, key = self.keys[key_id]
+        return self.secrets[secret_id] + "/" + key
@@ -0,0 +1,116 @@
+import os
+import json
+import logging
+import threading
+
+
+class KVJournal:
+    """
+    Append-only journal of completed secrets writes
+
+    Each completed write is recorded as a JSON line with its source and
+    target paths. Entries are buffered and flushed to disk in batches, so a
+    failed copy only loses the last unflushed batch and can be resumed by
+    skipping the journaled entries
+    """
+    logger = None
+    journal_file = None
+    batch_size = None
+    buffer = None
+    lock = None
+    fd = None
+
+    def __init__(self, base_logger=None, journal_file=None, batch_size=100):
+        """
+        :param base_logger: main class name
+        :type base_logger: string
+        :param journal_file: path of the journal file
+        :type journal_file: str
+        :param batch_size: number of entries written to disk at once
+        :type batch_size: int
+        """
+        if base_logger:
+            self.logger = logging.getLogger(
+                base_logger + "." + self.__class__.__name__
+            )
+        else:
+            self.logger = logging.getLogger()
+        self.journal_file = journal_file
+        self.batch_size = batch_size
+        self.buffer = []
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Read entries of the journal file. A truncated last line, left by an
+        interrupted flush, is ignored
+
+        :return: set(tuple(str, str)) source and target paths
+        """
+        entries = set()
+        if not os.path.isfile(self.journal_file):
+            self.logger.debug("Journal '%s' doesn't exist" % self.journal_file)
+            return entries
+        with open(self.journal_file) as fd:
+            for line in fd:
+                try:
+                    entry = json.loads(line)
+                    entries.add((entry["from"], entry["to"]))
+                except (ValueError, KeyError, TypeError):
+                    self.logger.debug("Ignoring journal line '%s'" %
+                                      line.strip())
+        self.logger.debug("%s entries loaded from journal '%s'" %
+                          (len(entries), self.journal_file))
+        return entries
+
+    def open(self, resume=False):
+        """
+        Open the journal file, emptying it unless resuming
+
+        :param resume: keep the entries of the previous run
+        :type resume: bool
+        """
+        self.logger.debug("Opening journal '%s' - resume: %s" %
+                          (self.journal_file, resume))
+        self.fd = open(self.journal_file, "a" if resume else "w")
+
+    def append(self, copy_from, copy_to):
+        """
+        Record a completed write, flushing the batch if it is full
+
+        :param copy_from: source secret path
+        :type copy_from: str
+        :param copy_to: target secret path
+        :type copy_to: str
+        """
+        with self.lock:
+            self.buffer.append(json.dumps({"from": copy_from, "to": copy_to}))
+            if len(self.buffer) >= self.batch_size:
+                self.write_buffer()
+
+    def write_buffer(self):
+        """
+        Write buffered entries to disk. The lock must be held
+        """
+        if not len(self.buffer):
+            return
+        self.fd.write("\n".join(self.buffer) + "\n")
+        self.fd.flush()
+        os.fsync(self.fd.fileno())
+        self.logger.debug("%s entries flushed to journal" % len(self.buffer))
+        self.buffer = []
+
+    def flush(self):
+        """
+        Write buffered entries to disk
+        """
+        with self.lock:
+            self.write_buffer()
+
+    def close(self):
+        """
+        Flush buffered entries and close the journal file
+        """
+        with self.lock:
+            self.write_buffer()
+            self.fd.close()
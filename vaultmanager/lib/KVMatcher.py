@@ -0,0 +1,177 @@
+import re
+import json
+
+
+class KVMatcher:
+    """
+    Compiled matcher of several search terms
+
+    Literal terms are compiled into an Aho-Corasick automaton, so a text is
+    scanned once whatever the number of terms. Terms can also be regular
+    expressions, and matching can ignore case. Matchers only hold plain
+    data so they can be sent to worker processes
+    """
+    terms = None
+    regex = None
+    ignore_case = None
+    patterns = None
+    goto = None
+    fail = None
+    output = None
+    always = None
+    worker_matcher = None
+
+    def __init__(self, terms, regex=False, ignore_case=False):
+        """
+        :param terms: search terms, duplicates are ignored
+        :type terms: list(str)
+        :param regex: terms are regular expressions
+        :type regex: bool
+        :param ignore_case: ignore case when matching
+        :type ignore_case: bool
+        """
+        self.terms = []
+        for term in terms:
+            if term not in self.terms:
+                self.terms.append(term)
+        self.regex = regex
+        self.ignore_case = ignore_case
+        if regex:
+            flags = re.IGNORECASE if ignore_case else 0
+            self.patterns = []
+            for term in self.terms:
+                try:
+                    self.patterns.append(re.compile(term, flags))
+                except re.error as e:
+                    raise ValueError("Invalid regular expression '%s': %s" %
+                                     (term, str(e)))
+        else:
+            self.build_automaton()
+
+    def build_automaton(self):
+        """
+        Build the Aho-Corasick automaton of literal terms: a trie of terms
+        with failure links to the longest proper suffix also in the trie
+        """
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        self.always = []
+        for index, term in enumerate(self.terms):
+            if self.ignore_case:
+                term = term.lower()
+            if not len(term):
+                # an empty term is found in every text
+                self.always.append(index)
+                continue
+            state = 0
+            for char in term:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append(index)
+        # breadth first, so failure links of shorter prefixes are known
+        to_visit = list(self.goto[0].values())
+        while len(to_visit):
+            state = to_visit.pop(0)
+            for char, child in self.goto[state].items():
+                to_visit.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                if self.fail[child] == child:
+                    self.fail[child] = 0
+                self.output[child] = \
+                    self.output[child] + self.output[self.fail[child]]
+
+    def match(self, text):
+        """
+        Return indexes of terms found in a text
+
+        :param text: text to search in
+        :type text: str
+
+        :return: set(int)
+        """
+        if self.regex:
+            return set(index for index, pattern in enumerate(self.patterns)
+                       if pattern.search(text))
+        if self.ignore_case:
+            text = text.lower()
+        found = set(self.always)
+        state = 0
+        for char in text:
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            if self.output[state]:
+                found.update(self.output[state])
+                if len(found) == len(self.terms):
+                    break
+        return found
+
+    def match_secrets(self, secrets, scope="all"):
+        """
+        Search terms in secrets
+
+        With the 'all' scope, terms are searched in 'path/key' and values
+        of secrets, with 'keys' in key names only and with 'paths' in
+        secrets paths only, secrets contents being ignored
+
+        :param secrets: secrets paths and contents
+        :type secrets: list(tuple(str, dict))
+        :param scope: 'all', 'keys' or 'paths'
+        :type scope: str
+
+        :return: list(tuple(str, list(str))) 'path/key' of matches, or
+                 'path' with the 'paths' scope, with the terms found
+        """
+        matches = []
+        for path, secret in secrets:
+            if scope == "paths":
+                found = self.match(path)
+                if len(found):
+                    matches.append(
+                        (path, [self.terms[i] for i in sorted(found)])
+                    )
+                continue
+            for key in secret:
+                if scope == "keys":
+                    found = self.match(key)
+                else:
+                    value = secret[key]
+                    if not isinstance(value, str):
+                        value = json.dumps(value, sort_keys=True)
+                    found = self.match(path + "/" + key) | self.match(value)
+                if len(found):
+                    matches.append((path + "/" + key,
+                                    [self.terms[i] for i in sorted(found)]))
+        return matches
+
+    @staticmethod
+    def init_worker(matcher):
+        """
+        Worker process initializer keeping the matcher of the process
+
+        :param matcher: matcher used by match_in_worker
+        :type matcher: KVMatcher
+        """
+        KVMatcher.worker_matcher = matcher
+
+    @staticmethod
+    def match_in_worker(secrets, scope="all"):
+        """
+        Search terms in secrets with the matcher of the worker process
+
+        :param secrets: secrets paths and contents
+        :type secrets: list(tuple(str, dict))
+        :param scope: 'all', 'keys' or 'paths'
+        :type scope: str
+
+        :return: list(tuple(str, list(str)))
+        """
+        return KVMatcher.worker_matcher.match_secrets(secrets, scope)
@@ -0,0 +1,197 @@
+import queue
+import logging
+import threading
+
+
+class KVPipeline:
+    """
+    Streaming pipeline moving secrets from a source to a target
+
+    A walker thread produces secrets paths, reader threads read them and
+    writer threads write them. Stages are connected by bounded queues so the
+    memory used doesn't depend on the size of the tree and writes start as
+    soon as the first secret is read. The first error stops all stages
+    """
+    logger = None
+    readers = None
+    writers = None
+    queue_size = None
+    stop = None
+    errors = None
+    counts = None
+    counts_lock = None
+    done = object()
+
+    def __init__(self, base_logger=None, readers=1, writers=1,
+                 queue_size=100):
+        """
+        :param base_logger: main class name
+        :type base_logger: string
+        :param readers: number of reader threads
+        :type readers: int
+        :param writers: number of writer threads
+        :type writers: int
+        :param queue_size: maximum number of items waiting between stages
+        :type queue_size: int
+        """
+        if base_logger:
+            self.logger = logging.getLogger(
+                base_logger + "." + self.__class__.__name__
+            )
+        else:
+            self.logger = logging.getLogger()
+        self.readers = readers
+        self.writers = writers
+        self.queue_size = queue_size
+
+    def put(self, to_queue, item):
+        """
+        Put an item in a queue, giving up if the pipeline is stopped
+
+        :param to_queue: queue to fill
+        :type to_queue: queue.Queue
+        :param item: item to put
+        :type item: object
+
+        :return: bool
+        """
+        while not self.stop.is_set():
+            try:
+                to_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(self, from_queue):
+        """
+        Get an item from a queue, returning done if the pipeline is stopped
+
+        :param from_queue: queue to consume
+        :type from_queue: queue.Queue
+
+        :return: object
+        """
+        while not self.stop.is_set():
+            try:
+                return from_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return self.done
+
+    def guard(self, stage, *args):
+        """
+        Run a stage, stopping the pipeline if it fails
+
+        :param stage: stage function
+        :type stage: function
+        """
+        try:
+            stage(*args)
+        except Exception as e:
+            self.logger.debug("Pipeline stopped: %s" % str(e))
+            self.errors.append(e)
+            self.stop.set()
+
+    def walk(self, paths, paths_queue):
+        """
+        Walker stage: feed readers with paths
+
+        :param paths: paths to process
+        :type paths: iterable(str)
+        :param paths_queue: queue consumed by readers
+        :type paths_queue: queue.Queue
+        """
+        try:
+            for path in paths:
+                if not self.put(paths_queue, path):
+                    return
+        finally:
+            for _ in range(self.readers):
+                self.put(paths_queue, self.done)
+
+    def read(self, paths_queue, secrets_queue, read_function):
+        """
+        Reader stage: read secrets and feed writers
+
+        :param paths_queue: queue of paths to read
+        :type paths_queue: queue.Queue
+        :param secrets_queue: queue consumed by writers
+        :type secrets_queue: queue.Queue
+        :param read_function: function returning the secret of a path
+        :type read_function: function
+        """
+        while True:
+            path = self.get(paths_queue)
+            if path is self.done:
+                return
+            if not self.put(secrets_queue, (path, read_function(path))):
+                return
+
+    def write(self, secrets_queue, write_function):
+        """
+        Writer stage: write secrets and count results
+
+        :param secrets_queue: queue of (path, secret) to write
+        :type secrets_queue: queue.Queue
+        :param write_function: function writing a secret and returning the
+                               name of the counter to increment
+        :type write_function: function
+        """
+        while True:
+            item = self.get(secrets_queue)
+            if item is self.done:
+                return
+            counter = write_function(*item)
+            with self.counts_lock:
+                self.counts[counter] = self.counts.get(counter, 0) + 1
+
+    def run(self, paths, read_function, write_function):
+        """
+        Run the pipeline until all paths are processed or a stage fails.
+        The first error is raised once all stages are stopped
+
+        :param paths: paths to process
+        :type paths: iterable(str)
+        :param read_function: function returning the secret of a path
+        :type read_function: function
+        :param write_function: function writing a secret and returning the
+                               name of the counter to increment
+        :type write_function: function
+
+        :return: dict of counters
+        """
+        self.logger.debug("Starting pipeline with %s readers and %s writers" %
+                          (self.readers, self.writers))
+        self.stop = threading.Event()
+        self.errors = []
+        self.counts = {}
+        self.counts_lock = threading.Lock()
+        paths_queue = queue.Queue(self.queue_size)
+        secrets_queue = queue.Queue(self.queue_size)
+        walker = threading.Thread(target=self.guard,
+                                  args=(self.walk, paths, paths_queue),
+                                  daemon=True)
+        readers = [threading.Thread(target=self.guard,
+                                    args=(self.read, paths_queue,
+                                          secrets_queue, read_function),
+                                    daemon=True)
+                   for _ in range(self.readers)]
+        writers = [threading.Thread(target=self.guard,
+                                    args=(self.write, secrets_queue,
+                                          write_function),
+                                    daemon=True)
+                   for _ in range(self.writers)]
+        for thread in [walker] + readers + writers:
+            thread.start()
+        walker.join()
+        for reader in readers:
+            reader.join()
+        for _ in range(self.writers):
+            self.put(secrets_queue, self.done)
+        for writer in writers:
+            writer.join()
+        if len(self.errors):
+            raise self.errors[0]
+        self.logger.debug("Pipeline done: %s" % self.counts)
+        return self.counts
@@ -0,0 +1,83 @@
+import json
+import logging
+import threading
+
+try:
+    import lib.utils as utils
+except ImportError:
+    import vaultmanager.lib.utils as utils
+
+
+class KVRecordWriter:
+    """
+    Write results as newline delimited JSON, one record per line
+
+    Records are logged and written to the output file as soon as they are
+    produced, so consumers can start before the command ends and memory
+    doesn't depend on the size of the result
+    """
+    logger = None
+    output_file = None
+    fd = None
+    lock = None
+    records_count = 0
+
+    def __init__(self, base_logger=None, output_file=None):
+        """
+        :param base_logger: main class name
+        :type base_logger: string
+        :param output_file: file records are also written to, gzip
+                            compressed if its name ends with '.gz'
+        :type output_file: str
+        """
+        if base_logger:
+            self.logger = logging.getLogger(
+                base_logger + "." + self.__class__.__name__
+            )
+        else:
+            self.logger = logging.getLogger()
+        self.output_file = output_file
+        self.lock = threading.Lock()
+        if output_file:
+            self.logger.debug("Writing records to '%s'" % output_file)
+            self.fd = utils.open_file(output_file, "w")
+
+    def write(self, record):
+        """
+        Write a record
+
+        :param record: JSON serializable record
+        :type record: dict
+        """
+        line = json.dumps(record, separators=(",", ":"), default=list)
+        with self.lock:
+            self.logger.info(line)
+            if self.fd:
+                self.fd.write(line + "\n")
+            self.records_count += 1
+
+    def write_result(self, result):
+        """
+        Write each entry of a complete result as a record
+
+        :param result: command result
+        :type result: dict or list
+        """
+        if isinstance(result, list):
+            for item in result:
+                self.write({"value": item})
+            return
+        for key in result:
+            if key in ["__truncated__", "__candidates__"]:
+                self.write({key: result[key]})
+            else:
+                self.write({"key": key, "value": result[key]})
+
+    def close(self):
+        """
+        Close the output file
+        """
+        self.logger.debug("%s records written" % self.records_count)
+        if self.fd:
+            self.fd.close()
+            self.fd = None
@@ -0,0 +1,134 @@
+import logging
+import multiprocessing
+import concurrent.futures
+
+try:
+    from lib.KVMatcher import KVMatcher
+except ImportError:
+    from vaultmanager.lib.KVMatcher import KVMatcher
+
+
+class KVSearchPool:
+    """
+    Match secrets by batches on a pool of processes
+
+    Secrets are buffered until a batch is full and batches are matched by
+    worker processes. The number of batches waiting for a process is
+    bounded so memory doesn't depend on the number of secrets.
+    Worker processes are spawned instead of forked, so they don't inherit
+    locks held by the threads reading secrets
+    """
+    logger = None
+    matcher = None
+    scope = None
+    processes = None
+    batch_size = None
+    pool = None
+    batch = None
+    pending = None
+    found = None
+    on_match = None
+
+    def __init__(self, base_logger=None, matcher=None, scope="all",
+                 processes=1, batch_size=500, on_match=None):
+        """
+        :param base_logger: main class name
+        :type base_logger: string
+        :param matcher: compiled search terms
+        :type matcher: KVMatcher
+        :param scope: 'all', 'keys' or 'paths'
+        :type scope: str
+        :param processes: number of matching processes, secrets are matched
+                          in the calling thread if 1
+        :type processes: int
+        :param batch_size: number of secrets matched at once
+        :type batch_size: int
+        :param on_match: function called with each match and its terms as
+                         soon as its batch is matched, matches are not kept
+        :type on_match: function
+        """
+        if base_logger:
+            self.logger = logging.getLogger(
+                base_logger + "." + self.__class__.__name__
+            )
+        else:
+            self.logger = logging.getLogger()
+        self.matcher = matcher
+        self.scope = scope
+        self.processes = processes
+        self.batch_size = batch_size
+        self.batch = []
+        self.pending = []
+        self.found = {}
+        self.on_match = on_match
+        if processes > 1:
+            self.logger.debug("Matching on %s processes" % processes)
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                processes, mp_context=multiprocessing.get_context("spawn"),
+                initializer=KVMatcher.init_worker, initargs=(matcher,)
+            )
+
+    def add_matches(self, matches):
+        """
+        Record matches of a batch
+
+        :param matches: 'path/key' or 'path' with the terms found
+        :type matches: list(tuple(str, list(str)))
+        """
+        for full_path, terms in matches:
+            if self.on_match:
+                self.on_match(full_path, terms)
+                continue
+            self.found.setdefault(full_path, set()).update(terms)
+
+    def submit_batch(self):
+        """
+        Match the current batch
+        """
+        if not len(self.batch):
+            return
+        if self.pool is None:
+            self.add_matches(self.matcher.match_secrets(self.batch,
+                                                        self.scope))
+        else:
+            self.pending.append(self.pool.submit(KVMatcher.match_in_worker,
+                                                 self.batch, self.scope))
+            # bound the number of batches waiting for a process
+            while len(self.pending) > 2 * self.processes:
+                self.add_matches(self.pending.pop(0).result())
+        self.batch = []
+
+    def add(self, path, secret):
+        """
+        Add a secret to match
+
+        :param path: secret path
+        :type path: str
+        :param secret: secret content, ignored with the 'paths' scope
+        :type secret: dict
+        """
+        self.batch.append((path, secret))
+        if len(self.batch) >= self.batch_size:
+            self.submit_batch()
+
+    def results(self):
+        """
+        Match remaining secrets and return all matches
+
+        :return: dict of matched 'path/key', or 'path' with the 'paths'
+                 scope, with the terms found in terms order
+        """
+        self.submit_batch()
+        for future in self.pending:
+            self.add_matches(future.result())
+        self.pending = []
+        return {full_path: [term for term in self.matcher.terms
+                            if term in self.found[full_path]]
+                for full_path in sorted(self.found)}
+
+    def close(self):
+        """
+        Stop worker processes
+        """
+        if self.pool is not None:
+            self.pool.shutdown()
@@ -0,0 +1,64 @@
+import hashlib
+
+
+class KVShard:
+    """
+    Deterministic partition of secrets trees between several runs
+
+    Subtrees found at a given depth under each walked path are assigned to a
+    shard using a stable hash of their path, so N runs with shards 0/N to
+    N-1/N list and read each secret exactly once
+    """
+    index = None
+    count = None
+    depth = None
+
+    def __init__(self, index, count, depth=1):
+        """
+        :param index: index of this shard, from 0 to count - 1
+        :type index: int
+        :param count: total number of shards
+        :type count: int
+        :param depth: depth of the subtrees which are partitioned
+        :type depth: int
+        """
+        if count < 1 or not 0 <= index < count:
+            raise ValueError("Invalid shard %s/%s" % (index, count))
+        if depth < 1:
+            raise ValueError("Shard depth must be greater than 0")
+        self.index = index
+        self.count = count
+        self.depth = depth
+
+    @classmethod
+    def from_string(cls, shard, depth=1):
+        """
+        Create a shard from its 'INDEX/COUNT' representation
+
+        :param shard: shard as 'INDEX/COUNT'
+        :type shard: str
+        :param depth: depth of the subtrees which are partitioned
+        :type depth: int
+
+        :return: KVShard
+        """
+        try:
+            index, count = [int(elem) for elem in shard.split("/")]
+        except ValueError:
+            raise ValueError("Shard '%s' should be INDEX/COUNT" % shard)
+        return cls(index, count, depth)
+
+    def owns(self, path):
+        """
+        Check if a subtree belongs to this shard
+
+        :param path: normalized subtree path
+        :type path: str
+
+        :return: bool
+        """
+        digest = hashlib.sha1(path.encode()).digest()
+        return int.from_bytes(digest[:8], "big") % self.count == self.index
+
+    def __repr__(self):
+        return "%s/%s" % (self.index, self.count)
@@ -0,0 +1,345 @@
+import os
+import hmac
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+
+
+class KVSnapshot:
+    """
+    Local SQLite index of a Vault K/V tree
+
+    Only paths, key names, keyed digests and sizes of values are stored,
+    never the values themselves nor the digest key
+    """
+    logger = None
+    snapshot_file = None
+    connection = None
+    digest_key = None
+    batch_size = 1000
+
+    def __init__(self, base_logger=None, snapshot_file=None):
+        """
+        :param base_logger: main class name
+        :type base_logger: string
+        :param snapshot_file: path of the SQLite snapshot file
+        :type snapshot_file: str
+        """
+        if base_logger:
+            self.logger = logging.getLogger(
+                base_logger + "." + self.__class__.__name__
+            )
+        else:
+            self.logger = logging.getLogger()
+        self.snapshot_file = snapshot_file
+        self.logger.debug("Instantiating KVSnapshot class")
+
+    def create(self, vault_addr, roots, excluded, digest_key=None):
+        """
+        Create a new empty snapshot. An existing file will be overwritten
+
+        :param vault_addr: Vault instance URL the snapshot is taken from
+        :type vault_addr: str
+        :param roots: Paths stored in the snapshot
+        :type roots: list(str)
+        :param excluded: Paths excluded from the snapshot
+        :type excluded: list(str)
+        :param digest_key: key of the values digests, a random key only
+                           used for this snapshot if None
+        :type digest_key: bytes
+        """
+        self.logger.debug("Creating snapshot '%s'" % self.snapshot_file)
+        if os.path.isfile(self.snapshot_file):
+            self.logger.debug("Removing previous snapshot")
+            os.remove(self.snapshot_file)
+        self.connection = sqlite3.connect(self.snapshot_file)
+        self.connection.executescript("""
+            CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE secrets (path TEXT PRIMARY KEY);
+            CREATE TABLE kv (
+                path TEXT NOT NULL,
+                key TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL
+            );
+        """)
+        # the key is never stored with the digests, it would allow to
+        # brute force low entropy values from the snapshot file
+        self.digest_key = digest_key or os.urandom(32)
+        self.connection.executemany(
+            "INSERT INTO meta (name, value) VALUES (?, ?)",
+            [("vault_addr", vault_addr),
+             ("created", str(int(time.time()))),
+             ("roots", json.dumps([self.normalize(r) for r in roots])),
+             ("excluded", json.dumps(excluded))]
+        )
+        self.connection.commit()
+
+    def open(self):
+        """
+        Open an existing snapshot
+        """
+        self.logger.debug("Opening snapshot '%s'" % self.snapshot_file)
+        if not os.path.isfile(self.snapshot_file):
+            raise ValueError("Snapshot file '%s' doesn't exist" %
+                             self.snapshot_file)
+        self.connection = sqlite3.connect(self.snapshot_file)
+
+    def close(self):
+        """
+        Close the snapshot
+        """
+        if self.connection:
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+    def finalize(self):
+        """
+        Build the snapshot indexes once all secrets have been inserted
+        """
+        self.logger.debug("Building snapshot indexes")
+        self.connection.executescript("""
+            CREATE INDEX IF NOT EXISTS kv_path ON kv (path);
+            CREATE INDEX IF NOT EXISTS kv_digest ON kv (digest);
+        """)
+        self.connection.commit()
+
+    def get_meta(self, name):
+        """
+        Return a snapshot metadata value
+
+        :param name: metadata name
+        :type name: str
+
+        :return: str
+        """
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE name = ?", (name,)
+        ).fetchone()
+        if not row:
+            raise ValueError("Snapshot '%s' is not valid: '%s' is missing" %
+                             (self.snapshot_file, name))
+        return row[0]
+
+    @staticmethod
+    def normalize(path):
+        """
+        Remove leading, trailing and duplicated slashes from a path
+
+        :param path: path to normalize
+        :type path: str
+
+        :return: str
+        """
+        return path.replace("//", "/").strip("/")
+
+    def digest(self, value):
+        """
+        Return the keyed digest and the size of a secret value
+
+        :param value: secret value
+        :type value: str or object
+
+        :return: tuple(str, int)
+        """
+        if not isinstance(value, str):
+            value = json.dumps(value, sort_keys=True)
+        encoded = value.encode()
+        return (hmac.new(self.digest_key, encoded, hashlib.sha256).hexdigest(),
+                len(encoded))
+
+    def insert(self, secrets):
+        """
+        Bulk insert secrets in the snapshot
+
+        :param secrets: secrets to insert as a list of (path, secret)
+        :type secrets: list(tuple(str, dict))
+        """
+        self.logger.debug("Inserting %s secrets in snapshot" % len(secrets))
+        kv_rows = []
+        for path, secret in secrets:
+            for key in secret:
+                digest, size = self.digest(secret[key])
+                kv_rows.append((path, key, digest, size))
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO secrets (path) VALUES (?)",
+                [(path,) for path, secret in secrets]
+            )
+            self.connection.executemany(
+                "INSERT INTO kv (path, key, digest, size) VALUES (?, ?, ?, ?)",
+                kv_rows
+            )
+
+    def check_covered(self, path):
+        """
+        Log a warning if path is not under a root stored in the snapshot
+
+        :param path: path to check
+        :type path: str
+        """
+        path = self.normalize(path)
+        for root in json.loads(self.get_meta("roots")):
+            if path == root or path.startswith(root + "/") or not root:
+                return
+        self.logger.warning("'%s' is not covered by snapshot '%s'" %
+                            (path, self.snapshot_file))
+
+    @staticmethod
+    def prefix_range(prefix):
+        """
+        Return the [low, high[ string range of all strings starting with prefix
+
+        :param prefix: string prefix
+        :type prefix: str
+
+        :return: tuple(str, str)
+        """
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    def where_under(self, path, excluded, column="path"):
+        """
+        Build the SQL condition selecting rows at and under path
+        and not under any excluded path
+
+        :param path: root path
+        :type path: str
+        :param excluded: paths to exclude
+        :type excluded: list(str)
+        :param column: SQL column holding the secret path
+        :type column: str
+
+        :return: tuple(str, list)
+        """
+        path = self.normalize(path)
+        if path:
+            low, high = self.prefix_range(path + "/")
+            clauses = ["(%s = ? OR (%s >= ? AND %s < ?))" %
+                       (column, column, column)]
+            params = [path, low, high]
+        else:
+            clauses = ["1"]
+            params = []
+        for exc in excluded:
+            if not exc:
+                continue
+            low, high = self.prefix_range(exc)
+            clauses.append("NOT (%s >= ? AND %s < ?)" % (column, column))
+            params += [low, high]
+        return " AND ".join(clauses), params
+
+    def count(self, path, excluded=[]):
+        """
+        Count secrets and values under path
+
+        :param path: root path
+        :type path: str
+        :param excluded: paths to exclude
+        :type excluded: list(str)
+
+        :return: dict
+        """
+        self.check_covered(path)
+        where, params = self.where_under(path, excluded)
+        secrets_count = self.connection.execute(
+            "SELECT COUNT(*) FROM secrets WHERE " + where, params
+        ).fetchone()[0]
+        values_count = self.connection.execute(
+            "SELECT COUNT(*) FROM kv WHERE " + where, params
+        ).fetchone()[0]
+        return {"secrets_count": secrets_count, "values_count": values_count}
+
+    def tree(self, path, excluded=[]):
+        """
+        List secrets under path
+
+        :param path: root path
+        :type path: str
+        :param excluded: paths to exclude
+        :type excluded: list(str)
+
+        :return: list(str)
+        """
+        self.check_covered(path)
+        where, params = self.where_under(path, excluded)
+        return [row[0] for row in self.connection.execute(
+            "SELECT path FROM secrets WHERE " + where + " ORDER BY path",
+            params
+        )]
+
+    def search(self, matcher, paths, excluded=[], scope="all"):
+        """
+        Search values in secrets paths and key names under paths
+
+        :param matcher: compiled values to search
+        :type matcher: KVMatcher
+        :param paths: paths to search in
+        :type paths: list(str)
+        :param excluded: paths to exclude
+        :type excluded: list(str)
+        :param scope: search in 'path/key' with 'all', in key names only
+                      with 'keys' and in secrets paths only with 'paths'
+        :type scope: str
+
+        :return: dict of matched 'path/key', or 'path' with the 'paths'
+                 scope, with the values found
+        """
+        found = {}
+        for path in paths:
+            self.check_covered(path)
+            where, params = self.where_under(path, excluded)
+            for row in self.connection.execute(
+                    "SELECT DISTINCT path, key FROM kv WHERE " + where,
+                    params):
+                if scope == "paths":
+                    full_path = row[0]
+                    terms = matcher.match(row[0])
+                elif scope == "keys":
+                    full_path = row[0] + "/" + row[1]
+                    terms = matcher.match(row[1])
+                else:
+                    full_path = row[0] + "/" + row[1]
+                    terms = matcher.match(full_path)
+                if len(terms):
+                    found.setdefault(full_path, set()).update(terms)
+        return {full_path: [matcher.terms[i] for i in sorted(found[full_path])]
+                for full_path in sorted(found)}
+
+    def find_duplicates(self, paths, excluded=[]):
+        """
+        Find values having the same digest under paths
+
+        :param paths: paths to look for duplicates
+        :type paths: list(str)
+        :param excluded: paths to exclude
+        :type excluded: list(str)
+
+        :return: dict
+        """
+        clauses = []
+        params = []
+        for path in paths:
+            self.check_covered(path)
+            where, where_params = self.where_under(path, excluded)
+            clauses.append("(" + where + ")")
+            params += where_params
+        where = " OR ".join(clauses) if clauses else "0"
+        grouped_duplicates = {}
+        dup_counter = 0
+        current_digest = None
+        for digest, path, key in self.connection.execute(
+                "SELECT digest, path, key FROM kv WHERE digest IN ("
+                " SELECT digest FROM kv WHERE " + where +
+                " GROUP BY digest HAVING COUNT(*) > 1"
+                ") AND (" + where + ") ORDER BY digest, path, key",
+                params + params):
+            if digest != current_digest:
+                if current_digest is not None:
+                    dup_counter += 1
+                current_digest = digest
+                grouped_duplicates[dup_counter] = []
+            grouped_duplicates[dup_counter].append(path + ":" + key)
+        return grouped_duplicates
@@ -0,0 +1,222 @@
+import json
+import heapq
+from array import array
+
+
+class KVStats:
+    """
+    Statistics of the secrets under a path: counts and sizes by subtree,
+    depth histogram, key names frequencies and largest secrets and folders
+
+    Folders totals are kept in arrays indexed by folder id and the largest
+    secrets in a heap bounded to top entries, so only a few integers are
+    kept by folder and nothing by secret
+    """
+    root = None
+    subtree_depth = None
+    top = None
+    secrets_count = 0
+    values_count = 0
+    bytes = 0
+    depths = None
+    folder_ids = None
+    folder_secrets = None
+    folder_bytes = None
+    key_names = None
+    largest = None
+
+    def __init__(self, root, subtree_depth=1, top=10):
+        """
+        :param root: normalized path statistics are computed under
+        :type root: str
+        :param subtree_depth: depth of the subtrees reported under root
+        :type subtree_depth: int
+        :param top: number of largest secrets, folders and most frequent
+                    key names reported
+        :type top: int
+        """
+        self.root = root
+        self.subtree_depth = subtree_depth
+        self.top = top
+        self.depths = array('Q')
+        self.folder_ids = {}
+        self.folder_secrets = array('Q')
+        self.folder_bytes = array('Q')
+        self.key_names = {}
+        self.largest = []
+
+    @staticmethod
+    def secret_size(secret):
+        """
+        Return the size in bytes of a secret encoded as compact JSON
+
+        :param secret: secret content
+        :type secret: dict
+
+        :return: int
+        """
+        return len(json.dumps(secret, sort_keys=True,
+                              separators=(",", ":")).encode())
+
+    def add_to_folder(self, folder, size):
+        """
+        Add a secret to the totals of a folder
+
+        :param folder: folder path
+        :type folder: str
+        :param size: secret size
+        :type size: int
+        """
+        if folder not in self.folder_ids:
+            self.folder_ids[folder] = len(self.folder_secrets)
+            self.folder_secrets.append(0)
+            self.folder_bytes.append(0)
+        folder_id = self.folder_ids[folder]
+        self.folder_secrets[folder_id] += 1
+        self.folder_bytes[folder_id] += size
+
+    def add(self, secret_path, size, keys):
+        """
+        Add a secret to the statistics
+
+        :param secret_path: normalized secret path, under root
+        :type secret_path: str
+        :param size: secret size in bytes
+        :type size: int
+        :param keys: secret key names
+        :type keys: list(str)
+        """
+        segments = secret_path[len(self.root):].strip("/").split("/")
+        self.secrets_count += 1
+        self.values_count += len(keys)
+        self.bytes += size
+        while len(self.depths) <= len(segments):
+            self.depths.append(0)
+        self.depths[len(segments)] += 1
+        # the secret counts in every folder between root and the secret
+        folder = self.root
+        for segment in segments[:-1]:
+            folder = folder + "/" + segment if folder else segment
+            self.add_to_folder(folder, size)
+        for key in keys:
+            self.key_names[key] = self.key_names.get(key, 0) + 1
+        if len(self.largest) < self.top:
+            heapq.heappush(self.largest, (size, secret_path))
+        else:
+            heapq.heappushpop(self.largest, (size, secret_path))
+
+    def folder_depth(self, folder):
+        """
+        Return the number of segments of a folder under root
+
+        :param folder: folder path
+        :type folder: str
+
+        :return: int
+        """
+        return len(folder[len(self.root):].strip("/").split("/"))
+
+    def result(self):
+        """
+        Return the statistics
+
+        :return: dict
+        """
+        folders = sorted(self.folder_ids)
+        subtrees = {}
+        for folder in folders:
+            if self.folder_depth(folder) == self.subtree_depth:
+                folder_id = self.folder_ids[folder]
+                subtrees[folder] = {
+                    "secrets_count": self.folder_secrets[folder_id],
+                    "bytes": self.folder_bytes[folder_id]
+                }
+        largest_folders = heapq.nlargest(
+            self.top, folders,
+            key=lambda f: self.folder_bytes[self.folder_ids[f]]
+        )
+        key_names = heapq.nlargest(self.top, sorted(self.key_names),
+                                   key=lambda k: self.key_names[k])
+        return {
+            "secrets_count": self.secrets_count,
+            "values_count": self.values_count,
+            "bytes": self.bytes,
+            "subtrees": subtrees,
+            "depths": {str(depth): self.depths[depth]
+                       for depth in range(len(self.depths))
+                       if self.depths[depth]},
+            "key_names_count": len(self.key_names),
+            "key_names": {key: self.key_names[key] for key in key_names},
+            "largest_secrets": [
+                {"path": path, "bytes": size}
+                for size, path in sorted(self.largest,
+                                         key=lambda e: (-e[0], e[1]))
+            ],
+            "largest_folders": [
+                {"path": folder,
+                 "secrets_count": self.folder_secrets[self.folder_ids[folder]],
+                 "bytes": self.folder_bytes[self.folder_ids[folder]]}
+                for folder in largest_folders
+            ]
+        }
+
+    @staticmethod
+    def table_lines(headers, rows):
+        """
+        Return the lines of a text table, numbers being right aligned
+
+        :param headers: columns names
+        :type headers: list(str)
+        :param rows: table rows
+        :type rows: list(list)
+
+        :return: list(str)
+        """
+        widths = [max([len(str(cell)) for cell in column])
+                  for column in zip(headers, *rows)]
+        lines = []
+        for row in [headers] + rows:
+            cells = []
+            for index, cell in enumerate(row):
+                if isinstance(cell, int):
+                    cells.append(str(cell).rjust(widths[index]))
+                else:
+                    cells.append(str(cell).ljust(widths[index]))
+            lines.append("  ".join(cells).rstrip())
+        return lines
+
+    @staticmethod
+    def format_table(path, stats):
+        """
+        Return statistics as human readable tables
+
+        :param path: requested path
+        :type path: str
+        :param stats: statistics returned by result
+        :type stats: dict
+
+        :return: str
+        """
+        lines = ["%s: %s secrets, %s values, %s bytes" %
+                 (path, stats["secrets_count"], stats["values_count"],
+                  stats["bytes"]), ""]
+        sections = [
+            (["Subtree", "Secrets", "Bytes"],
+             [[folder, values["secrets_count"], values["bytes"]]
+              for folder, values in stats["subtrees"].items()]),
+            (["Depth", "Secrets"],
+             [[int(depth), count] for depth, count in stats["depths"].items()]),
+            (["Key name", "Secrets"],
+             [[key, count] for key, count in stats["key_names"].items()]),
+            (["Largest secret", "Bytes"],
+             [[entry["path"], entry["bytes"]]
+              for entry in stats["largest_secrets"]]),
+            (["Largest folder", "Secrets", "Bytes"],
+             [[entry["path"], entry["secrets_count"], entry["bytes"]]
+              for entry in stats["largest_folders"]])
+        ]
+        for headers, rows in sections:
+            if not len(rows):
+                continue
+            lines += KVStats.table_lines(headers, rows) + [""]
+        return "\n".join(lines).rstrip()
@@ -0,0 +1,152 @@
+import hashlib
+
+
+class MerkleTree:
+    """
+    Merkle hashes of a secrets tree
+
+    Leaves are secrets paths relative to the tree root with the digest of
+    their content. Each folder hash is computed from the names and hashes of
+    its children, so two trees are identical if their root hashes are equal
+    and comparing them only needs to descend into folders whose hashes
+    differ. Folders paths end with '/', the root folder being ''
+    """
+    leaves = None
+    hashes = None
+    children = None
+
+    def __init__(self, leaves=None):
+        """
+        :param leaves: digests by relative secret path
+        :type leaves: dict
+        """
+        self.leaves = {}
+        if leaves:
+            self.leaves.update(leaves)
+        self.hashes = None
+        self.children = None
+
+    @staticmethod
+    def hash(*parts):
+        """
+        Hash several strings, unambiguously separated
+
+        :param parts: strings to hash
+        :type parts: str
+
+        :return: str
+        """
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def add(self, path, digest):
+        """
+        Add a secret to the tree
+
+        :param path: secret path relative to the tree root
+        :type path: str
+        :param digest: digest of the secret content
+        :type digest: str
+        """
+        self.leaves[path] = digest
+        self.hashes = None
+
+    def remove_under(self, node):
+        """
+        Remove all secrets at or under a node
+
+        :param node: secret or folder path
+        :type node: str
+        """
+        for path in self.leaves_under(node):
+            del self.leaves[path]
+        self.hashes = None
+
+    def leaves_under(self, node):
+        """
+        Return secrets at or under a node
+
+        :param node: secret or folder path
+        :type node: str
+
+        :return: list(str)
+        """
+        if not node.endswith("/") and node:
+            return [node] if node in self.leaves else []
+        return sorted(path for path in self.leaves if path.startswith(node))
+
+    def compute(self):
+        """
+        Compute hashes of all folders, from the deepest to the root
+        """
+        self.children = {"": {}}
+        self.hashes = {}
+        for path, digest in self.leaves.items():
+            self.hashes[path] = self.hash(path.rsplit("/", 1)[-1], digest)
+            folder = ""
+            segments = path.split("/")
+            for segment in segments[:-1]:
+                self.children.setdefault(folder, {})[segment + "/"] = True
+                folder += segment + "/"
+            self.children.setdefault(folder, {})[segments[-1]] = True
+        for folder in sorted(self.children, key=lambda f: -f.count("/")):
+            self.hashes[folder] = self.hash(*[
+                name + "=" + self.hashes[folder + name]
+                for name in sorted(self.children[folder])
+            ])
+
+    def node_hash(self, node):
+        """
+        Return the hash of a secret or folder, None if it doesn't exist
+
+        :param node: secret or folder path
+        :type node: str
+
+        :return: str or None
+        """
+        if self.hashes is None:
+            self.compute()
+        return self.hashes.get(node)
+
+    def diff(self, other):
+        """
+        Compare this tree with another one, descending only into folders
+        whose hashes differ
+
+        :param other: tree to compare with
+        :type other: MerkleTree
+
+        :return: dict of 'added', 'removed' and 'changed' secrets in other,
+                 and 'differing' topmost nodes which are not identical
+        """
+        if self.hashes is None:
+            self.compute()
+        if other.hashes is None:
+            other.compute()
+        result = {"added": [], "removed": [], "changed": [], "differing": []}
+        to_visit = [""]
+        while len(to_visit):
+            folder = to_visit.pop()
+            if self.node_hash(folder) == other.node_hash(folder):
+                continue
+            names = set(self.children.get(folder, {})) | \
+                set(other.children.get(folder, {}))
+            for name in sorted(names):
+                node = folder + name
+                mine = self.node_hash(node)
+                theirs = other.node_hash(node)
+                if mine == theirs:
+                    continue
+                if mine is None:
+                    result["added"] += other.leaves_under(node)
+                    result["differing"].append(node)
+                elif theirs is None:
+                    result["removed"] += self.leaves_under(node)
+                    result["differing"].append(node)
+                elif name.endswith("/"):
+                    to_visit.append(node)
+                else:
+                    result["changed"].append(node)
+                    result["differing"].append(node)
+        for key in result:
+            result[key].sort()
+        return result
@@ -0,0 +1,150 @@
+from fnmatch import fnmatchcase
+
+
+class PathMatcher:
+    """
+    Glob patterns matcher for Vault paths
+
+    Patterns are matched segment by segment:
+     * `*` matches any part of a single segment
+     * `?` matches any single character of a segment
+     * `[seq]` and `[!seq]` match a character in or not in seq
+     * `**` as a whole segment matches zero or more segments
+
+    A pattern selects a path if it matches the path itself or one of its
+    parent folders. Folders which can't lead to a selected path can be
+    pruned while listing
+    """
+    glob_chars = "*?["
+    patterns = None
+
+    def __init__(self, patterns):
+        """
+        :param patterns: glob patterns
+        :type patterns: list(str)
+        """
+        self.patterns = [self.split(pattern) for pattern in patterns]
+
+    @staticmethod
+    def split(path):
+        """
+        Split a path in segments, ignoring empty segments
+
+        :param path: path to split
+        :type path: str
+
+        :return: list(str)
+        """
+        return [seg for seg in path.split("/") if seg]
+
+    @classmethod
+    def is_glob(cls, path):
+        """
+        Check if a path contains glob characters
+
+        :param path: path to check
+        :type path: str
+
+        :return: bool
+        """
+        return any(char in path for char in cls.glob_chars)
+
+    @classmethod
+    def literal_prefix(cls, pattern):
+        """
+        Return the path made of the segments before the first glob segment
+
+        :param pattern: glob pattern
+        :type pattern: str
+
+        :return: str
+        """
+        prefix = []
+        for segment in cls.split(pattern):
+            if cls.is_glob(segment):
+                break
+            prefix.append(segment)
+        return "/".join(prefix)
+
+    @staticmethod
+    def closure(pattern, states):
+        """
+        Add states reachable by matching '**' with zero segments
+
+        :param pattern: pattern segments
+        :type pattern: list(str)
+        :param states: positions in pattern
+        :type states: set(int)
+
+        :return: set(int)
+        """
+        to_check = list(states)
+        while len(to_check):
+            state = to_check.pop()
+            if state < len(pattern) and pattern[state] == "**" and \
+                    state + 1 not in states:
+                states.add(state + 1)
+                to_check.append(state + 1)
+        return states
+
+    def walk(self, pattern, segments):
+        """
+        Consume path segments with a pattern
+
+        :param pattern: pattern segments
+        :type pattern: list(str)
+        :param segments: path segments
+        :type segments: list(str)
+
+        :return: tuple(bool, set(int)) whether the pattern fully matched
+                 the path or one of its parents, and the positions reached
+        """
+        states = self.closure(pattern, {0})
+        selected = len(pattern) in states
+        for segment in segments:
+            if selected:
+                break
+            next_states = set()
+            for state in states:
+                if state == len(pattern):
+                    continue
+                if pattern[state] == "**":
+                    next_states.add(state)
+                elif fnmatchcase(segment, pattern[state]):
+                    next_states.add(state + 1)
+            states = self.closure(pattern, next_states)
+            selected = len(pattern) in states
+            if not len(states):
+                break
+        return selected, states
+
+    def selects(self, path):
+        """
+        Check if a pattern matches path or one of its parent folders
+
+        :param path: path to check
+        :type path: str
+
+        :return: bool
+        """
+        segments = self.split(path)
+        for pattern in self.patterns:
+            if self.walk(pattern, segments)[0]:
+                return True
+        return False
+
+    def can_descend(self, folder):
+        """
+        Check if a path under folder can be selected by a pattern
+
+        :param folder: folder path
+        :type folder: str
+
+        :return: bool
+        """
+        segments = self.split(folder)
+        for pattern in self.patterns:
+            selected, states = self.walk(pattern, segments)
+            if selected or len(states):
+                return True
+        return False
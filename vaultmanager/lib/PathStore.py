@@ -0,0 +1,295 @@
+from array import array
+from bisect import bisect_left
+
+
+class PathStore:
+    """
+    Ordered container of secrets paths with prefix queries
+
+    Path segments are interned once in a segment table and paths are stored
+    as nodes of a prefix tree kept in flat arrays, so common prefixes are
+    stored once. Children of a folder are kept in two arrays sorted by
+    segment id and found by bisection. Each folder costs a dictionary entry
+    and two arrays, and adding a child copies the arrays of its folder, so
+    the store isn't smaller than a set of strings for trees of short paths
+    or of folders holding few secrets. A value can optionally be attached
+    to each path, making the store usable as a path -> value mapping
+    """
+    separator = "/"
+    segments = None
+    segment_ids = None
+    parents = None
+    node_segments = None
+    child_segments = None
+    child_nodes = None
+    entry_index = None
+    entries = None
+    values = None
+
+    def __init__(self, paths=None):
+        """
+        :param paths: paths to add to the store
+        :type paths: iterable(str)
+        """
+        self.segments = []
+        self.segment_ids = {}
+        # node 0 is the root of the prefix tree
+        self.parents = array('l', [-1])
+        self.node_segments = array('l', [-1])
+        self.entry_index = array('l', [-1])
+        # sorted segment ids and nodes of the children, by folder node
+        self.child_segments = {}
+        self.child_nodes = {}
+        self.entries = array('l')
+        self.values = {}
+        if paths is not None:
+            self.update(paths)
+
+    def split(self, path):
+        """
+        Split a path in segments, ignoring empty segments
+
+        :param path: path to split
+        :type path: str
+
+        :return: list(str)
+        """
+        return [seg for seg in path.split(self.separator) if seg]
+
+    def intern(self, segment):
+        """
+        Return the id of a segment, adding it to the segment table if needed
+
+        :param segment: path segment
+        :type segment: str
+
+        :return: int
+        """
+        seg_id = self.segment_ids.get(segment)
+        if seg_id is None:
+            seg_id = len(self.segments)
+            self.segments.append(segment)
+            self.segment_ids[segment] = seg_id
+        return seg_id
+
+    def child(self, node, seg_id):
+        """
+        Return the child of a node for a segment, None if there is none
+
+        :param node: parent node
+        :type node: int
+        :param seg_id: segment id of the child
+        :type seg_id: int
+
+        :return: int or None
+        """
+        segments = self.child_segments.get(node)
+        if segments is None:
+            return None
+        index = bisect_left(segments, seg_id)
+        if index < len(segments) and segments[index] == seg_id:
+            return self.child_nodes[node][index]
+        return None
+
+    def find(self, path):
+        """
+        Return the node of a path or None if the path is not in the tree
+
+        :param path: path to look for
+        :type path: str
+
+        :return: int or None
+        """
+        node = 0
+        for segment in self.split(path):
+            seg_id = self.segment_ids.get(segment)
+            if seg_id is None:
+                return None
+            node = self.child(node, seg_id)
+            if node is None:
+                return None
+        return node
+
+    def add(self, path, value=None):
+        """
+        Add a path to the store
+
+        :param path: path to add
+        :type path: str
+        :param value: value attached to the path
+        :type value: object
+
+        :return: int node of the path
+        """
+        node = 0
+        for segment in self.split(path):
+            seg_id = self.intern(segment)
+            child = self.child(node, seg_id)
+            if child is None:
+                child = len(self.parents)
+                self.parents.append(node)
+                self.node_segments.append(seg_id)
+                self.entry_index.append(-1)
+                if node not in self.child_segments:
+                    self.child_segments[node] = array('l')
+                    self.child_nodes[node] = array('l')
+                segments = self.child_segments[node]
+                # new segments get the highest id, so this is mostly an append
+                index = bisect_left(segments, seg_id)
+                segments.insert(index, seg_id)
+                self.child_nodes[node].insert(index, child)
+            node = child
+        if self.entry_index[node] == -1:
+            self.entry_index[node] = len(self.entries)
+            self.entries.append(node)
+        if value is not None:
+            self.values[node] = value
+        return node
+
+    def update(self, paths):
+        """
+        Add several paths to the store
+
+        :param paths: paths to add
+        :type paths: iterable(str)
+        """
+        for path in paths:
+            self.add(path)
+
+    def path(self, node):
+        """
+        Rebuild the path of a node
+
+        :param node: node of the path
+        :type node: int
+
+        :return: str
+        """
+        segments = []
+        while node > 0:
+            segments.append(self.segments[self.node_segments[node]])
+            node = self.parents[node]
+        return self.separator.join(reversed(segments))
+
+    def is_entry(self, node):
+        """
+        Check if a node is a stored path and not only a prefix
+
+        :param node: node to check
+        :type node: int or None
+
+        :return: bool
+        """
+        return node is not None and self.entry_index[node] != -1
+
+    def __contains__(self, path):
+        return self.is_entry(self.find(path))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        for node in self.entries:
+            yield self.path(node)
+
+    def __getitem__(self, path):
+        node = self.find(path)
+        if not self.is_entry(node):
+            raise KeyError(path)
+        return self.values.get(node)
+
+    def __setitem__(self, path, value):
+        self.add(path, value)
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for node in self.entries:
+            yield self.path(node), self.values.get(node)
+
+    def prefix(self, prefix):
+        """
+        Iterate over stored paths at or under prefix, in insertion order
+
+        :param prefix: path prefix
+        :type prefix: str
+
+        :return: iterator(str)
+        """
+        start = self.find(prefix)
+        if start is None:
+            return
+        found = array('l')
+        to_visit = [start]
+        while len(to_visit):
+            node = to_visit.pop()
+            if self.is_entry(node):
+                found.append(self.entry_index[node])
+            to_visit.extend(self.child_nodes.get(node, ()))
+        for index in sorted(found):
+            yield self.path(self.entries[index])
+
+    def add_key(self, path, key):
+        """
+        Return a compact integer reference to a 'path:key' pair,
+        adding path to the store if needed
+
+        :param path: secret path
+        :type path: str
+        :param key: secret key
+        :type key: str
+
+        :return: int
+        """
+        return (self.intern(key) << 32) | self.add(path)
+
+    def key_ref(self, ref):
+        """
+        Rebuild the 'path:key' string of a reference returned by add_key
+
+        :param ref: reference returned by add_key
+        :type ref: int
+
+        :return: str
+        """
+        return self.path(ref & 0xFFFFFFFF) + ":" + self.segments[ref >> 32]
+
+    def union(self, other):
+        """
+        Return a new store with paths of both stores
+
+        :param other: other paths
+        :type other: PathStore or iterable(str)
+
+        :return: PathStore
+        """
+        result = PathStore(self)
+        result.update(other)
+        return result
+
+    def intersection(self, other):
+        """
+        Return a new store with paths present in both stores
+
+        :param other: other paths
+        :type other: PathStore
+
+        :return: PathStore
+        """
+        return PathStore(path for path in self if path in other)
+
+    def difference(self, other):
+        """
+        Return a new store with paths not present in other
+
+        :param other: other paths
+        :type other: PathStore
+
+        :return: PathStore
+        """
+        return PathStore(path for path in self if path not in other)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
@@ -0,0 +1,38 @@
+import time
+import threading
+
+
+class RateLimiter:
+    """
+    Thread safe limiter of the number of requests per second
+
+    Requests are spaced evenly: each call to acquire waits until the next
+    request slot is available
+    """
+    interval = None
+    next_slot = None
+    lock = None
+
+    def __init__(self, rate=None):
+        """
+        :param rate: maximum number of requests per second, None for no limit
+        :type rate: float
+        """
+        if rate is not None and rate <= 0:
+            raise ValueError("Rate limit must be greater than 0")
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait until a request can be sent
+        """
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
@@ -2,6 +2,7 @@ import os
 import logging
 import hvac
 import re
+import requests
 
 
 class VaultClient:
@@ -12,9 +13,11 @@ class VaultClient:
     vault_client = None
     dry = None
     skip_tls = None
+    pool_size = None
+    namespace = None
 
     def __init__(self, base_logger=None, dry=False, vault_addr=None,
-                 skip_tls=False):
+                 skip_tls=False, pool_size=None, namespace=None):
         """
         :param base_logger: main class name
         :type base_logger: string
@@ -24,6 +27,11 @@ class VaultClient:
         :type vault_addr :str
         :param skip_tls: skipping TLS verification
         :type skip_tls: bool
+        :param pool_size: number of HTTP connections kept open to Vault, for
+                          clients shared between threads
+        :type pool_size: int
+        :param namespace: Vault Enterprise namespace of all requests
+        :type namespace: str
         """
         if base_logger:
             self.logger = logging.getLogger(
@@ -35,6 +43,10 @@ class VaultClient:
         self.dry = dry
         self.logger.debug("Skip TLS: " + str(skip_tls))
         self.skip_tls = skip_tls
+        self.pool_size = pool_size
+        self.logger.debug("Namespace: " + str(namespace))
+        self.namespace = namespace
+        self.secrets_engines = None
         self.logger.debug("Instantiating VaultClient class")
         self.fetch_api_address(vault_addr)
 
@@ -471,6 +483,30 @@ class VaultClient:
             return secrets_engines
         return secrets_engines
 
+    def kv_mount(self, path):
+        """
+        Return the secrets engine mount of a path and its KV version.
+        Mounts are listed once per client as this is called for each
+        secret read
+
+        :param path: secret or folder path
+        :type path: str
+
+        :return: tuple(str, int) mount path without trailing '/' and KV
+                 version, (None, None) if the path is on no mount
+        """
+        self.logger.debug("Looking for the mount of '%s'" % path)
+        path = path.strip("/") + "/"
+        if self.secrets_engines is None:
+            self.secrets_engines = self.secret_list()
+        secrets_engines = self.secrets_engines
+        # the longest mount prefix wins with nested mounts
+        for mount in sorted(secrets_engines, key=len, reverse=True):
+            if path.startswith(mount.strip("/") + "/"):
+                options = secrets_engines[mount].get("options") or {}
+                return mount.strip("/"), int(options.get("version", "1"))
+        return None, None
+
     def secret_enable(self, secret_type, path, description):
         """
         Enable a new secret engine
@@ -482,6 +518,7 @@ class VaultClient:
         :type description: str
         """
         self.logger.debug("Enabling '" + secret_type + "' secret engine")
+        self.secrets_engines = None
         if not self.dry_run():
             self.vault_client.enable_secret_backend(
                 backend_type=secret_type,
@@ -497,6 +534,7 @@ class VaultClient:
         :type path: str
         """
         self.logger.debug("Disabling secret engine '" + path + "'")
+        self.secrets_engines = None
         if not self.dry_run():
             self.vault_client.disable_secret_backend(path)
 
@@ -567,9 +605,25 @@ class VaultClient:
         else:
             self.logger.error("No Vault address found")
         self.logger.debug("Vault address to be used: " + vault_address)
+        session = None
+        if self.pool_size or self.namespace:
+            session = requests.Session()
+        if self.pool_size:
+            self.logger.debug("Using a pool of %s connections" %
+                              self.pool_size)
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=self.pool_size,
+                pool_maxsize=self.pool_size
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        if self.namespace:
+            # hvac merges session headers in each request
+            session.headers["X-Vault-Namespace"] = self.namespace
         self.vault_client = hvac.Client(
             url=vault_address,
-            verify=(not self.skip_tls)
+            verify=(not self.skip_tls),
+            session=session
         )
 
     # TODO: should always receive a Vault token
@@ -666,7 +720,8 @@ class VaultClient:
                     secrets.append(path + "/" + p)
         return [secret.replace("//", "/") for secret in secrets]
 
-    def secrets_tree_list(self, path, path_excluded=[]):
+    def secrets_tree_list(self, path, path_excluded=[], matcher=None,
+                          exclude_matcher=None, budget=None, shard=None):
         """
         List all secrets at given path
 
@@ -674,26 +729,53 @@ class VaultClient:
         :type path: str
         :param path_excluded: List of path to exclude from list
         :type path_excluded: list
+        :param matcher: only list secrets selected by this matcher
+        :type matcher: PathMatcher
+        :param exclude_matcher: exclude secrets selected by this matcher
+        :type exclude_matcher: PathMatcher
+        :param budget: depth, count and time limits of the walk
+        :type budget: WalkBudget
+        :param shard: only list subtrees belonging to this shard
+        :type shard: KVShard
         :return: list
         """
-        secrets_list = []
-        secrets_list += self.secrets_tree_list_recursive(path, path_excluded)
-        return secrets_list
+        return list(self.secrets_tree_iter(path, path_excluded, matcher,
+                                           exclude_matcher, budget, shard))
 
-    def secrets_tree_list_recursive(self, path, path_excluded):
+    def secrets_tree_iter(self, path, path_excluded=[], matcher=None,
+                          exclude_matcher=None, budget=None, shard=None,
+                          depth=0):
         """
-        Recursive method associated to secrets_tree_list
+        Recursively browse a path and yield secrets as soon as they are listed
+
+        Folders which can't contain secrets selected by matcher, or which are
+        selected by exclude_matcher, are never listed. Once the budget is
+        exhausted, no further request is sent
 
         :param path: Secrets path to list
         :type path: str
         :param path_excluded: List of path to exclude from list
         :type path_excluded: list
+        :param matcher: only list secrets selected by this matcher
+        :type matcher: PathMatcher
+        :param exclude_matcher: exclude secrets selected by this matcher
+        :type exclude_matcher: PathMatcher
+        :param budget: depth, count and time limits of the walk
+        :type budget: WalkBudget
+        :param shard: only list subtrees belonging to this shard
+        :type shard: KVShard
+        :param depth: depth of path under the walked path
+        :type depth: int
+        :return: iterator(str)
         """
-        secrets = []
         # if path is in in path_excluded we return
         for p in path_excluded:
             if path.startswith(p):
-                return []
+                return
+        if exclude_matcher and exclude_matcher.selects(path):
+            return
+        if budget and budget.exhausted():
+            return
 
         # If path is a folder we continue else id it's a secret,
         # we return the secret path
@@ -701,20 +783,42 @@ class VaultClient:
         if len(listed):
             listed = listed["keys"]
         else:
-            if len(self.read(path)):
+            if shard and depth == 0 and not shard.owns(path):
+                return
+            if (not matcher or matcher.selects(path)) and len(self.read(path)):
                 self.logger.debug("'%s' is a secret" % path)
-                return [path]
-
-        if len(listed):
-            for p in listed:
-                avoid = False
-                for t_e in path_excluded:
-                    if (path + "/" + p).replace("//", "/").startswith(t_e):
-                        avoid = True
-                if p.endswith("/") and not avoid:
-                    secrets += self.secrets_tree_list_recursive(
-                        path + "/" + p, path_excluded
-                    )
-                elif not avoid:
-                    secrets.append(path + "/" + p)
-        return [secret.replace("//", "/") for secret in secrets]
+                if budget and not budget.consume():
+                    return
+                yield path
+            return
+
+        for p in listed:
+            if budget and budget.exhausted():
+                return
+            child = (path + "/" + p).replace("//", "/")
+            avoid = False
+            for t_e in path_excluded:
+                if child.startswith(t_e):
+                    avoid = True
+            if exclude_matcher and exclude_matcher.selects(child):
+                avoid = True
+            if shard and not avoid and (
+                    depth + 1 == shard.depth or
+                    (depth + 1 < shard.depth and not p.endswith("/"))):
+                avoid = not shard.owns(child.rstrip("/"))
+            if p.endswith("/") and not avoid:
+                if matcher and not matcher.can_descend(child):
+                    self.logger.debug("Pruning '%s'" % child)
+                    continue
+                if budget and not budget.can_descend(depth + 1):
+                    self.logger.debug("Max depth reached at '%s'" % child)
+                    continue
+                yield from self.secrets_tree_iter(child, path_excluded,
+                                                  matcher, exclude_matcher,
+                                                  budget, shard, depth + 1)
+            elif not avoid:
+                if matcher and not matcher.selects(child):
+                    continue
+                if budget and not budget.consume():
+                    return
+                yield child
@@ -0,0 +1,95 @@
+import time
+import threading
+
+
+class WalkBudget:
+    """
+    Limits of a secrets tree walk
+
+    The walk stops listing folders as soon as the number of secrets found
+    reaches the limit or the time budget is spent. Folders deeper than the
+    maximum depth are not listed
+    """
+    max_depth = None
+    limit = None
+    deadline = None
+    secrets_count = 0
+    reason = None
+    depth_reached = False
+    lock = None
+
+    def __init__(self, max_depth=None, limit=None, time_budget=None):
+        """
+        :param max_depth: maximum depth of secrets under the walked path
+        :type max_depth: int
+        :param limit: maximum number of secrets to find
+        :type limit: int
+        :param time_budget: maximum duration of the walk in seconds
+        :type time_budget: float
+        """
+        self.max_depth = max_depth
+        self.limit = limit
+        if time_budget is not None:
+            self.deadline = time.monotonic() + time_budget
+        self.secrets_count = 0
+        # walks of several paths can share the budget from several threads
+        self.lock = threading.Lock()
+
+    def exhausted(self):
+        """
+        Check if the walk must stop
+
+        :return: bool
+        """
+        if self.reason:
+            return True
+        if self.limit is not None and self.secrets_count >= self.limit:
+            self.reason = "limit"
+        elif self.deadline is not None and time.monotonic() >= self.deadline:
+            self.reason = "time-budget"
+        return self.reason is not None
+
+    def can_descend(self, depth):
+        """
+        Check if a folder at depth can be listed
+
+        :param depth: depth of the folder under the walked path
+        :type depth: int
+
+        :return: bool
+        """
+        if self.max_depth is not None and depth >= self.max_depth:
+            self.depth_reached = True
+            return False
+        return True
+
+    def consume(self):
+        """
+        Account for a secret found by the walk if the budget allows it
+
+        :return: bool
+        """
+        with self.lock:
+            if self.exhausted():
+                return False
+            self.secrets_count += 1
+            return True
+
+    def is_truncated(self):
+        """
+        Check if the walk returned partial results
+
+        :return: bool
+        """
+        return self.reason is not None or self.depth_reached
+
+    def marker(self):
+        """
+        Return a description of why the walk results are partial
+
+        :return: dict
+        """
+        return {
+            "reason": self.reason if self.reason else "max-depth",
+            "secrets_listed": self.secrets_count
+        }
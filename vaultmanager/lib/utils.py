@@ -2,6 +2,13 @@
 # Utils methods
 #
 import os
+import gzip
+import hmac
+import json
+import queue
+import hashlib
+import threading
+import concurrent.futures
 
 
 def get_var_or_env(logger, variable, env_variable):
@@ -82,3 +89,248 @@ def keys_exists_in_dict(logger, dictionary, keys):
         if not len(key['inc']) or dictionary[key['key']] in key['inc']:
             logger.debug("Key %s found and value in included values" % key)
     return missing_keys
+
+
+def normalize_path(path):
+    """
+    Remove duplicated, leading and trailing slashes from a Vault path
+
+    :param path: path to normalize
+    :type path: str
+
+    :return: str
+    """
+    while "//" in path:
+        path = path.replace("//", "/")
+    return path.strip("/")
+
+
+def path_is_under(path, root):
+    """
+    Check if path is root or is under root. Both paths must be normalized
+
+    :param path: path to check
+    :type path: str
+    :param root: root path
+    :type root: str
+
+    :return: bool
+    """
+    return (not root or path == root or
+            (path.startswith(root) and path[len(root)] == "/"))
+
+
+def merge_paths(logger, paths):
+    """
+    Normalize paths and remove paths which are under another path of the list
+    so each subtree is only walked once
+
+    :param logger: logger instance
+    :type logger: logger
+    :param paths: paths to merge
+    :type paths: list(str)
+
+    :return: list of normalized paths
+    """
+    normalized = [normalize_path(path) for path in paths]
+    merged = []
+    for idx, path in enumerate(normalized):
+        covered = False
+        for other_idx, other in enumerate(normalized):
+            if path_is_under(path, other) and \
+                    (path != other or other_idx < idx):
+                logger.debug("'%s' is covered by '%s'" % (paths[idx], other))
+                covered = True
+                break
+        if not covered:
+            merged.append(path)
+    logger.debug("Paths to walk: %s" % merged)
+    return merged
+
+
+def get_digest_key(logger, env_variable="VAULT_MANAGER_DIGEST_KEY"):
+    """
+    Return the key used to compute digests which have to be compared
+    between several runs
+
+    :param logger: logger instance
+    :type logger: logger
+    :param env_variable: Environment variable containing the key
+    :type env_variable: str
+
+    :return: bytes
+    """
+    logger.debug("Fetching digest key from '%s'" % env_variable)
+    key = os.getenv(env_variable, None)
+    if not key:
+        raise ValueError("A digest key shared by all runs must be set in "
+                         "the '%s' environment variable" % env_variable)
+    return key.encode()
+
+
+def value_digest(value, key, raw=False):
+    """
+    Return the keyed digest of a secret value
+
+    :param value: secret value
+    :type value: str or object
+    :param key: digest key
+    :type key: bytes
+    :param raw: return the 32 bytes digest instead of its hex string
+    :type raw: bool
+
+    :return: str or bytes
+    """
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True)
+    digest = hmac.new(key, value.encode(), hashlib.sha256)
+    if raw:
+        return digest.digest()
+    return digest.hexdigest()
+
+
+def secret_digest(secret):
+    """
+    Return the digest of a secret content, independent of keys order
+
+    :param secret: secret content
+    :type secret: dict
+
+    :return: str
+    """
+    normalized = json.dumps(secret, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def sum_counters(counters):
+    """
+    Sum dictionaries of counters, nested dictionaries being summed, lists
+    concatenated and the first of several strings, like errors, kept
+
+    :param counters: dictionaries to sum
+    :type counters: list(dict)
+
+    :return: dict
+    """
+    total = {}
+    for counter in counters:
+        for key, value in counter.items():
+            if isinstance(value, dict):
+                total[key] = sum_counters([total.get(key, {}), value])
+            elif isinstance(value, list):
+                total[key] = total.get(key, []) + value
+            elif isinstance(value, str):
+                total.setdefault(key, value)
+            else:
+                total[key] = total.get(key, 0) + value
+    return total
+
+
+def get_fernet(env_variable):
+    """
+    Return a Fernet instance, the key being read from an environment
+    variable
+
+    :param env_variable: Environment variable containing the Fernet key
+    :type env_variable: str
+
+    :return: cryptography.fernet.Fernet
+    """
+    try:
+        from cryptography.fernet import Fernet
+    except ImportError:
+        raise ValueError("The cryptography package is needed to encrypt "
+                         "files")
+    key = os.getenv(env_variable, None)
+    if not key:
+        raise ValueError(
+            "A Fernet key must be set in the '%s' environment variable. "
+            "It can be generated with: python -c 'from "
+            "cryptography.fernet import Fernet; "
+            "print(Fernet.generate_key().decode())'" % env_variable
+        )
+    try:
+        return Fernet(key.encode())
+    except ValueError as e:
+        raise ValueError("Invalid key in '%s': %s" % (env_variable, str(e)))
+
+
+def open_file(path, mode="r"):
+    """
+    Open a text file, gzip compressed if its name ends with '.gz'
+
+    :param path: file path
+    :type path: str
+    :param mode: 'r', 'w' or 'a'
+    :type mode: str
+
+    :return: file object
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t")
+    return open(path, mode)
+
+
+def parallel_iter(logger, producers, workers, queue_size=16):
+    """
+    Run producers concurrently and yield their items as soon as they are
+    produced. Producers wait while queue_size items by worker are waiting
+    for the consumer, so memory doesn't depend on the number of items.
+    Exceptions raised by a producer are raised again once all producers
+    are done
+
+    :param logger: logger instance
+    :type logger: logger
+    :param producers: functions returning an iterable
+    :type producers: list(function)
+    :param workers: maximum number of producers running at the same time
+    :type workers: int
+    :param queue_size: maximum number of waiting items by worker
+    :type queue_size: int
+
+    :return: iterator
+    """
+    if workers <= 1 or len(producers) < 2:
+        for producer in producers:
+            yield from producer()
+        return
+    logger.debug("Running %s producers with %s workers" %
+                 (len(producers), workers))
+    done = object()
+    items = queue.Queue(workers * queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        # give up if the consumer stopped, so producers are never left
+        # blocked on a full queue
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(producer):
+        try:
+            for item in producer():
+                if not put(item):
+                    return
+        finally:
+            put(done)
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        futures = [pool.submit(run, producer) for producer in producers]
+        try:
+            remaining = len(producers)
+            while remaining:
+                item = items.get()
+                if item is done:
+                    remaining -= 1
+                else:
+                    yield item
+        finally:
+            # consumer stopped early: producers exit at their next put
+            stop.set()
+        for future in futures:
+            future.result()
@@ -1,12 +1,48 @@
 import os
+import time
+import threading
+import math
+import concurrent.futures
 import logging
 import json
 import random
+from array import array
+from fnmatch import fnmatchcase
 try:
     from lib.VaultClient import VaultClient
+    from lib.KVSnapshot import KVSnapshot
+    from lib.PathStore import PathStore
+    from lib.PathMatcher import PathMatcher
+    from lib.WalkBudget import WalkBudget
+    from lib.KVShard import KVShard
+    from lib.KVPipeline import KVPipeline
+    from lib.MerkleTree import MerkleTree
+    from lib.KVFanOut import KVFanOut
+    from lib.KVJournal import KVJournal
+    from lib.KVMatcher import KVMatcher
+    from lib.KVIndex import KVIndex
+    from lib.KVSearchPool import KVSearchPool
+    from lib.KVRecordWriter import KVRecordWriter
+    from lib.KVStats import KVStats
+    from lib.KVArchive import KVArchive
     import lib.utils as utils
 except ImportError:
     from vaultmanager.lib.VaultClient import VaultClient
+    from vaultmanager.lib.KVSnapshot import KVSnapshot
+    from vaultmanager.lib.PathStore import PathStore
+    from vaultmanager.lib.PathMatcher import PathMatcher
+    from vaultmanager.lib.WalkBudget import WalkBudget
+    from vaultmanager.lib.KVShard import KVShard
+    from vaultmanager.lib.KVPipeline import KVPipeline
+    from vaultmanager.lib.MerkleTree import MerkleTree
+    from vaultmanager.lib.KVFanOut import KVFanOut
+    from vaultmanager.lib.KVJournal import KVJournal
+    from vaultmanager.lib.KVMatcher import KVMatcher
+    from vaultmanager.lib.KVIndex import KVIndex
+    from vaultmanager.lib.KVSearchPool import KVSearchPool
+    from vaultmanager.lib.KVRecordWriter import KVRecordWriter
+    from vaultmanager.lib.KVStats import KVStats
+    from vaultmanager.lib.KVArchive import KVArchive
     import vaultmanager.lib.utils as utils
 
 
@@ -18,6 +54,20 @@ class VaultManagerKV:
     module_name = None
     dry_run = False
     skip_tls = False
+    selectors = None
+    walk_budget = None
+    shard = None
+    output_file = None
+    records = None
+    output_format = "json"
+    workers = 1
+    mounts = None
+    namespace = None
+    report = True
+    pipeline_queue_size = 16
+    target_timeout = 30
+    search_batch_size = 500
+    result = None
 
     def __init__(self, base_logger=None, dry_run=False, skip_tls=False):
         """
@@ -35,6 +85,7 @@ class VaultManagerKV:
             self.logger = logging.getLogger()
         self.dry_run = dry_run
         self.skip_tls = skip_tls
+        self.selectors = {}
         self.logger.debug("Initializing VaultManagerKV")
 
     def connect_to_vault(self, vault_addr, vault_token):
@@ -52,7 +103,9 @@ class VaultManagerKV:
             self.base_logger,
             dry=self.dry_run,
             vault_addr=vault_addr,
-            skip_tls=self.skip_tls
+            skip_tls=self.skip_tls,
+            pool_size=self.workers if self.workers > 1 else None,
+            namespace=self.namespace
         )
         vault_client.authenticate(vault_token)
         return vault_client
@@ -79,6 +132,57 @@ class VaultManagerKV:
                                     vault-target-token is used for
                                     vault-target-addr""",
                                     metavar=("COPY_FROM_PATH", "COPY_TO_PATH"))
+        self.subparser.add_argument("--targets", nargs='+',
+                                    help="""copy-path and copy-secret to
+                                    several Vault instances instead of
+                                    vault-target-addr. The token of each
+                                    target is read from the TOKEN_ENV
+                                    environment variable and RATE limits
+                                    the writes per second""",
+                                    metavar="ADDR=TOKEN_ENV[@RATE]")
+        self.subparser.add_argument("--target-rate", nargs='?',
+                                    help="""maximum number of writes per
+                                    second on each target without RATE""",
+                                    metavar="RATE", type=float)
+        self.subparser.add_argument("--target-timeout", nargs='?',
+                                    help="""seconds waited for a target too
+                                    slow to keep up before dropping its
+                                    writes. Default: 30""",
+                                    metavar="SECONDS", type=float,
+                                    default=30)
+        self.subparser.add_argument("--diff", nargs=2,
+                                    help="""compare secrets under SRC_PATH
+                                    on vault-addr with secrets under DST_PATH
+                                    on vault-target-addr without displaying
+                                    values""",
+                                    metavar=("SRC_PATH", "DST_PATH"))
+        self.subparser.add_argument("--diff-cache", nargs='?',
+                                    help="""store hashes of diff in
+                                    CACHE_FILE so a diff run again doesn't
+                                    read again KV version 2 secrets whose
+                                    version didn't change""",
+                                    metavar="CACHE_FILE")
+        self.subparser.add_argument("--cache-max-age", nargs='?',
+                                    help="""maximum age in seconds of the
+                                    hashes reused from CACHE_FILE.
+                                    Default: 3600""",
+                                    metavar="SECONDS", type=float,
+                                    default=3600)
+        self.subparser.add_argument("--sync", action='store_true',
+                                    help="""with copy-path, only write
+                                    secrets missing or different on
+                                    vault-target-addr""")
+        self.subparser.add_argument("--prune", action='store_true',
+                                    help="""with sync, delete secrets of
+                                    vault-target-addr missing on
+                                    vault-addr""")
+        self.subparser.add_argument("--journal", nargs='?',
+                                    help="""with copy-path, record completed
+                                    writes in JOURNAL_FILE""",
+                                    metavar="JOURNAL_FILE")
+        self.subparser.add_argument("--resume", action='store_true',
+                                    help="""with journal, skip secrets
+                                    already copied by a previous run""")
         self.subparser.add_argument("--copy-secret", nargs=2,
                                     help="""copy one secret from vault-addr
                                     instance at SECRET_TO_COPY to
@@ -89,30 +193,63 @@ class VaultManagerKV:
                                     secrets under it from vault-addr instance.
                                     vault-token is used for vault-addr""",
                                     metavar="PATHS_TO_DELETE")
-        self.subparser.add_argument("--count", nargs='+',
+        self.subparser.add_argument("--all-versions", action='store_true',
+                                    help="""with delete on KV version 2
+                                    mounts, delete the metadata of secrets
+                                    to remove all their versions""")
+        self.subparser.add_argument("--max-failures", nargs='?', type=int,
+                                    help="""stop delete or copy-path once
+                                    MAX_FAILURES secrets failed. Default:
+                                    never""",
+                                    metavar="MAX_FAILURES")
+        self.subparser.add_argument("--count", nargs='*',
                                     help="""count all secrets on vault-addr
-                                    instance under SECRET_PATHS""",
+                                    instance under SECRET_PATHS. Glob
+                                    patterns are accepted""",
                                     metavar="SECRET_PATHS")
-        self.subparser.add_argument("--find-duplicates", nargs='+',
+        self.subparser.add_argument("--find-duplicates", nargs='*',
                                     help="""search and display duplicates on
-                                    vault-addr instance under SECRET_PATHS""",
+                                    vault-addr instance under SECRET_PATHS.
+                                    Glob patterns are accepted""",
                                     metavar="SECRET_PATHS")
-        self.subparser.add_argument("--secrets-tree", nargs='+',
+        self.subparser.add_argument("--secrets-tree", nargs='*',
                                     help="""display all secrets tree
                                     (path/to/secret) on vault-addr instance
-                                     under SECRET_PATHS""",
+                                     under SECRET_PATHS. Glob patterns are
+                                     accepted""",
                                     metavar="SECRET_PATHS")
         self.subparser.add_argument("--search", nargs='+',
                                     help="""try to find all SEARCH_VALUES
                                     on vault-addr instance whether it's a
                                     path or a secret""",
                                     metavar="SEARCH_VALUES")
+        self.subparser.add_argument("--regex", action='store_true',
+                                    help="""search SEARCH_VALUES as regular
+                                    expressions""")
+        self.subparser.add_argument("--ignore-case", action='store_true',
+                                    help="""ignore case when searching
+                                    SEARCH_VALUES""")
+        self.subparser.add_argument("--search-scope", nargs='?',
+                                    choices=["all", "keys", "paths"],
+                                    default="all",
+                                    help="""search SEARCH_VALUES in paths,
+                                    key names and values (all), in key names
+                                    only (keys) or in secrets paths only
+                                    without reading secrets (paths).
+                                    Default: all""")
+        self.subparser.add_argument("--processes", nargs='?', type=int,
+                                    help="""number of processes matching
+                                    search values. Default: 1, values are
+                                    matched without starting processes""",
+                                    metavar="PROCESSES")
         self.subparser.add_argument("-e", "--exclude", nargs='+',
                                     help="""paths to excludes from count,
-                                    find-duplicates, secrets-tree or search""",
+                                    find-duplicates, secrets-tree or search.
+                                    Glob patterns are accepted""",
                                     metavar="SECRET_PATHS")
         self.subparser.add_argument("-i", "--include", nargs='+',
-                                    help="""paths to include in search""",
+                                    help="""paths to include in search.
+                                    Glob patterns are accepted""",
                                     metavar="SECRET_PATHS")
         self.subparser.add_argument("--generate-tree", nargs='+',
                                     help="""paths under which will be
@@ -122,55 +259,588 @@ class VaultManagerKV:
                                     help="""depth of tree generated by
                                     generate-tree""",
                                     metavar="DEPTH", type=int)
+        self.subparser.add_argument("--snapshot", nargs='?',
+                                    help="""store paths, key names, value
+                                    digests and sizes of all secrets under
+                                    the included paths in the SQLite file
+                                    SNAPSHOT_FILE""",
+                                    metavar="SNAPSHOT_FILE")
+        self.subparser.add_argument("--export", nargs=2,
+                                    help="""export secrets under
+                                    SECRET_PATH on vault-addr instance to a
+                                    compressed EXPORT_FILE""",
+                                    metavar=("SECRET_PATH", "EXPORT_FILE"))
+        self.subparser.add_argument("--encrypt", action='store_true',
+                                    help="""with export, encrypt secrets
+                                    with the Fernet key of the
+                                    VAULT_MANAGER_EXPORT_KEY environment
+                                    variable""")
+        self.subparser.add_argument("--import", nargs=2,
+                                    help="""import secrets of EXPORT_FILE
+                                    under SECRET_PATH on vault-addr
+                                    instance""",
+                                    metavar=("EXPORT_FILE", "SECRET_PATH"))
+        self.subparser.add_argument("--force", action='store_true',
+                                    help="""with import, import an export
+                                    file which is incomplete or has no
+                                    trailer""")
+        self.subparser.add_argument("--stats", nargs='*',
+                                    help="""compute counts and sizes by
+                                    subtree, depths, key names frequencies
+                                    and largest secrets and folders under
+                                    SECRET_PATHS. Glob patterns are
+                                    accepted""",
+                                    metavar="SECRET_PATHS")
+        self.subparser.add_argument("--stats-depth", nargs='?',
+                                    help="""with stats, depth of the
+                                    subtrees reported under each path.
+                                    Default: 1""",
+                                    metavar="DEPTH", type=int, default=1)
+        self.subparser.add_argument("--top", nargs='?',
+                                    help="""with stats, number of largest
+                                    secrets and folders and of most frequent
+                                    key names reported. Default: 10""",
+                                    metavar="TOP", type=int, default=10)
+        self.subparser.add_argument("--transform", nargs='+',
+                                    help="""rewrite values of secrets under
+                                    SECRET_PATHS selected by transform-key
+                                    and/or match. Glob patterns are
+                                    accepted""",
+                                    metavar="SECRET_PATHS")
+        self.subparser.add_argument("--transform-key", nargs='+',
+                                    help="""with transform, only rewrite
+                                    keys matching KEYS glob patterns""",
+                                    metavar="KEYS")
+        self.subparser.add_argument("--match", nargs='?',
+                                    help="""with transform, only rewrite
+                                    values containing VALUE, VALUE being
+                                    replaced in them""",
+                                    metavar="VALUE")
+        self.subparser.add_argument("--replace-with", nargs='?',
+                                    help="""with transform, new value""",
+                                    metavar="VALUE")
+        self.subparser.add_argument("--replace-from", nargs='?',
+                                    help="""with transform, read the new
+                                    value at key KEY of secret SECRET""",
+                                    metavar="SECRET:KEY")
+        self.subparser.add_argument("--preview", action='store_true',
+                                    help="""with transform, display changes
+                                    without writing them""")
+        self.subparser.add_argument("--build-index", nargs='?',
+                                    help="""store an encrypted search index
+                                    of paths segments and key names of all
+                                    secrets under the included paths in
+                                    INDEX_FILE""",
+                                    metavar="INDEX_FILE")
+        self.subparser.add_argument("--index-values", action='store_true',
+                                    help="""with build-index, also index
+                                    salted digests of values n-grams""")
+        self.subparser.add_argument("--index", nargs='?',
+                                    help="""run search against INDEX_FILE
+                                    built with build-index instead of
+                                    vault-addr""",
+                                    metavar="INDEX_FILE")
+        self.subparser.add_argument("--from-snapshot", nargs='?',
+                                    help="""run count, find-duplicates,
+                                    secrets-tree or search against
+                                    SNAPSHOT_FILE instead of vault-addr""",
+                                    metavar="SNAPSHOT_FILE")
+        self.subparser.add_argument("--max-depth", nargs='?',
+                                    help="""only list secrets up to MAX_DEPTH
+                                    folders under each path""",
+                                    metavar="MAX_DEPTH", type=int)
+        self.subparser.add_argument("--limit", nargs='?',
+                                    help="""stop listing once LIMIT secrets
+                                    have been found""",
+                                    metavar="LIMIT", type=int)
+        self.subparser.add_argument("--time-budget", nargs='?',
+                                    help="""stop listing after SECONDS
+                                    seconds""",
+                                    metavar="SECONDS", type=float)
+        self.subparser.add_argument("--metadata-only", action='store_true',
+                                    help="""count secrets and versions of KV
+                                    version 2 mounts from their metadata,
+                                    without reading secrets values""")
+        self.subparser.add_argument("--estimate", action='store_true',
+                                    help="""estimate count by sampling
+                                    folders and secrets instead of listing
+                                    and reading all of them""")
+        self.subparser.add_argument("--sample-fraction", nargs='?',
+                                    help="""fraction of folders and secrets
+                                    sampled at each level by estimate.
+                                    Default: 0.1""",
+                                    metavar="FRACTION", type=float,
+                                    default=0.1)
+        self.subparser.add_argument("--seed", nargs='?',
+                                    help="""random seed used by estimate""",
+                                    metavar="SEED", type=int)
+        self.subparser.add_argument("--shard", nargs='?',
+                                    help="""only process subtrees belonging
+                                    to shard INDEX/COUNT. Output can be
+                                    merged with merge-shards""",
+                                    metavar="INDEX/COUNT")
+        self.subparser.add_argument("--shard-depth", nargs='?',
+                                    help="""depth of the subtrees partitioned
+                                    between shards. Default: 1""",
+                                    metavar="DEPTH", type=int, default=1)
+        self.subparser.add_argument("--merge-shards", nargs='+',
+                                    help="""merge JSON outputs of sharded
+                                    runs into a single result""",
+                                    metavar="SHARD_FILES")
+        self.subparser.add_argument("--output-file", nargs='?',
+                                    help="""also write the result to
+                                    OUTPUT_FILE, gzip compressed if its name
+                                    ends with .gz""",
+                                    metavar="OUTPUT_FILE")
+        self.subparser.add_argument("--output", nargs='?',
+                                    help="""output format. ndjson writes
+                                    one JSON record per line as results are
+                                    produced, table is only available with
+                                    stats. Default: json""",
+                                    choices=["json", "ndjson", "table"],
+                                    default="json")
+        self.subparser.add_argument("--all-mounts", action='store_true',
+                                    help="""add all KV mounts of vault-addr
+                                    to the paths of count, find-duplicates,
+                                    secrets-tree, search or snapshot""")
+        self.subparser.add_argument("--workers", nargs='?',
+                                    help="""number of paths walked
+                                    concurrently and of readers and writers
+                                    of copy-path. Default: 4""",
+                                    metavar="WORKERS", type=int, default=4)
+        self.subparser.add_argument("--namespaces", nargs='+',
+                                    help="""run count, find-duplicates,
+                                    secrets-tree or search in each Vault
+                                    Enterprise namespace of NAMESPACES.
+                                    WORKERS namespaces are processed
+                                    concurrently""",
+                                    metavar="NAMESPACES")
         self.subparser.set_defaults(module_name=self.module_name)
 
-    def read_from_vault(self, path_to_read, vault_client):
+    def get_selector(self, path):
+        """
+        Return the PathMatcher of a glob path, None for a literal path
+
+        :param path: requested path
+        :type path: str
+
+        :return: PathMatcher or None
+        """
+        if not PathMatcher.is_glob(path):
+            return None
+        if path not in self.selectors:
+            self.selectors[path] = PathMatcher([path])
+        return self.selectors[path]
+
+    def path_selects(self, path, secret_path):
+        """
+        Check if a requested path, literal or glob, selects secret_path
+
+        :param path: requested path
+        :type path: str
+        :param secret_path: normalized secret path
+        :type secret_path: str
+
+        :return: bool
+        """
+        selector = self.get_selector(path)
+        if selector:
+            return selector.selects(secret_path)
+        return utils.path_is_under(secret_path, utils.normalize_path(path))
+
+    def paths_containing(self, secret_path, paths):
+        """
+        Return paths of the list selecting secret_path
+
+        :param secret_path: normalized secret path
+        :type secret_path: str
+        :param paths: requested paths
+        :type paths: list(str)
+
+        :return: list(str)
+        """
+        return [path for path in paths
+                if self.path_selects(path, secret_path)]
+
+    def walk_roots(self, paths):
+        """
+        Return paths where the listing starts, overlapping paths being merged
+        and glob patterns being replaced by their literal prefix
+
+        :param paths: requested paths, literal or glob
+        :type paths: list(str)
+
+        :return: list(str)
+        """
+        roots = []
+        for path in paths:
+            if PathMatcher.is_glob(path):
+                root = PathMatcher.literal_prefix(path)
+                if not root:
+                    raise ValueError("Glob pattern '%s' must start with a "
+                                     "literal path" % path)
+                roots.append(root)
+            else:
+                roots.append(path)
+        return utils.merge_paths(self.logger, roots)
+
+    def walk_paths(self, vault_client, paths, excluded=[], read=False,
+                   logical=True):
+        """
+        Yield all secrets selected by paths, each secret being listed once
+        even if paths overlap. Paths and excluded paths can be glob patterns
+        in which case folders which can't match are never listed.
+        Independent paths are walked concurrently by the workers. Paths on
+        a KV version 2 mount are listed through its metadata
+
+        :param vault_client: VaultClient instance
+        :type vault_client: VaultClient
+        :param paths: paths to walk, literal or glob
+        :type paths: list(str)
+        :param excluded: paths to exclude, literal or glob
+        :type excluded: list(str)
+        :param read: also read secrets and yield (path, secret) tuples
+        :type read: bool
+        :param logical: paths are logical secret paths, False if they are
+                        already KV version 2 metadata paths
+        :type logical: bool
+
+        :return: iterator(str) or iterator(tuple(str, dict))
+        """
+        excluded_globs = [exc for exc in excluded if PathMatcher.is_glob(exc)]
+        excluded = [exc for exc in excluded if not PathMatcher.is_glob(exc)]
+        walks = []
+        for root in self.walk_roots(paths):
+            under_root = [
+                path for path in paths
+                if utils.path_is_under(
+                    utils.normalize_path(PathMatcher.literal_prefix(path)),
+                    root
+                )
+            ]
+            root_excluded = excluded
+            root_excluded_globs = excluded_globs
+            mount = None
+            if logical:
+                mount, version = vault_client.kv_mount(root)
+                if version != 2:
+                    mount = None
+            if mount is not None:
+                # v2 secrets are listed under mount/metadata
+                root = self.metadata_subpath(mount, root)
+                under_root = [self.metadata_subpath(mount, path)
+                              for path in under_root]
+                root_excluded = self.metadata_subpaths(mount, excluded)
+                root_excluded_globs = self.metadata_subpaths(
+                    mount, excluded_globs
+                )
+            matcher = None
+            if not any(utils.normalize_path(path) == root
+                       for path in under_root):
+                matcher = PathMatcher(under_root)
+            exclude_matcher = None
+            if len(root_excluded_globs):
+                exclude_matcher = PathMatcher(root_excluded_globs)
+            walks.append(self.root_walk(vault_client, root, root_excluded,
+                                        matcher, exclude_matcher, read,
+                                        mount))
+        yield from utils.parallel_iter(self.logger, walks, self.workers,
+                                       self.pipeline_queue_size)
+
+    @staticmethod
+    def metadata_subpath(mount, path):
+        """
+        Return the metadata path, literal or glob, of a path on a KV
+        version 2 mount
+
+        :param mount: mount path
+        :type mount: str
+        :param path: path under mount
+        :type path: str
+
+        :return: str
+        """
+        rest = utils.normalize_path(path)[len(mount):].strip("/")
+        return mount + "/metadata" + ("/" + rest if rest else "")
+
+    def metadata_subpaths(self, mount, paths):
+        """
+        Return the metadata paths of paths on a KV version 2 mount, paths
+        on other mounts being kept as is
+
+        :param mount: mount path
+        :type mount: str
+        :param paths: paths, literal or glob
+        :type paths: list(str)
+
+        :return: list(str)
+        """
+        return [
+            self.metadata_subpath(mount, path)
+            if utils.path_is_under(
+                utils.normalize_path(PathMatcher.literal_prefix(path)), mount
+            ) else path
+            for path in paths
+        ]
+
+    def root_walk(self, vault_client, root, excluded, matcher,
+                  exclude_matcher, read, mount=None):
+        """
+        Return a function walking one root path
+
+        :param vault_client: VaultClient instance
+        :type vault_client: VaultClient
+        :param root: normalized root path
+        :type root: str
+        :param excluded: literal paths to exclude
+        :type excluded: list(str)
+        :param matcher: glob patterns to select under root
+        :type matcher: PathMatcher
+        :param exclude_matcher: glob patterns to exclude
+        :type exclude_matcher: PathMatcher
+        :param read: also read secrets and yield (path, secret) tuples
+        :type read: bool
+        :param mount: KV version 2 mount if root is a metadata path, walked
+                      secrets being yielded with their logical path
+        :type mount: str
+
+        :return: function
+        """
+        read_secret = self.secret_reader(vault_client)
+
+        def walk():
+            self.logger.debug("Walking '%s'" % root)
+            for secret_path in vault_client.secrets_tree_iter(
+                    root, excluded, matcher, exclude_matcher,
+                    self.walk_budget, self.shard):
+                if mount is not None:
+                    secret_path = mount + \
+                        secret_path[len(mount + "/metadata"):]
+                if read:
+                    secret = read_secret(secret_path)
+                    if secret is not None:
+                        yield secret_path, secret
+                else:
+                    yield secret_path
+        return walk
+
+    def discover_mounts(self, vault_client):
+        """
+        Return paths of all KV mounts of a Vault instance, KV version 2
+        mounts being walked through their metadata
+
+        :param vault_client: VaultClient instance
+        :type vault_client: VaultClient
+
+        :return: list(str)
+        """
+        self.logger.debug("Discovering KV mounts")
+        mounts = []
+        secrets_engines = vault_client.secret_list()
+        for mount in sorted(secrets_engines):
+            engine = secrets_engines[mount]
+            if engine["type"] not in ["kv", "generic"]:
+                continue
+            mounts.append(utils.normalize_path(mount))
+        self.logger.debug("KV mounts found: %s" % mounts)
+        return mounts
+
+    def command_paths(self, paths, argument=None):
+        """
+        Return paths given to a command, with all KV mounts if all-mounts
+        is specified
+
+        :param paths: paths given to the command
+        :type paths: list(str) or None
+        :param argument: argument name to report if no path is given
+        :type argument: str
+
+        :return: list(str)
+        """
+        paths = list(paths) if paths else []
+        if self.mounts:
+            paths += [mount for mount in self.mounts if mount not in paths]
+        if argument and not len(paths):
+            raise ValueError("Following arguments are missing %s" %
+                             [argument])
+        return paths
+
+    def output_result(self, command, result, extra=None):
+        """
+        Log a command result as JSON and write it to the output file if
+        needed. Results of a sharded run are wrapped with the shard
+        description so they can be merged with kv_merge_shards
+
+        :param command: command name
+        :type command: str
+        :param result: command result
+        :type result: dict or list
+        :param extra: additional data needed to merge sharded results
+        :type extra: dict
+
+        :return: dict or list
+        """
+        self.result = result
+        if not self.report:
+            return result
+        if self.records:
+            self.records.write_result(result)
+            return result
+        if self.shard:
+            result = {"command": command,
+                      "shard": [self.shard.index, self.shard.count],
+                      "result": result}
+            if extra:
+                result.update(extra)
+        # PathStore objects are dumped as lists
+        dumped = json.dumps(result, indent=4, default=list)
+        self.logger.info(dumped)
+        if self.output_file:
+            self.logger.debug("Writing result to '%s'" % self.output_file)
+            with utils.open_file(self.output_file, 'w') as fd:
+                fd.write(dumped + "\n")
+        return result
+
+    def output_streamed(self):
+        """
+        End a result streamed as records, with a truncation marker record if
+        the walk budget stopped the walk
+
+        :return: dict, the truncation marker if any
+        """
+        result = self.mark_truncated({})
+        if "__truncated__" in result:
+            self.records.write(result)
+        self.result = result
+        return result
+
+    def mark_truncated(self, result):
+        """
+        Add a truncation marker to a result if the walk budget stopped the walk
+
+        :param result: command result
+        :type result: dict or list
+
+        :return: dict or list
+        """
+        if not self.walk_budget or not self.walk_budget.is_truncated():
+            return result
+        marker = self.walk_budget.marker()
+        self.logger.debug("Partial results, walk stopped by %s after %s "
+                          "secrets" %
+                          (marker["reason"], marker["secrets_listed"]))
+        if isinstance(result, dict):
+            result = dict(result)
+            result["__truncated__"] = marker
+            return result
+        return {"results": result, "__truncated__": marker}
+
+    def copy_walk(self, vault_client, copy_from):
         """
-        Read secret tree from Vault
+        Yield secrets to copy under a path
 
-        :param path_to_read: secret path to read and return
-        :type path_to_read: str
         :param vault_client: VaultClient instance
         :type vault_client: VaultClient
-        :return dict(dict)
+        :param copy_from: source path
+        :type copy_from: str
+
+        :return: iterator(str)
         """
         self.logger.debug("Reading kv tree")
-        kv_full = {}
-        kv_list = vault_client.secrets_tree_list(
-            path_to_read
-        )
-        self.logger.debug("Secrets found: " + str(kv_list))
-        for kv in kv_list:
-            kv_full[kv] = vault_client.read_secret(kv)
-        return kv_full
+        for secret in vault_client.secrets_tree_iter(copy_from,
+                                                     shard=self.shard):
+            if utils.normalize_path(secret) == \
+                    utils.normalize_path(copy_from):
+                raise AttributeError(
+                    "--copy-path should not be used to copy individual "
+                    "secrets. Use --copy-secret instead"
+                )
+            self.logger.debug("Secret found: " + secret)
+            yield secret
 
-    def push_to_vault(self, exported_path, exported_kv, target_path,
-                      vault_client):
+    def target_secret_path(self, exported_path, secret, target_path):
         """
-        Push exported kv to Vault
+        Return the path of a copied secret on the target
 
         :param exported_path: export root path
         :type exported_path: str
-        :param target_path: push kv to this path
+        :param secret: source secret path
+        :type secret: str
+        :param target_path: target root path
         :type target_path: str
-        :param exported_kv: Exported KV store
-        :type exported_kv: dict
+
+        :return: str
+        """
+        return utils.list_to_string(
+            self.logger,
+            target_path.split('/') +
+            secret.split('/')[len(exported_path.split('/')):],
+            separator="/"
+        )
+
+    def new_pipeline(self):
+        """
+        Return a pipeline with workers readers and workers writers
+
+        :return: KVPipeline
+        """
+        return KVPipeline(self.base_logger, readers=self.workers,
+                          writers=self.workers,
+                          queue_size=self.pipeline_queue_size * self.workers)
+
+    def secret_reader(self, vault_client, read_function=None):
+        """
+        Return a pipeline read function reading listed secrets, through
+        their data path on KV version 2 mounts. A secret deleted or
+        destroyed since it was listed is read as None, so writers wrapped by
+        skip_deleted skip it
+
         :param vault_client: VaultClient instance
         :type vault_client: VaultClient
+        :param read_function: function of the path and the secret returning
+                              what is given to writers, the secret if None
+        :type read_function: function
+
+        :return: function
         """
-        self.logger.debug("Pushing exported kv to Vault")
-        for secret in exported_kv:
+        def read(secret_path):
+            mount, version = vault_client.kv_mount(secret_path)
+            if version == 2:
+                response = vault_client.read(
+                    self.data_path(mount, secret_path)
+                )
+                secret = response.get("data") if response else None
+            else:
+                try:
+                    secret = vault_client.read_secret(secret_path)
+                except TypeError:
+                    secret = None
+            if secret is None:
+                self.logger.warning("'%s' was deleted since it was listed, "
+                                    "skipping it" % secret_path)
+                return None
+            if read_function is None:
+                return secret
+            return read_function(secret_path, secret)
+        return read
 
-            secret_target_path = utils.list_to_string(
-                self.logger,
-                target_path.split('/') + secret.split('/')[len(exported_path.split('/')):],
-                separator="/"
-            )
-            self.logger.info(
-                "Exporting secret: " + secret + " to " + secret_target_path
-            )
-            vault_client.write(secret_target_path, exported_kv[secret],
-                               hide_all=True)
+    @staticmethod
+    def skip_deleted(write_function):
+        """
+        Return a pipeline write function skipping secrets read as None by
+        secret_reader
+
+        :param write_function: function writing a secret and returning the
+                               name of the counter to increment
+        :type write_function: function
+
+        :return: function
+        """
+        def write(secret_path, secret):
+            if secret is None:
+                return "secrets_deleted"
+            return write_function(secret_path, secret)
+        return write
 
     def kv_copy_secret(self, vault_addr, vault_token, vault_target_addr,
                        vault_target_token, copy_from, copy_to):
@@ -216,11 +886,325 @@ class VaultManagerKV:
                          (copy_from, copy_to))
         return True
 
+    def parse_targets(self, targets, default_rate=None):
+        """
+        Parse targets given as ADDR=TOKEN_ENV[@RATE], tokens being read from
+        the TOKEN_ENV environment variables
+
+        :param targets: targets descriptions
+        :type targets: list(str)
+        :param default_rate: writes per second of targets without RATE
+        :type default_rate: float
+
+        :return: list(tuple(str, str, float)) address, token and rate
+        """
+        parsed = []
+        for target in targets:
+            self.logger.debug("Parsing target '%s'" % target)
+            if "=" not in target:
+                raise ValueError("Target '%s' should be ADDR=TOKEN_ENV[@RATE]"
+                                 % target)
+            addr, token_env = target.rsplit("=", 1)
+            rate = default_rate
+            if "@" in token_env:
+                token_env, rate = token_env.split("@", 1)
+                try:
+                    rate = float(rate)
+                except ValueError:
+                    raise ValueError("Invalid rate limit in target '%s'" %
+                                     target)
+            token = os.getenv(token_env, None)
+            if not token:
+                raise ValueError("Token of target '%s' not found in '%s'" %
+                                 (addr, token_env))
+            if addr in [target[0] for target in parsed]:
+                raise ValueError("Target '%s' given several times" % addr)
+            parsed.append((addr, token, rate))
+        return parsed
+
+    def new_fan_out(self, targets):
+        """
+        Connect to all targets and return a fan out writing to all of them.
+        A target which can't be reached or authenticated to is reported as
+        failed and the others are still written to
+
+        :param targets: address, token and rate limit of each target
+        :type targets: list(tuple(str, str, float))
+
+        :return: KVFanOut
+        """
+        fan_out = KVFanOut(self.base_logger, writers=self.workers,
+                           queue_size=self.pipeline_queue_size * self.workers,
+                           submit_timeout=self.target_timeout)
+        for addr, token, rate in targets:
+            try:
+                vault_client = self.connect_to_vault(addr, token)
+                if not vault_client.is_authenticated():
+                    raise ValueError("authentication failed")
+            except Exception as e:
+                self.logger.error("Target '%s' is unavailable: %s" %
+                                  (addr, str(e)))
+                fan_out.add_failed_target(addr, str(e))
+                continue
+            fan_out.add_target(addr, vault_client, rate)
+        if not fan_out.healthy_targets():
+            fan_out.close()
+            raise ValueError("No target available")
+        return fan_out
+
+    def report_fan_out(self, report):
+        """
+        Log failures of each target of a fan out
+
+        :param report: report returned by KVFanOut.close
+        :type report: dict
+
+        :return: bool True if all writes succeeded
+        """
+        success = True
+        for target in report:
+            if report[target].get("error"):
+                success = False
+                self.logger.error("'%s' was unavailable: %s" %
+                                  (target, report[target]["error"]))
+                continue
+            if report[target]["failed"]:
+                success = False
+                self.logger.error("%s writes failed on '%s'" %
+                                  (report[target]["failed"], target))
+            if report[target]["dropped"]:
+                success = False
+                self.logger.error("%s writes dropped on '%s', too slow" %
+                                  (report[target]["dropped"], target))
+        return success
+
+    def kv_copy_secret_to_targets(self, vault_addr, vault_token, targets,
+                                  copy_from, copy_to):
+        """
+        Read a secret once and copy it to several Vault instances
+
+        :param vault_addr: Vault source instance URL
+        :type vault_addr: str
+        :param vault_token: Vault source token
+        :type vault_token: str
+        :param targets: address, token and rate limit of each target
+        :type targets: list(tuple(str, str, float))
+        :param copy_from: Source secret
+        :type copy_from: str
+        :param copy_to: Target secret
+        :type copy_to: str
+
+        :return: bool
+        """
+        self.logger.debug("KV copy secret to targets starting")
+        self.logger.info("Copying %s from %s to %s on %s" %
+                         (copy_from, vault_addr, copy_to,
+                          [target[0] for target in targets]))
+        vault_source_client = self.connect_to_vault(vault_addr, vault_token)
+        secret_to_copy = vault_source_client.read(copy_from)
+        if not len(secret_to_copy):
+            raise AttributeError("'%s' is not a valid secret. If you're trying "
+                                 "to copy a path, use --copy-path instead" %
+                                 copy_from)
+        fan_out = self.new_fan_out(targets)
+        fan_out.submit(copy_to, secret_to_copy)
+        report = fan_out.close()
+        self.output_result("copy-secret", {"targets": report})
+        return self.report_fan_out(report)
+
+    def kv_copy_path_to_targets(self, vault_addr, vault_token, targets,
+                                copy_from, copy_to, max_failures=None):
+        """
+        Read secrets of a path once and copy them to several Vault instances
+        at the same time. A secret which can't be read doesn't stop the
+        others until max_failures secrets failed
+
+        :param vault_addr: Vault source instance URL
+        :type vault_addr: str
+        :param vault_token: Vault source token
+        :type vault_token: str
+        :param targets: address, token and rate limit of each target
+        :type targets: list(tuple(str, str, float))
+        :param copy_from: Source path
+        :type copy_from: str
+        :param copy_to: Target path
+        :type copy_to: str
+        :param max_failures: number of failed reads stopping the copy
+        :type max_failures: int
+
+        :return: bool
+        """
+        self.logger.debug("KV copy path to targets starting")
+        self.logger.info("Copying %s from %s to %s on %s" %
+                         (copy_from, vault_addr, copy_to,
+                          [target[0] for target in targets]))
+        vault_source_client = self.connect_to_vault(vault_addr, vault_token)
+        fan_out = self.new_fan_out(targets)
+        failed = {}
+        failed_lock = threading.Lock()
+        read_source = self.secret_reader(vault_source_client)
+
+        def read_secret(secret):
+            # read errors are reported by writers with the other failures
+            try:
+                return read_source(secret)
+            except Exception as e:
+                return e
+
+        def write_secret(secret, secret_content):
+            if isinstance(secret_content, Exception):
+                self.logger.error("Failed to read '%s': %s" %
+                                  (secret, secret_content))
+                with failed_lock:
+                    failed[secret] = str(secret_content)
+                    failures = len(failed)
+                if max_failures and failures >= max_failures:
+                    raise ValueError("%s secrets failed, stopping" % failures)
+                return "failed"
+            secret_target_path = self.target_secret_path(copy_from, secret,
+                                                         copy_to)
+            self.logger.info(
+                "Exporting secret: " + secret + " to " + secret_target_path
+            )
+            fan_out.submit(secret_target_path, secret_content)
+            return "secrets_read"
+
+        stopped = False
+        pipeline = self.new_pipeline()
+        try:
+            counts = pipeline.run(
+                self.copy_walk(vault_source_client, copy_from),
+                read_secret,
+                self.skip_deleted(write_secret)
+            )
+        except ValueError as e:
+            if not max_failures or len(failed) < max_failures:
+                fan_out.close()
+                raise
+            self.logger.error("Copy stopped: %s" % str(e))
+            stopped = True
+            counts = dict(pipeline.counts)
+        report = fan_out.close()
+        if not counts.get("secrets_read", 0) and not failed and \
+                not self.shard:
+            raise AttributeError("No path to copy")
+        result = {
+            "secrets_read": counts.get("secrets_read", 0),
+            "targets": report
+        }
+        if failed:
+            result["failed"] = {secret: failed[secret]
+                                for secret in sorted(failed)}
+            result["stopped"] = stopped
+            self.logger.error("%s secrets failed to be read" % len(failed))
+        self.output_result("copy-path", result)
+        return self.report_fan_out(report) and not failed
+
+    def read_digests(self, vault_client, path,
+                     digest_function=utils.secret_digest, versions=None,
+                     secrets=None):
+        """
+        Read all secrets under path concurrently and return their digests
+
+        :param vault_client: VaultClient instance
+        :type vault_client: VaultClient
+        :param path: path to read
+        :type path: str
+        :param digest_function: function returning the digest of a secret
+        :type digest_function: function
+        :param versions: filled with the version of secrets on a KV version
+                         2 mount, read with their content
+        :type versions: dict
+        :param secrets: secrets under path to read instead of listing it
+        :type secrets: list(str)
+
+        :return: PathStore(str) digests by normalized secret path
+        """
+        self.logger.debug("Reading digests of secrets under '%s'" % path)
+        digests = PathStore()
+        mount, kv_version = vault_client.kv_mount(path)
+        read_secret = self.secret_reader(
+            vault_client, lambda secret, content: (content, None)
+        )
+        if versions is not None and kv_version == 2:
+            def read_secret(secret):
+                # content and version are read in a single request
+                response = vault_client.read(self.data_path(mount, secret))
+                if not response or not response.get("data"):
+                    self.logger.warning("'%s' was deleted since it was "
+                                        "listed, skipping it" % secret)
+                    return None
+                return response["data"], self.version_signal(
+                    response["metadata"]["version"], response["metadata"]
+                )
+
+        def store_digest(secret, read):
+            secret_content, secret_version = read
+            digests[secret] = digest_function(secret_content)
+            if secret_version is not None:
+                versions[secret] = secret_version
+            return "secrets_read"
+
+        # a single writer keeps PathStore updates in one thread
+        KVPipeline(self.base_logger, readers=self.workers, writers=1,
+                   queue_size=self.pipeline_queue_size * self.workers).run(
+            secrets if secrets is not None else
+            self.logical_tree_iter(vault_client, path),
+            read_secret,
+            self.skip_deleted(store_digest)
+        )
+        return digests
+
+    def logical_tree_iter(self, vault_client, path):
+        """
+        Yield all secrets under path, secrets on a KV version 2 mount being
+        listed through its metadata
+
+        :param vault_client: VaultClient instance
+        :type vault_client: VaultClient
+        :param path: path to list
+        :type path: str
+
+        :return: iterator(str)
+        """
+        mount, version = vault_client.kv_mount(path)
+        if version != 2:
+            yield from vault_client.secrets_tree_iter(path)
+            return
+        for secret in vault_client.secrets_tree_iter(
+                self.metadata_subpath(mount, path)):
+            yield mount + secret[len(mount + "/metadata"):]
+
+    @staticmethod
+    def version_signal(version, version_metadata):
+        """
+        Return an identifier of a version of a secret on a KV version 2
+        mount. It changes on every write, even if the secret metadata were
+        deleted and the secret written again from version 1
+
+        :param version: version number
+        :type version: int
+        :param version_metadata: metadata of this version
+        :type version_metadata: dict
+
+        :return: str or None if the version is deleted or destroyed
+        """
+        if version_metadata.get("deletion_time") or \
+                version_metadata.get("destroyed"):
+            return None
+        return "%s:%s" % (version, version_metadata.get("created_time"))
+
     def kv_copy_path(self, vault_addr, vault_token, vault_target_addr,
-                     vault_target_token, copy_from, copy_to):
+                     vault_target_token, copy_from, copy_to, sync=False,
+                     prune=False, journal_file=None, resume=False,
+                     max_failures=None):
         """
         Method running the copy_path function of KV module
 
+        A secret which can't be read or written doesn't stop the copy until
+        max_failures secrets failed. Failed secrets are reported with their
+        error and never pruned
+
         :param vault_addr: Vault source instance URL
         :type vault_addr: str
         :param vault_token: Vault source token
@@ -233,74 +1217,618 @@ class VaultManagerKV:
         :type copy_from: str
         :param copy_to: Target path
         :type copy_to: str
+        :param sync: only write secrets missing or different on the target
+        :type sync: bool
+        :param prune: with sync, delete target secrets missing on the source
+        :type prune: bool
+        :param journal_file: file recording completed writes
+        :type journal_file: str
+        :param resume: skip writes recorded in journal_file
+        :type resume: bool
+        :param max_failures: number of failed secrets stopping the copy
+        :type max_failures: int
 
         :return: bool
         """
         self.logger.debug("KV copy path starting")
+        if resume and not journal_file:
+            raise ValueError("--resume can only be used with --journal")
+        if prune and not sync:
+            raise ValueError("--prune can only be used with --sync")
+        if prune and self.shard:
+            raise ValueError("--prune can't be used with --shard")
         self.logger.info("Copying %s from %s to %s on %s" %
                          (copy_from, vault_addr, copy_to, vault_target_addr))
         vault_source_client = self.connect_to_vault(vault_addr, vault_token)
-        exported_kv = self.read_from_vault(copy_from, vault_source_client)
-        if not len(exported_kv):
-            raise AttributeError("No path to copy")
-        if len(exported_kv) == 1 and list(exported_kv.keys())[0] == copy_from:
-            raise AttributeError(
-                "--copy-path should not be used to copy individual secrets."
-                " Use --copy-secret instead"
-            )
         vault_target_client = self.connect_to_vault(
             vault_target_addr, vault_target_token
         )
+        target_digests = None
+        synced = set()
+        if sync:
+            target_digests = self.read_digests(vault_target_client, copy_to)
+        journal = None
+        journaled = set()
+        skipped = [0]
+        failed = {}
+        failed_lock = threading.Lock()
+        if journal_file:
+            journal = KVJournal(self.base_logger, journal_file)
+            if resume:
+                journaled = journal.load()
+            journal.open(resume)
+
+        def walk():
+            for secret in self.copy_walk(vault_source_client, copy_from):
+                secret_target_path = self.target_secret_path(
+                    copy_from, secret, copy_to
+                )
+                if (secret, secret_target_path) in journaled:
+                    self.logger.debug("'%s' already copied" % secret)
+                    # journaled secrets must not be pruned
+                    synced.add(utils.normalize_path(secret_target_path))
+                    skipped[0] += 1
+                    continue
+                yield secret
+
+        def read_secret(secret):
+            # read errors are reported by writers with the other failures
+            try:
+                return vault_source_client.read_secret(secret)
+            except TypeError:
+                # deleted between listing and reading
+                return ValueError("Secret not found")
+            except Exception as e:
+                return e
+
+        def record_failure(secret, error):
+            self.logger.error("Failed to copy '%s': %s" % (secret, error))
+            with failed_lock:
+                failed[secret] = str(error)
+                # the target of a failed secret must not be pruned
+                synced.add(utils.normalize_path(
+                    self.target_secret_path(copy_from, secret, copy_to)
+                ))
+                failures = len(failed)
+            if max_failures and failures >= max_failures:
+                raise ValueError("%s secrets failed, stopping" % failures)
+            return "failed"
+
+        def write_secret(secret, secret_content):
+            if isinstance(secret_content, Exception):
+                return record_failure(secret, secret_content)
+            try:
+                counter = copy_secret(secret, secret_content)
+            except Exception as e:
+                return record_failure(secret, e)
+            if journal:
+                journal.append(
+                    secret, self.target_secret_path(copy_from, secret, copy_to)
+                )
+            return counter
+
+        def copy_secret(secret, secret_content):
+            secret_target_path = self.target_secret_path(copy_from, secret,
+                                                         copy_to)
+            if target_digests is None:
+                self.logger.info(
+                    "Exporting secret: " + secret + " to " + secret_target_path
+                )
+                vault_target_client.write(secret_target_path, secret_content,
+                                          hide_all=True)
+                return "secrets_copied"
+            synced.add(utils.normalize_path(secret_target_path))
+            if secret_target_path not in target_digests:
+                counter = "created"
+            elif target_digests[secret_target_path] != \
+                    utils.secret_digest(secret_content):
+                counter = "updated"
+            else:
+                self.logger.debug("'%s' is unchanged" % secret_target_path)
+                return "unchanged"
+            self.logger.info("Secret %s: %s to %s" %
+                             (counter, secret, secret_target_path))
+            vault_target_client.write(secret_target_path, secret_content,
+                                      hide_all=True)
+            return counter
+
+        def delete_secret(secret, secret_content):
+            self.logger.info("Deleting '%s'" % secret)
+            vault_target_client.delete(secret)
+            return "deleted"
+
+        # secrets are streamed from source readers to target writers
+        stopped = False
+        pipeline = self.new_pipeline()
         try:
-            self.push_to_vault(
-                copy_from, exported_kv, copy_to, vault_target_client
-            )
+            try:
+                counts = pipeline.run(walk(), read_secret, write_secret)
+            except ValueError as e:
+                if not max_failures or len(failed) < max_failures:
+                    raise
+                self.logger.error("Copy stopped: %s" % str(e))
+                stopped = True
+                counts = dict(pipeline.counts)
+            finally:
+                if journal:
+                    journal.close()
+            if prune and not stopped:
+                to_delete = target_digests.difference(PathStore(synced))
+                counts.update(KVPipeline(
+                    self.base_logger, readers=1, writers=self.workers
+                ).run(to_delete, lambda secret: None, delete_secret))
         except ValueError as e:
             self.logger.error("Failed to copy path '%s' to '%s'" %
                               (copy_from, copy_to))
             self.logger.error(e)
             return False
-        self.logger.info("Path successfully copied")
-        return True
+        if not sync:
+            counts = {"secrets_copied": counts.get("secrets_copied", 0)}
+        else:
+            counts = {counter: counts.get(counter, 0) for counter in
+                      ["unchanged", "created", "updated", "deleted"]}
+        if skipped[0]:
+            self.logger.info("%s secrets already copied skipped" % skipped[0])
+        if not sum(counts.values()) and not skipped[0] and not failed and \
+                not self.shard:
+            raise AttributeError("No path to copy")
+        if failed:
+            counts["failed"] = {secret: failed[secret]
+                                for secret in sorted(failed)}
+            counts["stopped"] = stopped
+            self.logger.error("%s secrets failed to copy" % len(failed))
+        else:
+            self.logger.info("Path successfully copied")
+        if sync or self.shard or failed:
+            self.output_result("copy-path", counts)
+        return not failed
 
-    def kv_delete(self, vault_addr, vault_token, paths):
+    def read_subtrees(self, vault_client, root, nodes, tree, digest_function,
+                      versions):
         """
-        Method running the delete function of KV module
+        Read subtrees of root and add their digests to a Merkle tree
 
-        :param vault_addr: Vault instance URL
-        :type vault_addr: str
-        :param vault_token: Vault token
-        :type vault_token: str
-        :param paths: Paths to count
-        :type paths: list(str)
+        :param vault_client: VaultClient instance
+        :type vault_client: VaultClient
+        :param root: root path of the tree
+        :type root: str
+        :param nodes: secrets or folders relative to root, '' for root
+        :type nodes: list(str)
+        :param tree: tree to fill
+        :type tree: MerkleTree
+        :param digest_function: function returning the digest of a secret
+        :type digest_function: function
+        :param versions: filled with versions of secrets on a KV version 2
+                         mount, by path relative to root
+        :type versions: dict
+        """
+        root = utils.normalize_path(root)
+        folders = [node for node in nodes if not node or node.endswith("/")]
+        # known secrets are read together without listing them
+        secrets = [root + "/" + node for node in nodes
+                   if node not in folders]
+        reads = [(root + "/" + node.rstrip("/") if node else root, None)
+                 for node in folders]
+        if len(secrets):
+            reads.append((root, secrets))
+        for path, path_secrets in reads:
+            read_versions = {}
+            digests = self.read_digests(vault_client, path, digest_function,
+                                        read_versions, path_secrets)
+            for secret, digest in digests.items():
+                if secret == root:
+                    raise AttributeError("--diff should be used to compare "
+                                         "secrets folders")
+                tree.add(secret[len(root) + 1:], digest)
+            for secret, version in read_versions.items():
+                versions[secret[len(root) + 1:]] = version
 
-        :return: dict of deleted secrets
+    def list_relative(self, vault_client, root):
         """
-        self.logger.debug("KV delete starting")
-        vault_client = self.connect_to_vault(
-            vault_addr,
-            vault_token
+        List secrets under root without reading them
+
+        :param vault_client: VaultClient instance
+        :type vault_client: VaultClient
+        :param root: root path of the tree
+        :type root: str
+
+        :return: set(str) secrets paths relative to root
+        """
+        root = utils.normalize_path(root)
+        return set(utils.normalize_path(secret)[len(root) + 1:]
+                   for secret in self.logical_tree_iter(vault_client, root))
+
+    def refresh_cached_tree(self, tree, listed, read_nodes):
+        """
+        Remove cached secrets which are not listed anymore and return listed
+        secrets missing from the cache
+
+        :param tree: cached tree
+        :type tree: MerkleTree
+        :param listed: secrets currently listed, relative to the tree root
+        :type listed: set(str)
+        :param read_nodes: secrets or folders which are read anyway
+        :type read_nodes: list(str)
+
+        :return: list(str) secrets to read
+        """
+        for path in [path for path in tree.leaves if path not in listed]:
+            tree.remove_under(path)
+        return sorted(
+            path for path in listed if path not in tree.leaves and
+            not any(path == node or (node.endswith("/") or not node) and
+                    path.startswith(node) for node in read_nodes)
         )
-        for to_delete in paths:
-            self.logger.info("Deleting all secrets at and under %s at %s" %
-                             (to_delete,
-                              os.environ["VAULT_ADDR"]))
-            secrets_to_delete = vault_client.secrets_tree_list(to_delete)
-            if len(secrets_to_delete):
-                for secret in secrets_to_delete:
-                    self.logger.info("Deleting '" + secret + "'")
-                    vault_client.delete(secret)
-                self.logger.debug("%s secrets at '%s' successfully deleted" %
-                                  (len(secrets_to_delete), to_delete))
-            else:
-                self.logger.error("No secrets to delete at '%s'" % to_delete)
-        return secrets_to_delete
 
-    def kv_count(self, vault_addr, vault_token, paths, excluded=[]):
+    def check_cached_versions(self, vault_client, root, tree, versions):
         """
-        Method running the count function of KV module
+        Remove from a cached tree the secrets which can't be proven unchanged
+        and return them. Only secrets on a KV version 2 mount whose current
+        version is still the cached one are kept, their metadata being read
+        instead of their content
 
-        :param vault_addr: Vault instance URL
+        :param vault_client: VaultClient instance
+        :type vault_client: VaultClient
+        :param root: root path of the tree
+        :type root: str
+        :param tree: cached tree
+        :type tree: MerkleTree
+        :param versions: cached versions by path relative to root, updated
+        :type versions: dict
+
+        :return: list(str) secrets to read, [''] if the whole tree must be
+                 read again
+        """
+        root = utils.normalize_path(root)
+        mount, kv_version = vault_client.kv_mount(root)
+        if kv_version != 2:
+            # KV version 1 secrets have no version
+            tree.remove_under("")
+            versions.clear()
+            return [""]
+        unchanged = set()
+
+        def read_version(path):
+            metadata = vault_client.read(
+                self.metadata_subpath(mount, root + "/" + path)
+            )
+            if not metadata:
+                return None
+            current = metadata["current_version"]
+            return self.version_signal(
+                current, metadata["versions"].get(str(current)) or {}
+            )
+
+        def check_version(path, version):
+            if version is not None and version == versions[path]:
+                unchanged.add(path)
+                return "unchanged"
+            return "changed"
+
+        KVPipeline(self.base_logger, readers=self.workers, writers=1,
+                   queue_size=self.pipeline_queue_size * self.workers
+                   ).run([path for path in tree.leaves if path in versions],
+                         read_version, check_version)
+        to_read = sorted(path for path in tree.leaves if path not in unchanged)
+        for path in to_read:
+            tree.remove_under(path)
+        for path in [path for path in versions if path not in unchanged]:
+            del versions[path]
+        return to_read
+
+    def load_diff_cache(self, cache_file, cache_id, key_check, max_age):
+        """
+        Return the cached trees of a previous diff if they can be reused
+
+        :param cache_file: JSON cache file
+        :type cache_file: str
+        :param cache_id: identifier of the compared paths
+        :type cache_id: str
+        :param key_check: digest of a constant with the current digest key
+        :type key_check: str
+        :param max_age: maximum age of the cached trees in seconds
+        :type max_age: float
+
+        :return: dict or None
+        """
+        if not os.path.isfile(cache_file):
+            self.logger.debug("No diff cache found at '%s'" % cache_file)
+            return None
+        with open(cache_file, 'r') as fd:
+            try:
+                cached = json.load(fd)["diffs"][cache_id]
+            except (ValueError, KeyError):
+                self.logger.debug("'%s' not found in diff cache" % cache_id)
+                return None
+        if cached["key_check"] != key_check:
+            self.logger.debug("Diff cache computed with another digest key")
+            return None
+        if time.time() - cached["created"] > max_age:
+            self.logger.debug("Diff cache is older than %s seconds" % max_age)
+            return None
+        return cached
+
+    def save_diff_cache(self, cache_file, cache_id, cached):
+        """
+        Store the trees of a diff in the cache file
+
+        :param cache_file: JSON cache file
+        :type cache_file: str
+        :param cache_id: identifier of the compared paths
+        :type cache_id: str
+        :param cached: trees and differing nodes to store
+        :type cached: dict
+        """
+        self.logger.debug("Saving diff cache in '%s'" % cache_file)
+        cache = {"diffs": {}}
+        if os.path.isfile(cache_file):
+            with open(cache_file, 'r') as fd:
+                try:
+                    cache = json.load(fd)
+                except ValueError:
+                    self.logger.debug("Invalid diff cache, overwriting it")
+        cache["diffs"][cache_id] = cached
+        with open(cache_file, 'w') as fd:
+            json.dump(cache, fd)
+
+    def kv_diff(self, vault_addr, vault_token, vault_target_addr,
+                vault_target_token, src_path, dst_path, cache_file=None,
+                cache_max_age=3600):
+        """
+        Compare secrets under src_path on vault_addr with secrets under
+        dst_path on vault_target_addr using Merkle hashes of both trees.
+        Vault doesn't expose hashes of its folders, so all secrets of both
+        trees are read and only the comparison descends into differing
+        folders.
+
+        With a cache file, a diff run again before cache_max_age lists both
+        trees again and reads subtrees which differed during the previous
+        run, secrets which were not cached and cached secrets which can't be
+        proven unchanged. Only secrets on KV version 2 mounts whose current
+        version is still the cached one keep their cached digests, secrets
+        on KV version 1 mounts are always read
+
+        :param vault_addr: Vault source instance URL
+        :type vault_addr: str
+        :param vault_token: Vault source token
+        :type vault_token: str
+        :param vault_target_addr: Vault target instance URL
+        :type vault_target_addr: str
+        :param vault_target_token: Vault target token
+        :type vault_target_token: str
+        :param src_path: source path
+        :type src_path: str
+        :param dst_path: target path
+        :type dst_path: str
+        :param cache_file: JSON file storing trees between runs
+        :type cache_file: str
+        :param cache_max_age: maximum age of the cached trees in seconds
+        :type cache_max_age: float
+
+        :return: dict
+        """
+        self.logger.debug("KV diff starting")
+        vault_source_client = self.connect_to_vault(vault_addr, vault_token)
+        vault_target_client = self.connect_to_vault(
+            vault_target_addr, vault_target_token
+        )
+        if cache_file:
+            # cached digests must not allow guessing values offline
+            digest_key = utils.get_digest_key(self.logger)
+        else:
+            digest_key = os.urandom(32)
+        key_check = utils.value_digest("vault-manager", digest_key)
+        cache_id = "|".join([vault_addr, utils.normalize_path(src_path),
+                             vault_target_addr, utils.normalize_path(dst_path)])
+        cached = None
+        if cache_file:
+            cached = self.load_diff_cache(cache_file, cache_id, key_check,
+                                          cache_max_age)
+        cached_secrets = 0
+        if cached:
+            src_tree = MerkleTree(cached["src"])
+            dst_tree = MerkleTree(cached["dst"])
+            src_versions = dict(cached.get("src_versions") or {})
+            dst_versions = dict(cached.get("dst_versions") or {})
+            differing = cached["differing"]
+            for node in differing:
+                src_tree.remove_under(node)
+                dst_tree.remove_under(node)
+            # listings are cheap: secrets added or removed on either side
+            # since the cache was written are always found
+            with concurrent.futures.ThreadPoolExecutor(2) as pool:
+                src_listed, dst_listed = pool.map(
+                    self.list_relative,
+                    [vault_source_client, vault_target_client],
+                    [src_path, dst_path]
+                )
+            src_to_read = differing + self.refresh_cached_tree(
+                src_tree, src_listed, differing
+            )
+            dst_to_read = differing + self.refresh_cached_tree(
+                dst_tree, dst_listed, differing
+            )
+            # a cached digest is never trusted without a version to check
+            with concurrent.futures.ThreadPoolExecutor(2) as pool:
+                src_changed, dst_changed = pool.map(
+                    self.check_cached_versions,
+                    [vault_source_client, vault_target_client],
+                    [src_path, dst_path], [src_tree, dst_tree],
+                    [src_versions, dst_versions]
+                )
+            # a side without versions is read again entirely
+            src_to_read = [""] if "" in src_changed else \
+                src_to_read + src_changed
+            dst_to_read = [""] if "" in dst_changed else \
+                dst_to_read + dst_changed
+            cached_secrets = len(src_tree.leaves) + len(dst_tree.leaves)
+            self.logger.debug("Reading %s subtrees which differed, %s "
+                              "secrets unchanged since cached" %
+                              (len(differing), cached_secrets))
+        else:
+            src_tree = MerkleTree()
+            dst_tree = MerkleTree()
+            src_versions = {}
+            dst_versions = {}
+            src_to_read = dst_to_read = [""]
+
+        def digest_function(secret):
+            return utils.value_digest(secret, digest_key)
+
+        # both sides are read at the same time
+        with concurrent.futures.ThreadPoolExecutor(2) as pool:
+            futures = [
+                pool.submit(self.read_subtrees, vault_source_client, src_path,
+                            src_to_read, src_tree, digest_function,
+                            src_versions),
+                pool.submit(self.read_subtrees, vault_target_client, dst_path,
+                            dst_to_read, dst_tree, digest_function,
+                            dst_versions)
+            ]
+            for future in futures:
+                future.result()
+        diff = src_tree.diff(dst_tree)
+        if cache_file:
+            self.save_diff_cache(cache_file, cache_id, {
+                "created": time.time(),
+                "key_check": key_check,
+                "src": src_tree.leaves,
+                "dst": dst_tree.leaves,
+                "src_versions": src_versions,
+                "dst_versions": dst_versions,
+                "differing": diff["differing"]
+            })
+        report = {
+            "added": diff["added"],
+            "removed": diff["removed"],
+            "changed": diff["changed"],
+            "in_sync": not len(diff["differing"]),
+            "subtrees_read": len(set(src_to_read) | set(dst_to_read)),
+            "cached_secrets": cached_secrets
+        }
+        self.output_result("diff", report)
+        return report
+
+    def metadata_path(self, vault_client, path):
+        """
+        Return the metadata path of a path on a KV version 2 mount
+
+        :param vault_client: VaultClient instance
+        :type vault_client: VaultClient
+        :param path: secret or folder path
+        :type path: str
+
+        :return: tuple(str, str) mount and metadata path
+        """
+        mount, version = vault_client.kv_mount(path)
+        if version != 2:
+            raise ValueError("'%s' is not on a KV version 2 mount" % path)
+        return mount, self.metadata_subpath(mount, path)
+
+    def kv_delete(self, vault_addr, vault_token, paths, all_versions=False,
+                  max_failures=None):
+        """
+        Method running the delete function of KV module
+
+        Secrets are deleted by workers concurrent requests as soon as they
+        are listed. A failed deletion doesn't stop the others until
+        max_failures deletions failed
+
+        :param vault_addr: Vault instance URL
+        :type vault_addr: str
+        :param vault_token: Vault token
+        :type vault_token: str
+        :param paths: Paths to delete
+        :type paths: list(str)
+        :param all_versions: on KV version 2 mounts, delete the metadata of
+                             secrets, removing all their versions
+        :type all_versions: bool
+        :param max_failures: number of failed deletions stopping the delete
+        :type max_failures: int
+
+        :return: dict of 'deleted' secrets, 'failed' secrets with their error
+                 and 'stopped' if the delete stopped early
+        """
+        self.logger.debug("KV delete starting")
+        vault_client = self.connect_to_vault(
+            vault_addr,
+            vault_token
+        )
+        report = {"deleted": [], "failed": {}, "stopped": False}
+        report_lock = threading.Lock()
+
+        def logical_path(secret, mount):
+            if not mount:
+                return secret
+            return mount + secret[len(mount + "/metadata"):]
+
+        def limit_reached():
+            return max_failures and len(report["failed"]) >= max_failures
+
+        def delete_secret(secret, mount):
+            try:
+                self.logger.info("Deleting '" + secret + "'")
+                vault_client.delete(secret)
+            except Exception as e:
+                self.logger.error("Failed to delete '%s': %s" %
+                                  (secret, str(e)))
+                with report_lock:
+                    report["failed"][logical_path(secret, mount)] = str(e)
+                    failures = len(report["failed"])
+                    stop = limit_reached()
+                if stop:
+                    raise ValueError("%s deletions failed, stopping" %
+                                     failures)
+                return "failed"
+            with report_lock:
+                report["deleted"].append(logical_path(secret, mount))
+            return "deleted"
+
+        for to_delete in paths:
+            self.logger.info("Deleting all secrets at and under %s at %s" %
+                             (to_delete,
+                              os.environ["VAULT_ADDR"]))
+            walked = to_delete
+            mount = None
+            try:
+                if all_versions:
+                    mount, walked = self.metadata_path(vault_client,
+                                                       to_delete)
+                counts = KVPipeline(
+                    self.base_logger, readers=1, writers=self.workers,
+                    queue_size=self.pipeline_queue_size * self.workers
+                ).run(vault_client.secrets_tree_iter(walked, shard=self.shard),
+                      lambda secret: None,
+                      lambda secret, content, mount=mount:
+                      delete_secret(secret, mount))
+            except Exception as e:
+                if limit_reached():
+                    self.logger.error("Delete stopped at '%s': %s" %
+                                      (to_delete, str(e)))
+                    report["stopped"] = True
+                    break
+                # the path can't be walked, the other paths are deleted
+                self.logger.error("Failed to delete '%s': %s" %
+                                  (to_delete, str(e)))
+                report["failed"][to_delete] = str(e)
+                if limit_reached():
+                    report["stopped"] = True
+                    break
+                continue
+            if counts.get("deleted", 0):
+                self.logger.debug("%s secrets at '%s' successfully deleted" %
+                                  (counts["deleted"], to_delete))
+            elif not counts.get("failed", 0) and not self.shard:
+                self.logger.error("No secrets to delete at '%s'" % to_delete)
+        report["deleted"].sort()
+        self.output_result("delete", report)
+        return report
+
+    def kv_count(self, vault_addr, vault_token, paths, excluded=[]):
+        """
+        Method running the count function of KV module
+
+        :param vault_addr: Vault instance URL
         :type vault_addr: str
         :param vault_token: Vault token
         :type vault_token: str
@@ -319,133 +1847,1481 @@ class VaultManagerKV:
         total_secrets = 0
         total_kv = 0
         count_dict = {}
-        for path in paths:
-            self.logger.debug("At path '" + path + "'")
-            count_dict[path] = {"secrets_count": -1, "values_count": -1}
-            all_secrets = vault_client.secrets_tree_list(path, excluded)
-            self.logger.debug("\tSecrets count: " + str(len(all_secrets)))
-            count_dict[path]["secrets_count"] = len(all_secrets)
-            total_secrets += len(all_secrets)
-            kv_count = 0
-            for secret_path in all_secrets:
-                kv_count += len(vault_client.read(secret_path))
-            total_kv += kv_count
-            self.logger.debug("\tValues count: " + str(kv_count))
-            count_dict[path]["values_count"] = kv_count
-        self.logger.debug("Total")
-        self.logger.debug("\tSecrets count: " + str(total_secrets))
-        self.logger.debug("\tValues count: " + str(total_kv))
-        self.logger.info(json.dumps(count_dict, indent=4))
+        for path in paths:
+            count_dict[path] = {"secrets_count": 0, "values_count": 0}
+
+        # overlapping paths are walked once and results attributed to
+        # each requested path containing the secret
+        def count_secret(secret_path, secret):
+            nonlocal total_secrets, total_kv
+            kv_count = len(secret)
+            total_secrets += 1
+            total_kv += kv_count
+            for path in self.paths_containing(secret_path, paths):
+                count_dict[path]["secrets_count"] += 1
+                count_dict[path]["values_count"] += kv_count
+            return "counted"
+
+        # secrets are read by workers concurrent readers and counted by a
+        # single writer
+        KVPipeline(
+            self.base_logger, readers=self.workers, writers=1,
+            queue_size=self.pipeline_queue_size * self.workers
+        ).run(self.walk_paths(vault_client, paths, excluded),
+              self.secret_reader(vault_client),
+              self.skip_deleted(count_secret))
+        self.logger.debug("Total")
+        self.logger.debug("\tSecrets count: " + str(total_secrets))
+        self.logger.debug("\tValues count: " + str(total_kv))
+        if self.records:
+            for path in paths:
+                record = {"path": path}
+                record.update(count_dict[path])
+                self.records.write(record)
+            self.output_streamed()
+            return count_dict
+        count_dict = self.mark_truncated(count_dict)
+        self.output_result("count", count_dict)
+        return count_dict
+
+    def kv_count_metadata(self, vault_addr, vault_token, paths, excluded=[]):
+        """
+        Count secrets and their versions on KV version 2 mounts from the
+        metadata endpoints, without reading any secret value
+
+        :param vault_addr: Vault instance URL
+        :type vault_addr: str
+        :param vault_token: Vault token
+        :type vault_token: str
+        :param paths: Paths to count
+        :type paths: list(str)
+        :param excluded: Paths to exclude from count
+        :type excluded: list(str)
+
+        :return: dict
+        """
+        self.logger.debug("KV count metadata starting")
+        vault_client = self.connect_to_vault(
+            vault_addr,
+            vault_token
+        )
+        requested = {}
+        for path in paths:
+            requested[self.metadata_path(vault_client, path)[1]] = path
+        metadata_excluded = [self.metadata_path(vault_client, exc)[1]
+                             for exc in excluded]
+        count_dict = {}
+        for path in paths:
+            count_dict[path] = {"secrets_count": 0, "versions_count": 0}
+
+        def count_secret(secret_path, metadata):
+            versions_count = len(metadata.get("versions") or {})
+            for path in self.paths_containing(secret_path, list(requested)):
+                count_dict[requested[path]]["secrets_count"] += 1
+                count_dict[requested[path]]["versions_count"] += \
+                    versions_count
+            return "counted"
+
+        KVPipeline(
+            self.base_logger, readers=self.workers, writers=1,
+            queue_size=self.pipeline_queue_size * self.workers
+        ).run(self.walk_paths(vault_client, list(requested),
+                              metadata_excluded, logical=False),
+              vault_client.read, count_secret)
+        count_dict = self.mark_truncated(count_dict)
+        self.output_result("count", count_dict)
+        return count_dict
+
+    @staticmethod
+    def sample_variance(values):
+        """
+        Return the unbiased variance of a sample
+
+        :param values: sampled values
+        :type values: list(float)
+
+        :return: float
+        """
+        if len(values) < 2:
+            return 0.0
+        mean = sum(values) / len(values)
+        return sum((v - mean) ** 2 for v in values) / (len(values) - 1)
+
+    @staticmethod
+    def sample_size(population, fraction):
+        """
+        Return the number of elements to sample in a population. At least two
+        elements are sampled so the variance can be estimated
+
+        :param population: population size
+        :type population: int
+        :param fraction: fraction of the population to sample
+        :type fraction: float
+
+        :return: int
+        """
+        return min(population, max(2, int(math.ceil(fraction * population))))
+
+    def scale_sample(self, population, estimates):
+        """
+        Extrapolate a total and its variance from a simple random sample
+        without replacement of a population
+
+        :param population: population size
+        :type population: int
+        :param estimates: (estimate, variance) of each sampled element
+        :type estimates: list(tuple(float, float))
+
+        :return: tuple(float, float)
+        """
+        if not len(estimates):
+            return 0.0, 0.0
+        sampled = len(estimates)
+        ratio = population / sampled
+        total = ratio * sum(est for est, var in estimates)
+        # between elements variance + variance of each element estimate
+        variance = (population ** 2 * (1 - sampled / population) *
+                    self.sample_variance([est for est, var in estimates]) /
+                    sampled)
+        variance += ratio * sum(var for est, var in estimates)
+        return total, variance
+
+    def kv_count_estimate_recursive(self, vault_client, path, excluded,
+                                    exclude_matcher, fraction, rng, stats):
+        """
+        Recursive function associated with kv_count_estimate
+
+        :param vault_client: VaultClient instance
+        :type vault_client: VaultClient
+        :param path: Folder to estimate
+        :type path: str
+        :param excluded: Paths to exclude
+        :type excluded: list(str)
+        :param exclude_matcher: Glob paths to exclude
+        :type exclude_matcher: PathMatcher
+        :param fraction: Fraction of folders and secrets to sample
+        :type fraction: float
+        :param rng: Random generator
+        :type rng: random.Random
+        :param stats: Count of folders listed and secrets read
+        :type stats: dict
+
+        :return: tuple((secrets, variance), (values, variance))
+        """
+        listed = vault_client.list(path)
+        stats["folders_listed"] += 1
+        if not len(listed):
+            secret = vault_client.read(path)
+            stats["secrets_read"] += 1
+            if len(secret):
+                return (1.0, 0.0), (float(len(secret)), 0.0)
+            return (0.0, 0.0), (0.0, 0.0)
+        secrets = []
+        folders = []
+        for p in listed["keys"]:
+            child = (path + "/" + p).replace("//", "/")
+            if any(child.startswith(exc) for exc in excluded) or \
+                    (exclude_matcher and exclude_matcher.selects(child)):
+                continue
+            if p.endswith("/"):
+                folders.append(child)
+            else:
+                secrets.append(child)
+        secrets_estimate = (float(len(secrets)), 0.0)
+        values_samples = []
+        if len(secrets):
+            sampled = rng.sample(
+                secrets, self.sample_size(len(secrets), fraction)
+            )
+            for secret_path in sampled:
+                values_samples.append(
+                    (float(len(vault_client.read(secret_path))), 0.0)
+                )
+                stats["secrets_read"] += 1
+        values_estimate = self.scale_sample(len(secrets), values_samples)
+        if len(folders):
+            sampled = rng.sample(
+                folders, self.sample_size(len(folders), fraction)
+            )
+            folders_secrets = []
+            folders_values = []
+            for folder in sampled:
+                folder_secrets, folder_values = \
+                    self.kv_count_estimate_recursive(
+                        vault_client, folder, excluded, exclude_matcher,
+                        fraction, rng, stats
+                    )
+                folders_secrets.append(folder_secrets)
+                folders_values.append(folder_values)
+            sub_secrets = self.scale_sample(len(folders), folders_secrets)
+            sub_values = self.scale_sample(len(folders), folders_values)
+            secrets_estimate = (secrets_estimate[0] + sub_secrets[0],
+                                secrets_estimate[1] + sub_secrets[1])
+            values_estimate = (values_estimate[0] + sub_values[0],
+                               values_estimate[1] + sub_values[1])
+        return secrets_estimate, values_estimate
+
+    def kv_count_estimate(self, vault_addr, vault_token, paths, excluded=[],
+                          fraction=0.1, seed=None):
+        """
+        Estimate the count of secrets and values under paths by sampling a
+        fraction of folders and secrets at each level. Totals are given with
+        their 95% confidence interval
+
+        :param vault_addr: Vault instance URL
+        :type vault_addr: str
+        :param vault_token: Vault token
+        :type vault_token: str
+        :param paths: Paths to count
+        :type paths: list(str)
+        :param excluded: Paths to exclude from count
+        :type excluded: list(str)
+        :param fraction: Fraction of folders and secrets to sample
+        :type fraction: float
+        :param seed: Random seed, a random one is picked if not specified
+        :type seed: int
+
+        :return: dict
+        """
+        self.logger.debug("KV count estimate starting")
+        if self.shard:
+            raise ValueError("--estimate can't be used with --shard")
+        if not 0 < fraction <= 1:
+            raise ValueError("Sample fraction must be in ]0, 1]")
+        for path in paths:
+            if PathMatcher.is_glob(path):
+                raise ValueError("Glob pattern '%s' can't be used with "
+                                 "--estimate" % path)
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        vault_client = self.connect_to_vault(
+            vault_addr,
+            vault_token
+        )
+        exclude_matcher = None
+        if any(PathMatcher.is_glob(exc) for exc in excluded):
+            exclude_matcher = PathMatcher(
+                [exc for exc in excluded if PathMatcher.is_glob(exc)]
+            )
+        excluded = [exc for exc in excluded if not PathMatcher.is_glob(exc)]
+        count_dict = {}
+        for path in paths:
+            self.logger.debug("Estimating at path '" + path + "'")
+            rng = random.Random(seed)
+            stats = {"folders_listed": 0, "secrets_read": 0}
+            secrets, values = self.kv_count_estimate_recursive(
+                vault_client, utils.normalize_path(path), excluded,
+                exclude_matcher, fraction, rng, stats
+            )
+            count_dict[path] = {
+                "secrets_count": int(round(secrets[0])),
+                "secrets_count_ci95": self.confidence_interval(*secrets),
+                "values_count": int(round(values[0])),
+                "values_count_ci95": self.confidence_interval(*values),
+                "sample_fraction": fraction,
+                "seed": seed
+            }
+            count_dict[path].update(stats)
+        self.output_result("count", count_dict)
+        return count_dict
+
+    @staticmethod
+    def confidence_interval(estimate, variance):
+        """
+        Return the 95% confidence interval of an estimate
+
+        :param estimate: estimated total
+        :type estimate: float
+        :param variance: variance of the estimate
+        :type variance: float
+
+        :return: list(int)
+        """
+        margin = 1.96 * math.sqrt(variance)
+        return [int(math.floor(max(0.0, estimate - margin))),
+                int(math.ceil(estimate + margin))]
+
+    def kv_find_duplicates(self, vault_addr, vault_token, paths, excluded=[]):
+        """
+        Method running the count function of KV module
+
+        :param vault_addr: Vault instance URL
+        :type vault_addr: str
+        :param vault_token: Vault token
+        :type vault_token: str
+        :param paths: Paths to look for duplicates
+        :type paths: list(str)
+        :param excluded: Paths to exclude from count
+        :type excluded: list(str)
+
+        :return: dict
+        """
+        self.logger.debug("KV find duplicates starting")
+        vault_client = self.connect_to_vault(
+            vault_addr,
+            vault_token
+        )
+        # duplicates between shards can only be found with digests computed
+        # with the same key, a random key is enough otherwise
+        if self.shard:
+            digest_key = utils.get_digest_key(self.logger)
+        else:
+            digest_key = os.urandom(32)
+
+        def read_digests(path, secret):
+            # values are replaced by their digests as soon as they are read
+            return [(key, utils.value_digest(secret[key], digest_key,
+                                             raw=True))
+                    for key in secret]
+
+        kv_list = PathStore()
+        # values_count holds 'path:key' references as integers in arrays,
+        # indexed by value digest
+        values_count = {}
+
+        def add_digests(path, digests):
+            kv_list.add(path)
+            for key, digest in digests:
+                if digest not in values_count:
+                    values_count[digest] = array('Q')
+                values_count[digest].append(kv_list.add_key(path, key))
+            return "secrets_read"
+
+        KVPipeline(
+            self.base_logger, readers=self.workers, writers=1,
+            queue_size=self.pipeline_queue_size * self.workers
+        ).run(self.walk_paths(vault_client, paths, excluded),
+              self.secret_reader(vault_client, read_digests),
+              self.skip_deleted(add_digests))
+
+        if self.records:
+            for digest in values_count:
+                if len(values_count[digest]) > 1:
+                    self.records.write({"duplicates": sorted(
+                        kv_list.key_ref(ref) for ref in values_count[digest]
+                    )})
+            return self.output_streamed()
+        grouped_duplicates = {}
+        dup_counter = 0
+        for digest in values_count:
+            if len(values_count[digest]) > 1:
+                grouped_duplicates[dup_counter] = sorted(
+                    kv_list.key_ref(ref) for ref in values_count[digest]
+                )
+                dup_counter += 1
+        grouped_duplicates = self.mark_truncated(grouped_duplicates)
+        extra = None
+        if self.shard:
+            extra = {"digests": {
+                digest.hex():
+                    [kv_list.key_ref(ref) for ref in values_count[digest]]
+                for digest in values_count
+            }}
+        self.output_result("find-duplicates", grouped_duplicates, extra)
+        return grouped_duplicates
+
+    def new_search_pool(self, matcher, scope, processes=None, on_match=None):
+        """
+        Return a pool matching secrets by batches
+
+        :param matcher: compiled search terms
+        :type matcher: KVMatcher
+        :param scope: 'all', 'keys' or 'paths'
+        :type scope: str
+        :param processes: number of matching processes, secrets are
+                          matched in the calling thread by default
+        :type processes: int
+        :param on_match: function called with each match instead of keeping
+                         matches
+        :type on_match: function
+
+        :return: KVSearchPool
+        """
+        if processes is None:
+            processes = 1
+        return KVSearchPool(self.base_logger, matcher, scope, processes,
+                            self.search_batch_size, on_match)
+
+    def kv_search(
+            self, vault_addr, vault_token, to_search, included=[], excluded=[],
+            regex=False, ignore_case=False, processes=None, scope="all"
+    ):
+        """
+        Method running the search function of KV module
+
+        Secrets are read by workers concurrent readers and matched by batches
+        on a pool of processes
+
+        :param vault_addr: Vault instance URL
+        :type vault_addr: str
+        :param vault_token: Vault token
+        :type vault_token: str
+        :param to_search: Values to search in KV
+        :type to_search: list(str)
+        :param included: Paths to include in search
+        :type included: list(str)
+        :param excluded: Paths to exclude from search
+        :type excluded: list(str)
+        :param regex: values to search are regular expressions
+        :type regex: bool
+        :param ignore_case: ignore case when matching
+        :type ignore_case: bool
+        :param processes: number of matching processes, secrets are
+                          matched in the calling thread by default
+        :type processes: int
+        :param scope: search in paths, key names and values with 'all', in
+                      key names only with 'keys' and in secrets paths only
+                      with 'paths', secrets being listed but not read
+        :type scope: str
+
+        :return: dict of matched 'path/key', or 'path' with the 'paths'
+                 scope, with the values found
+        """
+        self.logger.debug("KV search secrets starting - scope: %s" % scope)
+        matcher = KVMatcher(to_search, regex, ignore_case)
+        vault_client = self.connect_to_vault(
+            vault_addr,
+            vault_token
+        )
+        write_match = None
+        if self.records:
+            # matches are written as soon as their batch is matched
+            def write_match(full_path, terms):
+                self.records.write({"match": full_path, "terms": terms})
+        search_pool = self.new_search_pool(matcher, scope, processes,
+                                           write_match)
+
+        def batch_secret(path, secret):
+            search_pool.add(path, secret)
+            return "secrets_read"
+
+        read_function = self.secret_reader(vault_client)
+        if scope == "paths":
+            # secrets paths are known from the listing, nothing is read
+            def read_function(path):
+                return {}
+
+        try:
+            KVPipeline(
+                self.base_logger, readers=self.workers, writers=1,
+                queue_size=self.pipeline_queue_size * self.workers
+            ).run(self.walk_paths(vault_client, included, excluded),
+                  read_function, self.skip_deleted(batch_secret))
+            found_values = search_pool.results()
+        finally:
+            search_pool.close()
+        if self.records:
+            return self.output_streamed()
+        found_values = self.mark_truncated(found_values)
+        self.output_result("search", found_values)
+        return found_values
+
+    def kv_analyze(self, vault_addr, vault_token, count=None,
+                   find_duplicates=None, secrets_tree=None, to_search=None,
+                   included=None, excluded=[], regex=False,
+                   ignore_case=False, processes=None, scope="all"):
+        """
+        Run count, find duplicates, secrets tree and search together over a
+        single walk, each secret being read once
+
+        :param vault_addr: Vault instance URL
+        :type vault_addr: str
+        :param vault_token: Vault token
+        :type vault_token: str
+        :param count: Paths to count
+        :type count: list(str)
+        :param find_duplicates: Paths to look for duplicates
+        :type find_duplicates: list(str)
+        :param secrets_tree: Paths to list
+        :type secrets_tree: list(str)
+        :param to_search: Values to search
+        :type to_search: list(str)
+        :param included: Paths to include in search
+        :type included: list(str)
+        :param excluded: Paths to exclude from all analyses
+        :type excluded: list(str)
+        :param regex: values to search are regular expressions
+        :type regex: bool
+        :param ignore_case: ignore case when searching
+        :type ignore_case: bool
+        :param processes: number of search processes
+        :type processes: int
+        :param scope: search scope, 'all', 'keys' or 'paths'
+        :type scope: str
+
+        :return: dict of results by command
+        """
+        self.logger.debug("KV analyze starting")
+        count = count or []
+        find_duplicates = find_duplicates or []
+        secrets_tree = secrets_tree or []
+        included = included or []
+        vault_client = self.connect_to_vault(
+            vault_addr,
+            vault_token
+        )
+        all_paths = []
+        for path in count + find_duplicates + secrets_tree + included:
+            if path not in all_paths:
+                all_paths.append(path)
+        count_dict = {path: {"secrets_count": 0, "values_count": 0}
+                      for path in count}
+        tree = {path: PathStore() for path in secrets_tree}
+        digest_key = os.urandom(32)
+        kv_list = PathStore()
+        values_count = {}
+        search_pool = None
+        if to_search:
+            search_pool = self.new_search_pool(
+                KVMatcher(to_search, regex, ignore_case), scope, processes
+            )
+
+        def analyze_secret(secret_path, secret):
+            for path in self.paths_containing(secret_path, count):
+                count_dict[path]["secrets_count"] += 1
+                count_dict[path]["values_count"] += len(secret)
+            for path in self.paths_containing(secret_path, secrets_tree):
+                tree[path].add(secret_path)
+            if len(self.paths_containing(secret_path, find_duplicates)):
+                kv_list.add(secret_path)
+                for key in secret:
+                    digest = utils.value_digest(secret[key], digest_key,
+                                                raw=True)
+                    if digest not in values_count:
+                        values_count[digest] = array('Q')
+                    values_count[digest].append(
+                        kv_list.add_key(secret_path, key)
+                    )
+            if search_pool and \
+                    len(self.paths_containing(secret_path, included)):
+                search_pool.add(secret_path, secret)
+            return "analyzed"
+
+        read_paths = count + find_duplicates
+        if to_search and scope != "paths":
+            read_paths = read_paths + included
+
+        read_secret = self.secret_reader(vault_client)
+
+        def read_function(secret_path):
+            # paths are known from the listing, secrets only listed by the
+            # tree or searched by path are not read
+            if not len(self.paths_containing(secret_path, read_paths)):
+                return {}
+            return read_secret(secret_path)
+
+        result = {}
+        try:
+            KVPipeline(
+                self.base_logger, readers=self.workers, writers=1,
+                queue_size=self.pipeline_queue_size * self.workers
+            ).run(self.walk_paths(vault_client, all_paths, excluded),
+                  read_function, self.skip_deleted(analyze_secret))
+            if search_pool:
+                result["search"] = search_pool.results()
+        finally:
+            if search_pool:
+                search_pool.close()
+        if count:
+            result["count"] = count_dict
+        if find_duplicates:
+            groups = [sorted(kv_list.key_ref(ref) for ref in refs)
+                      for refs in values_count.values() if len(refs) > 1]
+            result["find-duplicates"] = {index: group for index, group
+                                         in enumerate(groups)}
+        if secrets_tree:
+            result["secrets-tree"] = tree
+        result = self.mark_truncated(result)
+        self.output_result("analyze", result)
+        return result
+
+    def kv_export(self, vault_addr, vault_token, export_path, export_file,
+                  excluded=[], encrypt=False):
+        """
+        Method running the export function of KV module
+
+        Secrets are read and encoded by workers concurrent readers and
+        written to the export file by a single writer as they are read
+
+        :param vault_addr: Vault instance URL
+        :type vault_addr: str
+        :param vault_token: Vault token
+        :type vault_token: str
+        :param export_path: Path to export
+        :type export_path: str
+        :param export_file: Path of the export file
+        :type export_file: str
+        :param excluded: Paths to exclude from export
+        :type excluded: list(str)
+        :param encrypt: encrypt secrets with the export key
+        :type encrypt: bool
+
+        :return: dict
+        """
+        self.logger.debug("KV export starting")
+        vault_client = self.connect_to_vault(
+            vault_addr,
+            vault_token
+        )
+        root = utils.normalize_path(export_path)
+        archive = KVArchive(self.base_logger, export_file)
+        archive.create(root, encrypt)
+
+        def encode_secret(secret_path, secret):
+            return archive.encode(secret_path[len(root):].strip("/"), secret)
+
+        def write_line(secret_path, line):
+            archive.write(line)
+            return "secrets_exported"
+
+        try:
+            counts = KVPipeline(
+                self.base_logger, readers=self.workers, writers=1,
+                queue_size=self.pipeline_queue_size * self.workers
+            ).run(self.walk_paths(vault_client, [root], excluded),
+                  self.secret_reader(vault_client, encode_secret),
+                  self.skip_deleted(write_line))
+            # an export stopped by an error has no trailer
+            archive.write_trailer(
+                counts.get("secrets_exported", 0),
+                not self.walk_budget or not self.walk_budget.is_truncated()
+            )
+        finally:
+            archive.close()
+        self.logger.info("%s secrets exported from %s to %s" %
+                         (counts.get("secrets_exported", 0), root,
+                          export_file))
+        counts = self.mark_truncated(
+            {"secrets_exported": counts.get("secrets_exported", 0)}
+        )
+        self.output_result("export", counts)
+        return counts
+
+    def kv_import(self, vault_addr, vault_token, export_file, import_path,
+                  force=False):
+        """
+        Method running the import function of KV module
+
+        The export file is read as secrets are decoded by workers concurrent
+        readers and written to Vault by workers concurrent writers. The file
+        is first read once to check it holds a complete export
+
+        :param vault_addr: Vault instance URL
+        :type vault_addr: str
+        :param vault_token: Vault token
+        :type vault_token: str
+        :param export_file: Path of the export file
+        :type export_file: str
+        :param import_path: Path secrets are imported under
+        :type import_path: str
+        :param force: import an incomplete export file
+        :type force: bool
+
+        :return: dict
+        """
+        self.logger.debug("KV import starting")
+        vault_client = self.connect_to_vault(
+            vault_addr,
+            vault_token
+        )
+        root = utils.normalize_path(import_path)
+        archive = KVArchive(self.base_logger, export_file)
+        archive.open()
+        try:
+            archive.verify(force)
+        finally:
+            archive.close()
+        archive.open()
+        self.logger.info("Importing secrets exported from %s to %s" %
+                         (archive.header["path"], root))
+
+        def write_secret(line, decoded):
+            relative_path, secret = decoded
+            secret_path = root + "/" + relative_path if relative_path \
+                else root
+            self.logger.debug("Importing secret: " + secret_path)
+            vault_client.write(secret_path, secret, hide_all=True)
+            return "secrets_imported"
+
+        try:
+            counts = self.new_pipeline().run(archive.lines(), archive.decode,
+                                             write_secret)
+        finally:
+            archive.close()
+        counts = {"secrets_imported": counts.get("secrets_imported", 0)}
+        self.logger.info("%s secrets imported from %s" %
+                         (counts["secrets_imported"], export_file))
+        self.output_result("import", counts)
+        return counts
+
+    def kv_stats(self, vault_addr, vault_token, paths, excluded=[],
+                 subtree_depth=1, top=10):
+        """
+        Method running the stats function of KV module
+
+        Secrets are read by workers concurrent readers which only keep their
+        size and key names, statistics being computed by a single writer
+
+        :param vault_addr: Vault instance URL
+        :type vault_addr: str
+        :param vault_token: Vault token
+        :type vault_token: str
+        :param paths: Paths to compute statistics of
+        :type paths: list(str)
+        :param excluded: Paths to exclude from statistics
+        :type excluded: list(str)
+        :param subtree_depth: depth of the subtrees reported under each path
+        :type subtree_depth: int
+        :param top: number of largest secrets and folders and of most
+                    frequent key names reported
+        :type top: int
+
+        :return: dict
+        """
+        self.logger.debug("KV stats starting")
+        vault_client = self.connect_to_vault(
+            vault_addr,
+            vault_token
+        )
+        stats = {path: KVStats(
+            utils.normalize_path(PathMatcher.literal_prefix(path)),
+            subtree_depth, top
+        ) for path in paths}
+
+        def read_size(secret_path, secret):
+            return KVStats.secret_size(secret), list(secret)
+
+        def add_secret(secret_path, size_keys):
+            for path in self.paths_containing(secret_path, paths):
+                stats[path].add(secret_path, *size_keys)
+            return "secrets_read"
+
+        KVPipeline(
+            self.base_logger, readers=self.workers, writers=1,
+            queue_size=self.pipeline_queue_size * self.workers
+        ).run(self.walk_paths(vault_client, paths, excluded),
+              self.secret_reader(vault_client, read_size),
+              self.skip_deleted(add_secret))
+        stats_dict = {path: stats[path].result() for path in paths}
+        if self.output_format == "table":
+            self.result = stats_dict
+            tables = "\n\n".join(KVStats.format_table(path, stats_dict[path])
+                                 for path in paths)
+            stats_dict = self.mark_truncated(stats_dict)
+            if "__truncated__" in stats_dict:
+                tables += "\n\nTruncated by %(reason)s after " \
+                          "%(secrets_listed)s secrets" % \
+                          stats_dict["__truncated__"]
+            self.logger.info(tables)
+            if self.output_file:
+                with utils.open_file(self.output_file, 'w') as fd:
+                    fd.write(tables + "\n")
+            return stats_dict
+        stats_dict = self.mark_truncated(stats_dict)
+        self.output_result("stats", stats_dict)
+        return stats_dict
+
+    def kv_secrets_tree(self, vault_addr, vault_token, paths, excluded=[]):
+        """
+        Method running the secrets tree function of KV module
+
+        :param vault_addr: Vault instance URL
+        :type vault_addr: str
+        :param vault_token: Vault token
+        :type vault_token: str
+        :param paths: Paths to look for duplicates
+        :type paths: list(str)
+        :param excluded: Paths to exclude from count
+        :type excluded: list(str)
+
+        :return: dict
+        """
+        self.logger.debug("KV secrets paths starting")
+        vault_client = self.connect_to_vault(
+            vault_addr,
+            vault_token
+        )
+        if self.records:
+            # secrets are written as they are listed, nothing is kept
+            for secret in self.walk_paths(vault_client, paths, excluded):
+                for path in self.paths_containing(secret, paths):
+                    self.records.write({"path": path, "secret": secret})
+            return self.output_streamed()
+        all_secrets = PathStore(
+            self.walk_paths(vault_client, paths, excluded)
+        )
+        kv_full = {}
+        for path in paths:
+            kv_full[path] = PathStore(
+                secret for secret in all_secrets.prefix(
+                    utils.normalize_path(PathMatcher.literal_prefix(path))
+                ) if self.path_selects(path, secret)
+            )
+        kv_full = self.mark_truncated(kv_full)
+        self.output_result("secrets-tree", kv_full)
+        return kv_full
+
+    def kv_snapshot(self, vault_addr, vault_token, snapshot_file, paths,
+                    excluded=[]):
+        """
+        Store a snapshot of secrets under paths in a local SQLite index
+
+        :param vault_addr: Vault instance URL
+        :type vault_addr: str
+        :param vault_token: Vault token
+        :type vault_token: str
+        :param snapshot_file: SQLite snapshot file
+        :type snapshot_file: str
+        :param paths: Paths to store in the snapshot
+        :type paths: list(str)
+        :param excluded: Paths to exclude from the snapshot
+        :type excluded: list(str)
+
+        :return: dict
+        """
+        self.logger.debug("KV snapshot starting")
+        vault_client = self.connect_to_vault(
+            vault_addr,
+            vault_token
+        )
+        # digests are comparable between snapshots only if they are keyed
+        # with the shared digest key
+        digest_key = None
+        if os.getenv("VAULT_MANAGER_DIGEST_KEY"):
+            digest_key = utils.get_digest_key(self.logger)
+        snapshot = KVSnapshot(self.base_logger, snapshot_file)
+        snapshot.create(vault_addr, self.walk_roots(paths), excluded,
+                        digest_key)
+        count_dict = {}
+        for path in paths:
+            count_dict[path] = {"secrets_count": 0, "values_count": 0}
+        try:
+            self.logger.info("Taking snapshot of %s" % paths)
+            batch = []
+            for secret_path, secret in self.walk_paths(
+                    vault_client, paths, excluded, read=True):
+                for path in self.paths_containing(secret_path, paths):
+                    count_dict[path]["secrets_count"] += 1
+                    count_dict[path]["values_count"] += len(secret)
+                batch.append((secret_path, secret))
+                if len(batch) >= snapshot.batch_size:
+                    snapshot.insert(batch)
+                    batch = []
+            if len(batch):
+                snapshot.insert(batch)
+            snapshot.finalize()
+        finally:
+            snapshot.close()
+        self.logger.info("Snapshot saved in '%s'" % snapshot_file)
+        count_dict = self.mark_truncated(count_dict)
+        self.output_result("snapshot", count_dict)
+        return count_dict
+
+    def kv_build_index(self, vault_addr, vault_token, index_file, paths,
+                       excluded=[], index_values=False):
+        """
+        Store an encrypted search index of secrets under paths
+
+        :param vault_addr: Vault instance URL
+        :type vault_addr: str
+        :param vault_token: Vault token
+        :type vault_token: str
+        :param index_file: encrypted index file
+        :type index_file: str
+        :param paths: Paths to index
+        :type paths: list(str)
+        :param excluded: Paths to exclude from the index
+        :type excluded: list(str)
+        :param index_values: also index salted digests of values n-grams
+        :type index_values: bool
+
+        :return: dict
+        """
+        self.logger.debug("KV build index starting")
+        # fail before walking if the index can't be encrypted
+        KVIndex.fernet()
+        vault_client = self.connect_to_vault(
+            vault_addr,
+            vault_token
+        )
+        index = KVIndex(self.base_logger, index_file)
+        index.create(self.walk_roots(paths), index_values)
+        count_dict = {}
+        for path in paths:
+            count_dict[path] = {"secrets_count": 0, "values_count": 0}
+
+        def index_secret(secret_path, secret):
+            for path in self.paths_containing(secret_path, paths):
+                count_dict[path]["secrets_count"] += 1
+                count_dict[path]["values_count"] += len(secret)
+            index.add(secret_path, secret)
+            return "indexed"
+
+        self.logger.info("Indexing %s" % paths)
+        KVPipeline(
+            self.base_logger, readers=self.workers, writers=1,
+            queue_size=self.pipeline_queue_size * self.workers
+        ).run(self.walk_paths(vault_client, paths, excluded),
+              self.secret_reader(vault_client),
+              self.skip_deleted(index_secret))
+        index.save()
+        self.logger.info("Index saved in '%s'" % index_file)
+        count_dict = self.mark_truncated(count_dict)
+        self.output_result("build-index", count_dict)
+        return count_dict
+
+    def kv_search_from_index(self, index_file, to_search, included=[],
+                             excluded=[], regex=False, ignore_case=False,
+                             scope="all"):
+        """
+        Search values using an encrypted index built with kv_build_index
+
+        :param index_file: encrypted index file
+        :type index_file: str
+        :param to_search: Values to search
+        :type to_search: list(str)
+        :param included: Paths to include in search, all indexed paths if
+                         empty
+        :type included: list(str)
+        :param excluded: Paths to exclude from search
+        :type excluded: list(str)
+        :param regex: values to search are regular expressions
+        :type regex: bool
+        :param ignore_case: ignore case when matching
+        :type ignore_case: bool
+        :param scope: 'all', 'keys' or 'paths'
+        :type scope: str
+
+        :return: dict of matched 'path/key', or 'path' with the 'paths'
+                 scope, with the values found. Keys whose value may contain
+                 search values are under '__candidates__'
+        """
+        self.logger.debug("KV search from index starting")
+        matcher = KVMatcher(to_search, regex, ignore_case)
+        index = KVIndex(self.base_logger, index_file)
+        index.load()
+        for path in included:
+            if not index.covers(path):
+                self.logger.warning("'%s' is not covered by index '%s'" %
+                                    (path, index_file))
+        included = [utils.normalize_path(path) for path in included]
+        excluded = [utils.normalize_path(path) for path in excluded]
+
+        def selected(results):
+            return {full_path: terms for full_path, terms in results.items()
+                    if (not len(included) or
+                        any(utils.path_is_under(full_path, path)
+                            for path in included)) and
+                    not any(utils.path_is_under(full_path, path)
+                            for path in excluded)}
+
+        found, candidates = index.search(matcher, scope)
+        found_values = selected(found)
+        candidates = selected(candidates)
+        if len(candidates):
+            # n-grams of values may all be found in a value not containing
+            # the search value, so candidates are never reported as matches
+            self.logger.info("%s keys may contain search values, search "
+                             "them without --index to confirm" %
+                             len(candidates))
+            found_values["__candidates__"] = candidates
+        self.output_result("search", found_values)
+        return found_values
+
+    def read_kv_secret(self, vault_client, path):
+        """
+        Read a secret on a KV version 1 or 2 mount
+
+        :param vault_client: VaultClient instance
+        :type vault_client: VaultClient
+        :param path: secret path, without data/ on KV version 2 mounts
+        :type path: str
+
+        :return: tuple(dict, int) secret and its version, None on KV
+                 version 1 mounts
+        """
+        mount, version = vault_client.kv_mount(path)
+        if version != 2:
+            try:
+                return vault_client.read_secret(path), None
+            except TypeError:
+                raise ValueError("Secret '%s' not found" % path)
+        read = vault_client.read(self.data_path(mount, path))
+        if not read:
+            raise ValueError("Secret '%s' not found" % path)
+        return read["data"], read["metadata"]["version"]
+
+    @staticmethod
+    def data_path(mount, path):
+        """
+        Return the data path of a secret on a KV version 2 mount
+
+        :param mount: mount path
+        :type mount: str
+        :param path: secret path under mount
+        :type path: str
+
+        :return: str
+        """
+        return mount + "/data/" + utils.normalize_path(path)[len(mount) + 1:]
+
+    @staticmethod
+    def mask_value(value):
+        """
+        Return a masked value for display
+
+        :param value: secret value
+        :type value: str
+
+        :return: str
+        """
+        # no character of the value is shown, only its length
+        return "*** (%s characters)" % len(value)
+
+    def transform_value(self, key, value, keys, match, replacement):
+        """
+        Return the transformed value of a key, None if it is not selected
+
+        :param key: key name
+        :type key: str
+        :param value: key value
+        :type value: object
+        :param keys: glob patterns of keys to transform, all keys if None
+        :type keys: list(str)
+        :param match: value to replace, the whole value if None
+        :type match: str
+        :param replacement: new value
+        :type replacement: str
+
+        :return: str or None
+        """
+        if not isinstance(value, str):
+            return None
+        if keys and not any(fnmatchcase(key, pattern) for pattern in keys):
+            return None
+        if match is None:
+            return replacement
+        if match not in value:
+            return None
+        return value.replace(match, replacement)
+
+    def kv_transform(self, vault_addr, vault_token, paths, replacement,
+                     keys=None, match=None, excluded=[], preview=False):
+        """
+        Rewrite values of secrets under paths selected by key names and/or
+        by value. Secrets are read and written by workers concurrent
+        requests and only changed secrets are written, with check-and-set
+        on KV version 2 mounts
+
+        :param vault_addr: Vault instance URL
+        :type vault_addr: str
+        :param vault_token: Vault token
+        :type vault_token: str
+        :param paths: Paths to transform, literal or glob
+        :type paths: list(str)
+        :param replacement: new value
+        :type replacement: str
+        :param keys: glob patterns of keys to transform
+        :type keys: list(str)
+        :param match: only transform values containing match, match being
+                      replaced
+        :type match: str
+        :param excluded: Paths to exclude
+        :type excluded: list(str)
+        :param preview: only report changes, masked, without writing them
+        :type preview: bool
+
+        :return: dict
+        """
+        self.logger.debug("KV transform starting")
+        if not keys and match is None:
+            raise ValueError("--transform needs --transform-key or --match")
+        vault_client = self.connect_to_vault(
+            vault_addr,
+            vault_token
+        )
+        path_mounts = [vault_client.kv_mount(
+            PathMatcher.literal_prefix(path)
+        ) for path in paths]
+        excluded_mounts = {}
+        for exc in excluded:
+            exc_mount = vault_client.kv_mount(
+                PathMatcher.literal_prefix(exc)
+            )[0]
+            if exc_mount is None or \
+                    exc_mount not in [mount for mount, _ in path_mounts]:
+                raise ValueError("Excluded path '%s' is not on the mount of "
+                                 "a transformed path" % exc)
+            excluded_mounts[exc] = exc_mount
+        report = {"updated": [], "unchanged": 0, "skipped": [],
+                  "failed": {}}
+        if preview:
+            report = {"changes": {}, "unchanged": 0, "skipped": []}
+        report_lock = threading.Lock()
+        for path, (mount, version) in zip(paths, path_mounts):
+            walked = path
+            walked_excluded = [exc for exc in excluded
+                               if excluded_mounts[exc] == mount]
+            if version == 2:
+                walked = self.metadata_path(vault_client, path)[1]
+                walked_excluded = [self.metadata_path(vault_client, exc)[1]
+                                   for exc in walked_excluded]
+
+            def logical(secret_path):
+                if version == 2:
+                    return mount + secret_path[len(mount + "/data"):]
+                return secret_path
+
+            read_v1 = self.secret_reader(
+                vault_client, lambda secret_path, secret: (secret, None)
+            )
+
+            def read_secret(secret_path):
+                # secrets deleted or destroyed since they were listed are
+                # skipped
+                if version != 2:
+                    return read_v1(secret_path)
+                read = vault_client.read(secret_path)
+                if not read or not read.get("data"):
+                    return None
+                return read["data"], read["metadata"]["version"]
+
+            def write_secret(secret_path, read):
+                logical_path = logical(secret_path)
+                if read is None:
+                    self.logger.warning("'%s' not found, skipping it" %
+                                        logical_path)
+                    with report_lock:
+                        report["skipped"].append(logical_path)
+                    return "skipped"
+                secret, secret_version = read
+                changes = {}
+                for key in secret:
+                    new_value = self.transform_value(key, secret[key], keys,
+                                                     match, replacement)
+                    if new_value is not None and new_value != secret[key]:
+                        changes[key] = new_value
+                if not len(changes):
+                    with report_lock:
+                        report["unchanged"] += 1
+                    return "unchanged"
+                if preview:
+                    with report_lock:
+                        for key in changes:
+                            report["changes"][logical_path + ":" + key] = {
+                                "old": self.mask_value(secret[key]),
+                                "new": self.mask_value(changes[key])
+                            }
+                    return "changed"
+                new_secret = dict(secret)
+                new_secret.update(changes)
+                self.logger.info("Rewriting %s in '%s'" %
+                                 (sorted(changes), logical_path))
+                try:
+                    if version == 2:
+                        # the write fails if the secret changed since read
+                        vault_client.write(
+                            secret_path,
+                            {"data": new_secret,
+                             "options": {"cas": secret_version}},
+                            hide_all=True
+                        )
+                    else:
+                        vault_client.write(secret_path, new_secret,
+                                           hide_all=True)
+                except Exception as e:
+                    self.logger.error("Failed to rewrite '%s': %s" %
+                                      (logical_path, str(e)))
+                    with report_lock:
+                        report["failed"][logical_path] = str(e)
+                    return "failed"
+                with report_lock:
+                    report["updated"].append(logical_path)
+                return "updated"
+
+            def walk():
+                for secret_path in self.walk_paths(vault_client, [walked],
+                                                   walked_excluded,
+                                                   logical=False):
+                    if version == 2:
+                        # read and write data instead of metadata
+                        secret_path = mount + "/data" + \
+                            secret_path[len(mount + "/metadata"):]
+                    yield secret_path
+
+            self.logger.info("Transforming secrets under '%s'" % path)
+            self.new_pipeline().run(walk(), read_secret, write_secret)
+        if not preview:
+            report["updated"].sort()
+        report["skipped"].sort()
+        report = self.mark_truncated(report)
+        self.output_result("transform", report)
+        return report
+
+    def merge_shards_results(self, command, docs):
+        """
+        Merge results of sharded runs of a command
+
+        :param command: command name
+        :type command: str
+        :param docs: outputs of all shards
+        :type docs: list(dict)
+
+        :return: dict or list
+        """
+        results = []
+        truncated = []
+        for doc in docs:
+            result = doc["result"]
+            if isinstance(result, dict) and "__truncated__" in result:
+                result = dict(result)
+                truncated.append(result.pop("__truncated__"))
+                if "results" in result:
+                    result = result["results"]
+            results.append(result)
+        if command in ["count", "snapshot"]:
+            merged = {}
+            for result in results:
+                for path in result:
+                    if path not in merged:
+                        merged[path] = {}
+                    for counter in result[path]:
+                        merged[path][counter] = \
+                            merged[path].get(counter, 0) + result[path][counter]
+        elif command == "secrets-tree":
+            merged = {}
+            for result in results:
+                for path in result:
+                    merged[path] = merged.get(path, []) + result[path]
+            merged = {path: sorted(merged[path]) for path in merged}
+        elif command == "search":
+            merged = {}
+            for result in results:
+                for full_path in result:
+                    merged[full_path] = merged.get(full_path, []) + [
+                        term for term in result[full_path]
+                        if term not in merged.get(full_path, [])
+                    ]
+            merged = {full_path: merged[full_path]
+                      for full_path in sorted(merged)}
+        elif command == "delete":
+            merged = {
+                "deleted": sorted(set(secret for result in results
+                                      for secret in result["deleted"])),
+                "failed": {secret: result["failed"][secret]
+                           for result in results
+                           for secret in result["failed"]},
+                "stopped": any(result["stopped"] for result in results)
+            }
+        elif command == "copy-path":
+            merged = utils.sum_counters([
+                {counter: result[counter] for counter in result
+                 if counter not in ["failed", "stopped"]}
+                for result in results
+            ])
+            failed = {secret: result["failed"][secret]
+                      for result in results
+                      for secret in result.get("failed", {})}
+            if failed:
+                merged["failed"] = {secret: failed[secret]
+                                    for secret in sorted(failed)}
+                merged["stopped"] = any(result.get("stopped")
+                                        for result in results)
+        elif command == "find-duplicates":
+            digests = {}
+            for doc in docs:
+                for digest in doc["digests"]:
+                    digests[digest] = \
+                        digests.get(digest, []) + doc["digests"][digest]
+            groups = sorted(sorted(refs) for refs in digests.values()
+                            if len(refs) > 1)
+            merged = {idx: refs for idx, refs in enumerate(groups)}
+        else:
+            raise ValueError("Results of '%s' can't be merged" % command)
+        if len(truncated):
+            marker = {
+                "reason": ",".join(sorted(set(m["reason"] for m in truncated))),
+                "secrets_listed": sum(m["secrets_listed"] for m in truncated)
+            }
+            if isinstance(merged, dict):
+                merged["__truncated__"] = marker
+            else:
+                merged = {"results": merged, "__truncated__": marker}
+        return merged
+
+    def kv_merge_shards(self, shard_files):
+        """
+        Merge JSON outputs of sharded runs into the result a single run
+        would have produced
+
+        :param shard_files: JSON outputs of all shards
+        :type shard_files: list(str)
+
+        :return: dict or list
+        """
+        self.logger.debug("KV merge shards starting")
+        docs = []
+        for shard_file in shard_files:
+            self.logger.debug("Reading shard output '%s'" % shard_file)
+            with utils.open_file(shard_file, 'r') as fd:
+                try:
+                    doc = json.load(fd)
+                except ValueError as e:
+                    raise ValueError("'%s' is not a valid JSON file: %s" %
+                                     (shard_file, str(e)))
+            if not isinstance(doc, dict) or \
+                    not all(k in doc for k in ["command", "shard", "result"]):
+                raise ValueError("'%s' is not the output of a sharded run" %
+                                 shard_file)
+            docs.append(doc)
+        commands = set(doc["command"] for doc in docs)
+        if len(commands) != 1:
+            raise ValueError("Shards outputs of different commands can't be "
+                             "merged: %s" % sorted(commands))
+        shards_count = set(doc["shard"][1] for doc in docs)
+        if len(shards_count) != 1:
+            raise ValueError("Shards outputs come from runs with different "
+                             "shards counts: %s" % sorted(shards_count))
+        shards_count = shards_count.pop()
+        indexes = sorted(doc["shard"][0] for doc in docs)
+        if indexes != list(range(shards_count)):
+            missing = set(range(shards_count)) - set(indexes)
+            raise ValueError("Shards outputs are missing or duplicated. "
+                             "Missing shards: %s" % sorted(missing))
+        merged = self.merge_shards_results(commands.pop(), docs)
+        # the merged result is not a shard output anymore
+        self.shard = None
+        self.output_result("merge-shards", merged)
+        return merged
+
+    def open_snapshot(self, snapshot_file, paths=[]):
+        """
+        Open an existing KV snapshot
+
+        :param snapshot_file: SQLite snapshot file
+        :type snapshot_file: str
+        :param paths: paths which will be queried
+        :type paths: list(str)
+
+        :return: KVSnapshot
+        """
+        self.logger.debug("Using snapshot '%s'" % snapshot_file)
+        for path in paths:
+            if PathMatcher.is_glob(path):
+                raise ValueError("Glob pattern '%s' can't be used with "
+                                 "--from-snapshot" % path)
+        snapshot = KVSnapshot(self.base_logger, snapshot_file)
+        snapshot.open()
+        self.logger.debug("Snapshot taken on %s" %
+                          snapshot.get_meta("vault_addr"))
+        return snapshot
+
+    def kv_count_from_snapshot(self, snapshot_file, paths, excluded=[]):
+        """
+        Count secrets under paths using a KV snapshot
+
+        :param snapshot_file: SQLite snapshot file
+        :type snapshot_file: str
+        :param paths: Paths to count
+        :type paths: list(str)
+        :param excluded: Paths to exclude from count
+        :type excluded: list(str)
+
+        :return: dict
+        """
+        self.logger.debug("KV count from snapshot starting")
+        snapshot = self.open_snapshot(snapshot_file, paths + excluded)
+        count_dict = {}
+        try:
+            for path in paths:
+                count_dict[path] = snapshot.count(path, excluded)
+        finally:
+            snapshot.close()
+        self.output_result("count", count_dict)
         return count_dict
 
-    def kv_find_duplicates(self, vault_addr, vault_token, paths, excluded=[]):
+    def kv_find_duplicates_from_snapshot(self, snapshot_file, paths,
+                                         excluded=[]):
         """
-        Method running the count function of KV module
+        Find duplicated values under paths using a KV snapshot
 
-        :param vault_addr: Vault instance URL
-        :type vault_addr: str
-        :param vault_token: Vault token
-        :type vault_token: str
+        :param snapshot_file: SQLite snapshot file
+        :type snapshot_file: str
         :param paths: Paths to look for duplicates
         :type paths: list(str)
-        :param excluded: Paths to exclude from count
+        :param excluded: Paths to exclude
         :type excluded: list(str)
 
         :return: dict
         """
-        self.logger.debug("KV find duplicates starting")
-        vault_client = self.connect_to_vault(
-            vault_addr,
-            vault_token
-        )
-        kv_full = {}
-        kv_list = []
-        for path in paths:
-            kv_list += vault_client.secrets_tree_list(path, excluded)
-        for kv in kv_list:
-            kv_full[kv] = vault_client.read_secret(kv)
-        values_count = {}
-        for path in kv_full:
-            for key in kv_full[path]:
-                if kv_full[path][key] not in values_count:
-                    values_count[kv_full[path][key]] = [path + ":" + key]
-                else:
-                    values_count[kv_full[path][key]].append(path + ":" + key)
-
-        grouped_duplicates = {}
-        dup_counter = 0
-        for elem in values_count:
-            if len(values_count[elem]) > 1:
-                grouped_duplicates[dup_counter] = values_count[elem]
-                dup_counter += 1
-        self.logger.info(json.dumps(grouped_duplicates, indent=4))
+        self.logger.debug("KV find duplicates from snapshot starting")
+        snapshot = self.open_snapshot(snapshot_file, paths + excluded)
+        try:
+            grouped_duplicates = snapshot.find_duplicates(paths, excluded)
+        finally:
+            snapshot.close()
+        self.output_result("find-duplicates", grouped_duplicates)
         return grouped_duplicates
 
-    def kv_search(
-            self, vault_addr, vault_token, to_search, included=[], excluded=[]
-    ):
+    def kv_search_from_snapshot(self, snapshot_file, to_search, included=[],
+                                excluded=[], regex=False, ignore_case=False,
+                                scope="all"):
         """
-        Method running the search function of KV module
+        Search values in paths and key names using a KV snapshot.
+        Secret values are not stored in snapshots and can't be searched
 
-        :param vault_addr: Vault instance URL
-        :type vault_addr: str
-        :param vault_token: Vault token
-        :type vault_token: str
-        :param to_search: Values to search in KV
+        :param snapshot_file: SQLite snapshot file
+        :type snapshot_file: str
+        :param to_search: Values to search
         :type to_search: list(str)
         :param included: Paths to include in search
         :type included: list(str)
         :param excluded: Paths to exclude from search
         :type excluded: list(str)
+        :param regex: values to search are regular expressions
+        :type regex: bool
+        :param ignore_case: ignore case when matching
+        :type ignore_case: bool
+        :param scope: 'all', 'keys' or 'paths'
+        :type scope: str
 
-        :return: list
+        :return: dict of matched 'path/key', or 'path' with the 'paths'
+                 scope, with the values found
         """
-        self.logger.debug("KV search secrets starting")
-        vault_client = self.connect_to_vault(
-            vault_addr,
-            vault_token
-        )
-        kv_full = {}
-        kv_list = []
-        found_values = []
-        for path in included:
-            kv_list += vault_client.secrets_tree_list(path, excluded)
-        for kv in kv_list:
-            kv_full[kv] = vault_client.read_secret(kv)
-
-        for path in kv_full:
-            for key in kv_full[path]:
-                for v in to_search:
-                    if v in os.path.join(path, key) or v in kv_full[path][key]:
-                        found_values.append(os.path.join(path, key))
-
-        self.logger.info(json.dumps(found_values, indent=4))
+        self.logger.debug("KV search from snapshot starting")
+        matcher = KVMatcher(to_search, regex, ignore_case)
+        snapshot = self.open_snapshot(snapshot_file, included + excluded)
+        try:
+            found_values = snapshot.search(matcher, included, excluded,
+                                           scope)
+        finally:
+            snapshot.close()
+        self.output_result("search", found_values)
         return found_values
 
-    def kv_secrets_tree(self, vault_addr, vault_token, paths, excluded=[]):
+    def kv_secrets_tree_from_snapshot(self, snapshot_file, paths,
+                                      excluded=[]):
         """
-        Method running the secrets tree function of KV module
+        List secrets under paths using a KV snapshot
 
-        :param vault_addr: Vault instance URL
-        :type vault_addr: str
-        :param vault_token: Vault token
-        :type vault_token: str
-        :param paths: Paths to look for duplicates
+        :param snapshot_file: SQLite snapshot file
+        :type snapshot_file: str
+        :param paths: Paths to list
         :type paths: list(str)
-        :param excluded: Paths to exclude from count
+        :param excluded: Paths to exclude
         :type excluded: list(str)
 
         :return: dict
         """
-        self.logger.debug("KV secrets paths starting")
-        vault_client = self.connect_to_vault(
-            vault_addr,
-            vault_token
-        )
+        self.logger.debug("KV secrets tree from snapshot starting")
+        snapshot = self.open_snapshot(snapshot_file, paths + excluded)
         kv_full = {}
-        for path in paths:
-            kv_full[path] = vault_client.secrets_tree_list(path, excluded)
-        self.logger.info(json.dumps(kv_full, indent=4))
+        try:
+            for path in paths:
+                kv_full[path] = snapshot.tree(path, excluded)
+        finally:
+            snapshot.close()
+        self.output_result("secrets-tree", kv_full)
         return kv_full
 
     def kv_generate_tree_recursive(self, vault_client, path, depth, count,
@@ -547,6 +3423,17 @@ class VaultManagerKV:
         Prepares a CLI run of kv_count
         """
         self.logger.debug("Preparing run of kv_count")
+        if self.kwargs["metadata_only"] and \
+                (self.kwargs["from_snapshot"] or self.kwargs["estimate"]):
+            raise ValueError("--metadata-only can't be used with "
+                             "--from-snapshot or --estimate")
+        if self.kwargs["from_snapshot"]:
+            self.kv_count_from_snapshot(
+                self.kwargs["from_snapshot"],
+                self.command_paths(self.kwargs["count"], "count"),
+                self.kwargs["exclude"] if self.kwargs["exclude"] else []
+            )
+            return
         missing_args = utils.keys_exists_in_dict(
             self.logger, self.kwargs,
             [{"key": "vault_addr", "exc": [None, '']},
@@ -557,10 +3444,23 @@ class VaultManagerKV:
                 "Following arguments are missing %s" %
                 [k['key'].replace("_", "-") for k in missing_args]
             )
-        self.kv_count(
+        if self.kwargs["estimate"]:
+            self.kv_count_estimate(
+                self.kwargs["vault_addr"],
+                self.kwargs["vault_token"],
+                self.command_paths(self.kwargs["count"], "count"),
+                self.kwargs["exclude"] if self.kwargs["exclude"] else [],
+                self.kwargs["sample_fraction"],
+                self.kwargs["seed"]
+            )
+            return
+        count_function = self.kv_count
+        if self.kwargs["metadata_only"]:
+            count_function = self.kv_count_metadata
+        count_function(
             self.kwargs["vault_addr"],
             self.kwargs["vault_token"],
-            self.kwargs["count"],
+            self.command_paths(self.kwargs["count"], "count"),
             self.kwargs["exclude"] if self.kwargs["exclude"] else []
         )
 
@@ -569,6 +3469,13 @@ class VaultManagerKV:
         Prepares a CLI run of kv_find_duplicates
         """
         self.logger.debug("Preparing run of kv_find_duplicates")
+        if self.kwargs["from_snapshot"]:
+            self.kv_find_duplicates_from_snapshot(
+                self.kwargs["from_snapshot"],
+                self.command_paths(self.kwargs["find_duplicates"], "find-duplicates"),
+                self.kwargs["exclude"] if self.kwargs["exclude"] else []
+            )
+            return
         missing_args = utils.keys_exists_in_dict(
             self.logger, self.kwargs,
             [{"key": "vault_addr", "exc": [None, '']},
@@ -582,7 +3489,7 @@ class VaultManagerKV:
         self.kv_find_duplicates(
             self.kwargs["vault_addr"],
             self.kwargs["vault_token"],
-            self.kwargs["find_duplicates"],
+            self.command_paths(self.kwargs["find_duplicates"], "find-duplicates"),
             self.kwargs["exclude"] if self.kwargs["exclude"] else []
         )
 
@@ -591,6 +3498,28 @@ class VaultManagerKV:
         Prepares a CLI run of kv_search
         """
         self.logger.debug("Preparing run of kv_search")
+        if self.kwargs["index"]:
+            self.kv_search_from_index(
+                self.kwargs["index"],
+                self.kwargs["search"],
+                self.kwargs["include"] if self.kwargs["include"] else [],
+                self.kwargs["exclude"] if self.kwargs["exclude"] else [],
+                self.kwargs["regex"],
+                self.kwargs["ignore_case"],
+                self.kwargs["search_scope"]
+            )
+            return
+        if self.kwargs["from_snapshot"]:
+            self.kv_search_from_snapshot(
+                self.kwargs["from_snapshot"],
+                self.kwargs["search"],
+                self.kwargs["include"] if self.kwargs["include"] else [],
+                self.kwargs["exclude"] if self.kwargs["exclude"] else [],
+                self.kwargs["regex"],
+                self.kwargs["ignore_case"],
+                self.kwargs["search_scope"]
+            )
+            return
         missing_args = utils.keys_exists_in_dict(
             self.logger, self.kwargs,
             [{"key": "vault_addr", "exc": [None, '']},
@@ -601,12 +3530,19 @@ class VaultManagerKV:
                 "Following arguments are missing %s" %
                 [k['key'].replace("_", "-") for k in missing_args]
             )
+        if self.kwargs["processes"] is not None and \
+                self.kwargs["processes"] < 1:
+            raise ValueError("--processes must be greater than 0")
         self.kv_search(
             self.kwargs["vault_addr"],
             self.kwargs["vault_token"],
             self.kwargs["search"],
-            self.kwargs["include"] if self.kwargs["include"] else [],
-            self.kwargs["exclude"] if self.kwargs["exclude"] else []
+            self.command_paths(self.kwargs["include"]),
+            self.kwargs["exclude"] if self.kwargs["exclude"] else [],
+            self.kwargs["regex"],
+            self.kwargs["ignore_case"],
+            self.kwargs["processes"],
+            self.kwargs["search_scope"]
         )
 
     def run_kv_secrets_tree(self):
@@ -614,6 +3550,13 @@ class VaultManagerKV:
         Prepares a CLI run of kv_secrets_tree
         """
         self.logger.debug("Preparing run of kv_secrets_tree")
+        if self.kwargs["from_snapshot"]:
+            self.kv_secrets_tree_from_snapshot(
+                self.kwargs["from_snapshot"],
+                self.command_paths(self.kwargs["secrets_tree"], "secrets-tree"),
+                self.kwargs["exclude"] if self.kwargs["exclude"] else []
+            )
+            return
         missing_args = utils.keys_exists_in_dict(
             self.logger, self.kwargs,
             [{"key": "vault_addr", "exc": [None, '']},
@@ -627,10 +3570,240 @@ class VaultManagerKV:
         self.kv_secrets_tree(
             self.kwargs["vault_addr"],
             self.kwargs["vault_token"],
-            self.kwargs["secrets_tree"],
+            self.command_paths(self.kwargs["secrets_tree"], "secrets-tree"),
+            self.kwargs["exclude"] if self.kwargs["exclude"] else []
+        )
+
+    def run_kv_snapshot(self):
+        """
+        Prepares a CLI run of kv_snapshot
+        """
+        self.logger.debug("Preparing run of kv_snapshot")
+        missing_args = utils.keys_exists_in_dict(
+            self.logger, self.kwargs,
+            [{"key": "vault_addr", "exc": [None, '']},
+             {"key": "vault_token", "exc": [None, False]}]
+        )
+        if len(missing_args):
+            raise ValueError(
+                "Following arguments are missing %s" %
+                [k['key'].replace("_", "-") for k in missing_args]
+            )
+        self.kv_snapshot(
+            self.kwargs["vault_addr"],
+            self.kwargs["vault_token"],
+            self.kwargs["snapshot"],
+            self.command_paths(self.kwargs["include"], "include"),
             self.kwargs["exclude"] if self.kwargs["exclude"] else []
         )
 
+    def run_kv_build_index(self):
+        """
+        Prepares a CLI run of kv_build_index
+        """
+        self.logger.debug("Preparing run of kv_build_index")
+        if self.shard:
+            raise ValueError("--build-index can't be used with --shard")
+        missing_args = utils.keys_exists_in_dict(
+            self.logger, self.kwargs,
+            [{"key": "vault_addr", "exc": [None, '']},
+             {"key": "vault_token", "exc": [None, False]}]
+        )
+        if len(missing_args):
+            raise ValueError(
+                "Following arguments are missing %s" %
+                [k['key'].replace("_", "-") for k in missing_args]
+            )
+        self.kv_build_index(
+            self.kwargs["vault_addr"],
+            self.kwargs["vault_token"],
+            self.kwargs["build_index"],
+            self.command_paths(self.kwargs["include"], "include"),
+            self.kwargs["exclude"] if self.kwargs["exclude"] else [],
+            self.kwargs["index_values"]
+        )
+
+    def run_kv_transform(self):
+        """
+        Prepares a CLI run of kv_transform
+        """
+        self.logger.debug("Preparing run of kv_transform")
+        missing_args = utils.keys_exists_in_dict(
+            self.logger, self.kwargs,
+            [{"key": "vault_addr", "exc": [None, '']},
+             {"key": "vault_token", "exc": [None, False]}]
+        )
+        if len(missing_args):
+            raise ValueError(
+                "Following arguments are missing %s" %
+                [k['key'].replace("_", "-") for k in missing_args]
+            )
+        if (self.kwargs["replace_with"] is None) == \
+                (self.kwargs["replace_from"] is None):
+            raise ValueError("--transform needs either --replace-with or "
+                             "--replace-from")
+        if self.shard:
+            raise ValueError("--transform can't be used with --shard")
+        replacement = self.kwargs["replace_with"]
+        if self.kwargs["replace_from"]:
+            if ":" not in self.kwargs["replace_from"]:
+                raise ValueError("--replace-from should be SECRET:KEY")
+            secret_path, key = self.kwargs["replace_from"].rsplit(":", 1)
+            secret = self.read_kv_secret(
+                self.connect_to_vault(self.kwargs["vault_addr"],
+                                      self.kwargs["vault_token"]),
+                secret_path
+            )[0]
+            if key not in secret:
+                raise ValueError("Key '%s' not found in '%s'" %
+                                 (key, secret_path))
+            replacement = secret[key]
+        self.kv_transform(
+            self.kwargs["vault_addr"],
+            self.kwargs["vault_token"],
+            self.kwargs["transform"],
+            replacement,
+            self.kwargs["transform_key"],
+            self.kwargs["match"],
+            self.kwargs["exclude"] if self.kwargs["exclude"] else [],
+            self.kwargs["preview"]
+        )
+
+    def run_kv_export(self):
+        """
+        Prepares a CLI run of kv_export
+        """
+        self.logger.debug("Preparing run of kv_export")
+        if self.kwargs["shard"]:
+            raise ValueError("--export can't be used with --shard")
+        missing_args = utils.keys_exists_in_dict(
+            self.logger, self.kwargs,
+            [{"key": "vault_addr", "exc": [None, '']},
+             {"key": "vault_token", "exc": [None, False]}]
+        )
+        if len(missing_args):
+            raise ValueError(
+                "Following arguments are missing %s" %
+                [k['key'].replace("_", "-") for k in missing_args]
+            )
+        self.kv_export(
+            self.kwargs["vault_addr"],
+            self.kwargs["vault_token"],
+            self.kwargs["export"][0],
+            self.kwargs["export"][1],
+            self.kwargs["exclude"] if self.kwargs["exclude"] else [],
+            self.kwargs["encrypt"]
+        )
+
+    def run_kv_import(self):
+        """
+        Prepares a CLI run of kv_import
+        """
+        self.logger.debug("Preparing run of kv_import")
+        if self.kwargs["shard"]:
+            raise ValueError("--import can't be used with --shard")
+        missing_args = utils.keys_exists_in_dict(
+            self.logger, self.kwargs,
+            [{"key": "vault_addr", "exc": [None, '']},
+             {"key": "vault_token", "exc": [None, False]}]
+        )
+        if len(missing_args):
+            raise ValueError(
+                "Following arguments are missing %s" %
+                [k['key'].replace("_", "-") for k in missing_args]
+            )
+        self.kv_import(
+            self.kwargs["vault_addr"],
+            self.kwargs["vault_token"],
+            self.kwargs["import"][0],
+            self.kwargs["import"][1],
+            self.kwargs["force"]
+        )
+
+    def run_kv_stats(self):
+        """
+        Prepares a CLI run of kv_stats
+        """
+        self.logger.debug("Preparing run of kv_stats")
+        if self.kwargs["from_snapshot"] or self.kwargs["shard"]:
+            raise ValueError("--stats can't be used with --from-snapshot or "
+                             "--shard")
+        missing_args = utils.keys_exists_in_dict(
+            self.logger, self.kwargs,
+            [{"key": "vault_addr", "exc": [None, '']},
+             {"key": "vault_token", "exc": [None, False]}]
+        )
+        if len(missing_args):
+            raise ValueError(
+                "Following arguments are missing %s" %
+                [k['key'].replace("_", "-") for k in missing_args]
+            )
+        if self.kwargs["stats_depth"] < 1 or self.kwargs["top"] < 1:
+            raise ValueError("--stats-depth and --top must be greater than 0")
+        self.kv_stats(
+            self.kwargs["vault_addr"],
+            self.kwargs["vault_token"],
+            self.command_paths(self.kwargs["stats"], "stats"),
+            self.kwargs["exclude"] if self.kwargs["exclude"] else [],
+            self.kwargs["stats_depth"],
+            self.kwargs["top"]
+        )
+
+    def analyses(self):
+        """
+        Return names of the analyses given as arguments
+
+        :return: list(str)
+        """
+        analyses = ["count", "find_duplicates", "secrets_tree"]
+        analyses = [name for name in analyses
+                    if self.kwargs[name] is not None]
+        if self.kwargs["search"]:
+            analyses.append("search")
+        return analyses
+
+    def run_kv_analyze(self):
+        """
+        Prepares a CLI run of kv_analyze
+        """
+        self.logger.debug("Preparing run of kv_analyze")
+        if self.kwargs["from_snapshot"] or self.kwargs["index"] or \
+                self.shard or self.kwargs["estimate"] or \
+                self.kwargs["metadata_only"]:
+            raise ValueError("Several analyses can't be combined with "
+                             "--from-snapshot, --index, --shard, --estimate "
+                             "or --metadata-only")
+        missing_args = utils.keys_exists_in_dict(
+            self.logger, self.kwargs,
+            [{"key": "vault_addr", "exc": [None, '']},
+             {"key": "vault_token", "exc": [None, False]}]
+        )
+        if len(missing_args):
+            raise ValueError(
+                "Following arguments are missing %s" %
+                [k['key'].replace("_", "-") for k in missing_args]
+            )
+        analyses = self.analyses()
+        self.kv_analyze(
+            self.kwargs["vault_addr"],
+            self.kwargs["vault_token"],
+            self.command_paths(self.kwargs["count"], "count")
+            if "count" in analyses else None,
+            self.command_paths(self.kwargs["find_duplicates"],
+                               "find-duplicates")
+            if "find_duplicates" in analyses else None,
+            self.command_paths(self.kwargs["secrets_tree"], "secrets-tree")
+            if "secrets_tree" in analyses else None,
+            self.kwargs["search"],
+            self.command_paths(self.kwargs["include"])
+            if "search" in analyses else None,
+            self.kwargs["exclude"] if self.kwargs["exclude"] else [],
+            self.kwargs["regex"],
+            self.kwargs["ignore_case"],
+            self.kwargs["processes"],
+            self.kwargs["search_scope"]
+        )
+
     def run_kv_delete(self):
         """
         Prepares a CLI run of kv_delete
@@ -646,10 +3819,51 @@ class VaultManagerKV:
                 "Following arguments are missing %s" %
                 [k['key'].replace("_", "-") for k in missing_args]
             )
+        if self.kwargs["max_failures"] is not None and \
+                self.kwargs["max_failures"] < 1:
+            raise ValueError("--max-failures must be greater than 0")
         self.kv_delete(
             self.kwargs["vault_addr"],
             self.kwargs["vault_token"],
-            self.kwargs["delete"]
+            self.kwargs["delete"],
+            self.kwargs["all_versions"],
+            self.kwargs["max_failures"]
+        )
+
+    def run_kv_copy_to_targets(self, copy_function, copy_paths,
+                               *options):
+        """
+        Prepares a CLI run of a copy to several targets
+
+        :param copy_function: kv_copy_path_to_targets or
+                              kv_copy_secret_to_targets
+        :type copy_function: function
+        :param copy_paths: source and target paths
+        :type copy_paths: list(str)
+        :param options: other arguments of copy_function
+        :type options: list
+        """
+        self.logger.debug("Preparing run of copy to targets")
+        if self.target_timeout is None or self.target_timeout <= 0:
+            raise ValueError("--target-timeout must be greater than 0")
+        missing_args = utils.keys_exists_in_dict(
+            self.logger, self.kwargs,
+            [{"key": "vault_addr", "exc": [None, '']},
+             {"key": "vault_token", "exc": [None, False]}]
+        )
+        if len(missing_args):
+            raise ValueError(
+                "Following arguments are missing %s" %
+                [k['key'].replace("_", "-") for k in missing_args]
+            )
+        copy_function(
+            self.kwargs["vault_addr"],
+            self.kwargs["vault_token"],
+            self.parse_targets(self.kwargs["targets"],
+                               self.kwargs["target_rate"]),
+            copy_paths[0],
+            copy_paths[1],
+            *options
         )
 
     def run_kv_copy_secret(self):
@@ -657,6 +3871,10 @@ class VaultManagerKV:
         Prepares a CLI run of kv_copy_secret
         """
         self.logger.debug("Preparing run of kv_copy_secret")
+        if self.kwargs["targets"]:
+            self.run_kv_copy_to_targets(self.kv_copy_secret_to_targets,
+                                        self.kwargs["copy_secret"])
+            return
         missing_args = utils.keys_exists_in_dict(
             self.logger, self.kwargs,
             [{"key": "vault_addr", "exc": [None, '']},
@@ -678,11 +3896,50 @@ class VaultManagerKV:
             self.kwargs["copy_secret"][1]
         )
 
+    def run_kv_diff(self):
+        """
+        Prepares a CLI run of kv_diff
+        """
+        self.logger.debug("Preparing run of kv_diff")
+        missing_args = utils.keys_exists_in_dict(
+            self.logger, self.kwargs,
+            [{"key": "vault_addr", "exc": [None, '']},
+             {"key": "vault_token", "exc": [None, False]},
+             {"key": "vault_target_addr", "exc": [None, '']},
+             {"key": "vault_target_token", "exc": [None, False]}]
+        )
+        if len(missing_args):
+            raise ValueError(
+                "Following arguments are missing %s" %
+                [k['key'].replace("_", "-") for k in missing_args]
+            )
+        self.kv_diff(
+            self.kwargs["vault_addr"],
+            self.kwargs["vault_token"],
+            self.kwargs["vault_target_addr"],
+            self.kwargs["vault_target_token"],
+            self.kwargs["diff"][0],
+            self.kwargs["diff"][1],
+            self.kwargs["diff_cache"],
+            self.kwargs["cache_max_age"]
+        )
+
     def run_kv_copy_path(self):
         """
         Prepares a CLI run of kv_copy_path
         """
         self.logger.debug("Preparing run of kv_copy_path")
+        if self.kwargs["targets"]:
+            if self.kwargs["sync"] or self.kwargs["journal"]:
+                raise ValueError("--sync and --journal can't be used with "
+                                 "--targets")
+            if self.kwargs["max_failures"] is not None and \
+                    self.kwargs["max_failures"] < 1:
+                raise ValueError("--max-failures must be greater than 0")
+            self.run_kv_copy_to_targets(self.kv_copy_path_to_targets,
+                                        self.kwargs["copy_path"],
+                                        self.kwargs["max_failures"])
+            return
         missing_args = utils.keys_exists_in_dict(
             self.logger, self.kwargs,
             [{"key": "vault_addr", "exc": [None, '']},
@@ -695,13 +3952,122 @@ class VaultManagerKV:
                 "Following arguments are missing %s" %
                 [k['key'].replace("_", "-") for k in missing_args]
             )
+        if self.kwargs["max_failures"] is not None and \
+                self.kwargs["max_failures"] < 1:
+            raise ValueError("--max-failures must be greater than 0")
         self.kv_copy_path(
             self.kwargs["vault_addr"],
             self.kwargs["vault_token"],
             self.kwargs["vault_target_addr"],
             self.kwargs["vault_target_token"],
             self.kwargs["copy_path"][0],
-            self.kwargs["copy_path"][1]
+            self.kwargs["copy_path"][1],
+            self.kwargs["sync"],
+            self.kwargs["prune"],
+            self.kwargs["journal"],
+            self.kwargs["resume"],
+            self.kwargs["max_failures"]
+        )
+
+    def new_walk_budget(self):
+        """
+        Return the walk budget matching the limits given as arguments
+
+        :return: WalkBudget or None
+        """
+        if any(self.kwargs[limit] is not None
+               for limit in ["max_depth", "limit", "time_budget"]):
+            return WalkBudget(self.kwargs["max_depth"],
+                              self.kwargs["limit"],
+                              self.kwargs["time_budget"])
+        return None
+
+    def run_in_namespace(self, namespace):
+        """
+        Run the command in a namespace with a dedicated module instance
+        so namespaces can be processed concurrently
+
+        :param namespace: Vault Enterprise namespace
+        :type namespace: str
+
+        :return: dict or list
+        """
+        self.logger.debug("Running in namespace '%s'" % namespace)
+        module = VaultManagerKV(self.base_logger, self.dry_run, self.skip_tls)
+        module.module_name = self.module_name
+        module.kwargs = self.kwargs
+        module.namespace = namespace
+        module.report = False
+        # namespaces are the unit of concurrency
+        module.workers = 1
+        module.walk_budget = module.new_walk_budget()
+        if self.kwargs["all_mounts"]:
+            module.prepare_all_mounts()
+        module.run_command()
+        return module.result
+
+    def kv_namespaces(self, namespaces):
+        """
+        Run a read-only command in several namespaces concurrently and
+        report all results at once. A failure in a namespace doesn't stop
+        the others
+
+        :param namespaces: Vault Enterprise namespaces
+        :type namespaces: list(str)
+
+        :return: dict
+        """
+        self.logger.debug("KV namespaces fan-out starting")
+        if self.kwargs["from_snapshot"] or self.kwargs["shard"]:
+            raise ValueError("--namespaces can't be used with "
+                             "--from-snapshot or --shard")
+        commands = ["count", "find_duplicates", "secrets_tree", "search"]
+        command = [cmd for cmd in commands if self.kwargs[cmd] is not None]
+        if len(command) > 1:
+            raise ValueError("--namespaces can only be used with one of %s" %
+                             [cmd.replace("_", "-") for cmd in commands])
+        others = ["copy_path", "copy_secret", "delete", "generate_tree",
+                  "snapshot", "merge_shards", "build_index", "index",
+                  "transform", "stats", "export", "import"]
+        if not len(command) or any(self.kwargs[cmd] for cmd in others):
+            raise ValueError("--namespaces can only be used with %s" %
+                             [cmd.replace("_", "-") for cmd in commands])
+        command = command[0].replace("_", "-")
+        results = {}
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+            futures = {namespace: pool.submit(self.run_in_namespace,
+                                              namespace)
+                       for namespace in namespaces}
+            for namespace in namespaces:
+                try:
+                    results[namespace] = futures[namespace].result()
+                except Exception as e:
+                    self.logger.error("Namespace '%s' failed: %s" %
+                                      (namespace, str(e)))
+                    results[namespace] = {"error": str(e)}
+        self.output_result(command, results)
+        return results
+
+    def prepare_all_mounts(self):
+        """
+        Discover KV mounts to add to the paths of the command
+        """
+        self.logger.debug("Preparing discovery of all KV mounts")
+        if self.kwargs["from_snapshot"]:
+            raise ValueError("--all-mounts can't be used with --from-snapshot")
+        missing_args = utils.keys_exists_in_dict(
+            self.logger, self.kwargs,
+            [{"key": "vault_addr", "exc": [None, '']},
+             {"key": "vault_token", "exc": [None, False]}]
+        )
+        if len(missing_args):
+            raise ValueError(
+                "Following arguments are missing %s" %
+                [k['key'].replace("_", "-") for k in missing_args]
+            )
+        self.mounts = self.discover_mounts(
+            self.connect_to_vault(self.kwargs["vault_addr"],
+                                  self.kwargs["vault_token"])
         )
 
     def run(self, kwargs):
@@ -713,35 +4079,97 @@ class VaultManagerKV:
         """
         # Convert kwargs to an Object with kwargs dict as class vars
         self.kwargs = kwargs
-        if not any([self.kwargs["copy_path"], self.kwargs["count"],
+        if not any([self.kwargs["copy_path"],
+                    self.kwargs["count"] is not None,
                     self.kwargs["copy_secret"], self.kwargs["delete"],
-                    self.kwargs["find_duplicates"],
-                    self.kwargs["secrets_tree"], self.kwargs["generate_tree"],
-                    self.kwargs["search"]]):
+                    self.kwargs["find_duplicates"] is not None,
+                    self.kwargs["secrets_tree"] is not None,
+                    self.kwargs["generate_tree"],
+                    self.kwargs["search"], self.kwargs["snapshot"],
+                    self.kwargs["merge_shards"], self.kwargs["diff"],
+                    self.kwargs["build_index"], self.kwargs["transform"],
+                    self.kwargs["stats"] is not None,
+                    self.kwargs["export"], self.kwargs["import"]]):
             self.logger.error("One argument should be specified")
             self.subparser.print_help()
             return False
         self.dry_run = self.kwargs["dry_run"]
         self.skip_tls = self.kwargs["skip_tls"]
+        self.output_file = self.kwargs["output_file"]
+        self.output_format = self.kwargs["output"]
+        self.workers = self.kwargs["workers"]
+        self.target_timeout = self.kwargs["target_timeout"]
+        self.walk_budget = self.new_walk_budget()
         self.logger.debug("Module " + self.module_name + " started")
         try:
-            if self.kwargs["copy_path"]:
-                self.run_kv_copy_path()
-            elif self.kwargs["copy_secret"]:
-                self.run_kv_copy_secret()
-            elif self.kwargs["delete"]:
-                self.run_kv_delete()
-            elif self.kwargs["count"]:
-                self.run_kv_count()
-            elif self.kwargs["find_duplicates"]:
-                self.run_kv_find_duplicates()
-            elif self.kwargs["secrets_tree"]:
-                self.run_kv_secrets_tree()
-            elif self.kwargs["generate_tree"]:
-                self.run_kv_generate_tree()
-            elif self.kwargs["search"]:
-                self.run_kv_search()
+            if self.workers < 1:
+                raise ValueError("--workers must be greater than 0")
+            if self.kwargs["shard"]:
+                if self.kwargs["from_snapshot"]:
+                    raise ValueError("--shard can't be used with "
+                                     "--from-snapshot")
+                self.shard = KVShard.from_string(self.kwargs["shard"],
+                                                 self.kwargs["shard_depth"])
+                self.logger.debug("Running shard %s" % self.shard)
+            if self.output_format == "table" and self.kwargs["stats"] is None:
+                raise ValueError("--output table can only be used with "
+                                 "--stats")
+            if self.output_format == "ndjson":
+                if self.shard:
+                    raise ValueError("--output ndjson can't be used with "
+                                     "--shard, shards outputs are merged "
+                                     "as JSON")
+                self.records = KVRecordWriter(self.base_logger,
+                                              self.output_file)
+            if self.kwargs["namespaces"]:
+                self.kv_namespaces(self.kwargs["namespaces"])
+                return
+            if self.kwargs["all_mounts"]:
+                self.prepare_all_mounts()
+            self.run_command()
         except AttributeError as e:
             self.logger.error(str(e))
         except ValueError as e:
             self.logger.error(str(e))
+        finally:
+            if self.records:
+                self.records.close()
+
+    def run_command(self):
+        """
+        Run the command given as argument
+        """
+        if self.kwargs["merge_shards"]:
+            self.kv_merge_shards(self.kwargs["merge_shards"])
+        elif self.kwargs["copy_path"]:
+            self.run_kv_copy_path()
+        elif self.kwargs["copy_secret"]:
+            self.run_kv_copy_secret()
+        elif self.kwargs["delete"]:
+            self.run_kv_delete()
+        elif len(self.analyses()) > 1:
+            self.run_kv_analyze()
+        elif self.kwargs["count"] is not None:
+            self.run_kv_count()
+        elif self.kwargs["find_duplicates"] is not None:
+            self.run_kv_find_duplicates()
+        elif self.kwargs["secrets_tree"] is not None:
+            self.run_kv_secrets_tree()
+        elif self.kwargs["generate_tree"]:
+            self.run_kv_generate_tree()
+        elif self.kwargs["search"]:
+            self.run_kv_search()
+        elif self.kwargs["snapshot"]:
+            self.run_kv_snapshot()
+        elif self.kwargs["diff"]:
+            self.run_kv_diff()
+        elif self.kwargs["build_index"]:
+            self.run_kv_build_index()
+        elif self.kwargs["transform"]:
+            self.run_kv_transform()
+        elif self.kwargs["stats"] is not None:
+            self.run_kv_stats()
+        elif self.kwargs["export"]:
+            self.run_kv_export()
+        elif self.kwargs["import"]:
+            self.run_kv_import()
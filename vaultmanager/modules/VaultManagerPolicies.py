@@ -1,6 +1,7 @@
 import os
 import glob
 import logging
+import concurrent.futures
 from collections import namedtuple
 
 try:
@@ -56,6 +57,16 @@ class VaultManagerPolicies:
         self.subparser.add_argument(
             "--push", action='store_true', help="Push local policies to Vault"
         )
+        self.subparser.add_argument(
+            "--namespaces", nargs='+', metavar="NAMESPACES",
+            help="""pull policies of each Vault Enterprise namespace of
+            NAMESPACES in namespaces/NAMESPACE/policies of the vault config
+            folder"""
+        )
+        self.subparser.add_argument(
+            "--workers", nargs='?', type=int, default=4, metavar="WORKERS",
+            help="number of namespaces pulled concurrently. Default: 4"
+        )
         self.subparser.set_defaults(module_name=self.module_name)
 
     def check_args_integrity(self):
@@ -70,15 +81,33 @@ class VaultManagerPolicies:
         elif not any([self.kwargs.pull, self.kwargs.push]):
             self.logger.critical("You must specify pull or push")
             return False
+        elif self.kwargs.namespaces and self.kwargs.push:
+            self.logger.critical("namespaces can only be used with pull")
+            return False
+        elif self.kwargs.workers < 1:
+            self.logger.critical("workers must be greater than 0")
+            return False
         return True
 
-    def policies_pull(self):
+    def policies_pull(self, vault_client=None, policies_folder=None):
         """
         Pull policies from vault
+
+        :param vault_client: client to pull from, defaults to vault_client
+        :type vault_client: VaultClient
+        :param policies_folder: folder to pull in, defaults to policies_folder
+        :type policies_folder: str
+
+        :return: list of pulled policies files
         """
+        if not vault_client:
+            vault_client = self.vault_client
+        if not policies_folder:
+            policies_folder = self.policies_folder
         self.logger.info("Pulling Policies from Vault")
         self.logger.debug("Pulling policies")
-        distant_policies = self.vault_client.policy_list()
+        pulled = []
+        distant_policies = vault_client.policy_list()
         self.logger.info("Distant policies found:" + str(distant_policies))
         for policy in distant_policies:
             # policy name will always be 'type_name_policy'
@@ -89,17 +118,70 @@ class VaultManagerPolicies:
                                     "and will not be pulled")
                 continue
             # create the parent folder policy if doest not exists (user, etc...)
-            policy_folder = os.path.join(self.policies_folder, splitted[0])
+            policy_folder = os.path.join(policies_folder, splitted[0])
             if not os.path.isdir(policy_folder):
                 self.logger.debug("Folder " + policy_folder +
                                   " doest not exists, creating...")
-                os.makedirs(policy_folder)
+                os.makedirs(policy_folder, exist_ok=True)
             # create the policy file
             policy_path = os.path.join(policy_folder, splitted[1] + ".hcl")
             with open(policy_path, 'w+') as fd:
-                fd.write(self.vault_client.policy_get(policy))
+                fd.write(vault_client.policy_get(policy))
                 self.logger.info("Policy " + policy_path + " saved")
+            pulled.append(policy_path)
         self.logger.info("Policies fetched in policies folder")
+        return pulled
+
+    def policies_pull_namespace(self, namespace):
+        """
+        Pull policies of a namespace in its own vault config folder
+
+        :param namespace: Vault Enterprise namespace
+        :type namespace: str
+
+        :return: list of pulled policies files
+        """
+        self.logger.debug("Pulling policies of namespace '%s'" % namespace)
+        vault_client = VaultClient(
+            self.base_logger,
+            vault_addr=self.kwargs.vault_addr,
+            dry=self.kwargs.dry_run,
+            skip_tls=self.kwargs.skip_tls,
+            namespace=namespace
+        )
+        vault_client.authenticate()
+        policies_folder = os.path.join(
+            self.kwargs.vault_config, "namespaces", namespace, "policies"
+        )
+        return self.policies_pull(vault_client, policies_folder)
+
+    def policies_pull_namespaces(self, namespaces):
+        """
+        Pull policies of several namespaces concurrently. A failure in a
+        namespace doesn't stop the others
+
+        :param namespaces: Vault Enterprise namespaces
+        :type namespaces: list(str)
+
+        :return: dict of pulled policies files by namespace
+        """
+        self.logger.debug("Pulling policies of namespaces %s" % namespaces)
+        pulled = {}
+        with concurrent.futures.ThreadPoolExecutor(
+                self.kwargs.workers) as pool:
+            futures = {namespace: pool.submit(self.policies_pull_namespace,
+                                              namespace)
+                       for namespace in namespaces}
+            for namespace in namespaces:
+                try:
+                    pulled[namespace] = futures[namespace].result()
+                except Exception as e:
+                    self.logger.error("Namespace '%s' failed: %s" %
+                                      (namespace, str(e)))
+        for namespace in pulled:
+            self.logger.info("Namespace '%s': %s policies pulled" %
+                             (namespace, len(pulled[namespace])))
+        return pulled
 
     def policies_push(self):
         """
@@ -166,6 +248,9 @@ class VaultManagerPolicies:
         )
         if not os.path.isdir(self.policies_folder):
             os.mkdir(self.policies_folder)
+        if self.kwargs.namespaces:
+            self.policies_pull_namespaces(self.kwargs.namespaces)
+            return
         self.vault_client = VaultClient(
             self.base_logger,
             vault_addr=self.kwargs.vault_addr,
@@ -0,0 +1,624 @@
+import gzip
+import sqlite3
+import subprocess
+import json
+import os
+import pytest
+
+KV_MOUNT = "kvtest"
+
+SECRETS = {
+    "apps/app1/credentials": {"username": "user1", "password": "secret1"},
+    "apps/app1/prod/db": {"password": "secret1"},
+    "apps/app2/prod/db": {"password": "secret2", "host": "db.local"},
+    "apps/app2/dev/db": {"password": "secret2"},
+    "apps/token": {"token": "token1"},
+    "services/svc1/account": {"login": "svc1", "password": "secret1"},
+}
+
+
+def cli(args):
+    proc = subprocess.run(
+        ["vault-manager"] + args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    return proc.stdout, proc.stderr, proc.returncode
+
+
+@pytest.fixture
+def kv_mount(vault_client):
+    vault_client.enable_secret_backend("kv", mount_point=KV_MOUNT)
+    for path, secret in SECRETS.items():
+        vault_client.write(KV_MOUNT + "/" + path, **secret)
+    yield KV_MOUNT
+    vault_client.disable_secret_backend(KV_MOUNT)
+
+
+def test_kv_count(kv_mount):
+    out, err, rc = cli(["kv", "--count", kv_mount + "/apps",
+                        kv_mount + "/services"])
+    assert rc == 0
+    count = json.loads(out.decode())
+    assert count[kv_mount + "/apps"] == {"secrets_count": 5,
+                                         "values_count": 7}
+    assert count[kv_mount + "/services"] == {"secrets_count": 1,
+                                             "values_count": 2}
+
+
+def test_kv_stats(kv_mount):
+    out, err, rc = cli(["kv", "--stats", kv_mount + "/apps", "--top", "2"])
+    assert rc == 0
+    stats = json.loads(out.decode())[kv_mount + "/apps"]
+    assert stats["secrets_count"] == 5
+    assert stats["values_count"] == 7
+    assert sorted(stats["subtrees"]) == [kv_mount + "/apps/app1",
+                                         kv_mount + "/apps/app2"]
+    assert stats["depths"] == {"1": 1, "2": 1, "3": 3}
+    assert stats["key_names"] == {"password": 4, "host": 1}
+    assert len(stats["largest_secrets"]) == 2
+    assert sum(values["secrets_count"]
+               for values in stats["subtrees"].values()) == 4
+
+
+def test_kv_snapshot(kv_mount, tmp_path):
+    snapshot_file = os.path.join(tmp_path, "snapshot.db")
+    out, err, rc = cli(["kv", "--snapshot", snapshot_file, "-i", kv_mount])
+    assert rc == 0
+    assert os.path.isfile(snapshot_file)
+    with sqlite3.connect(snapshot_file) as connection:
+        meta = dict(connection.execute("SELECT name, value FROM meta"))
+    assert "digest_key" not in meta
+    out, err, rc = cli(["kv", "--count", kv_mount + "/apps",
+                        "--from-snapshot", snapshot_file])
+    assert rc == 0
+    count = json.loads(out.decode())
+    assert count[kv_mount + "/apps"] == {"secrets_count": 5,
+                                         "values_count": 7}
+    out, err, rc = cli(["kv", "--find-duplicates", kv_mount,
+                        "--from-snapshot", snapshot_file])
+    assert rc == 0
+    duplicates = json.loads(out.decode())
+    assert len(duplicates) == 2
+    assert sorted(len(group) for group in duplicates.values()) == [2, 3]
+
+
+def test_kv_count_overlapping_paths(kv_mount):
+    out, err, rc = cli(["kv", "--count", kv_mount + "/apps",
+                        kv_mount + "/apps/app2", kv_mount])
+    assert rc == 0
+    count = json.loads(out.decode())
+    assert count[kv_mount + "/apps"] == {"secrets_count": 5,
+                                         "values_count": 7}
+    assert count[kv_mount + "/apps/app2"] == {"secrets_count": 2,
+                                              "values_count": 3}
+    assert count[kv_mount] == {"secrets_count": 6, "values_count": 9}
+
+
+def test_kv_find_duplicates_digests(kv_mount, monkeypatch, tmp_path):
+    out, err, rc = cli(["kv", "--find-duplicates", kv_mount,
+                        "--workers", "4"])
+    assert rc == 0
+    duplicates = json.loads(out.decode())
+    assert sorted(duplicates.values()) == [
+        [kv_mount + "/apps/app1/credentials:password",
+         kv_mount + "/apps/app1/prod/db:password",
+         kv_mount + "/services/svc1/account:password"],
+        [kv_mount + "/apps/app2/dev/db:password",
+         kv_mount + "/apps/app2/prod/db:password"]
+    ]
+    monkeypatch.setenv("VAULT_MANAGER_DIGEST_KEY", "k" * 32)
+    shard_files = []
+    for index in range(2):
+        shard_file = os.path.join(tmp_path, "shard%s.json" % index)
+        out, err, rc = cli(["kv", "--find-duplicates", kv_mount,
+                            "--shard", "%s/2" % index,
+                            "--output-file", shard_file])
+        assert rc == 0
+        with open(shard_file) as fd:
+            content = fd.read()
+        # shards only hold keyed digests of values
+        assert "secret1" not in content and "secret2" not in content
+        shard_files.append(shard_file)
+    out, err, rc = cli(["kv", "--merge-shards"] + shard_files)
+    assert rc == 0
+    assert sorted(json.loads(out.decode()).values()) == \
+        sorted(duplicates.values())
+
+
+def test_kv_find_duplicates_overlapping_paths(kv_mount):
+    out, err, rc = cli(["kv", "--find-duplicates", kv_mount,
+                        kv_mount + "/apps"])
+    assert rc == 0
+    duplicates = json.loads(out.decode())
+    assert sorted(len(group) for group in duplicates.values()) == [2, 3]
+
+
+def test_kv_secrets_tree_glob(kv_mount):
+    out, err, rc = cli(["kv", "--secrets-tree", kv_mount + "/apps/*/prod/**",
+                        "--exclude", kv_mount + "/**/app1"])
+    assert rc == 0
+    tree = json.loads(out.decode())
+    assert tree[kv_mount + "/apps/*/prod/**"] == [
+        kv_mount + "/apps/app2/prod/db"
+    ]
+
+
+def test_kv_secrets_tree_limit(kv_mount):
+    out, err, rc = cli(["kv", "--secrets-tree", kv_mount, "--limit", "2"])
+    assert rc == 0
+    tree = json.loads(out.decode())
+    assert len(tree[kv_mount]) == 2
+    assert tree["__truncated__"] == {"reason": "limit", "secrets_listed": 2}
+
+
+def test_kv_count_estimate_full_sample(kv_mount):
+    out, err, rc = cli(["kv", "--count", kv_mount + "/apps", "--estimate",
+                        "--sample-fraction", "1", "--seed", "1"])
+    assert rc == 0
+    count = json.loads(out.decode())[kv_mount + "/apps"]
+    assert count["secrets_count"] == 5
+    assert count["values_count"] == 7
+    assert count["secrets_count_ci95"] == [5, 5]
+    assert count["seed"] == 1
+
+
+def test_kv_count_shards_merge(kv_mount, tmp_path):
+    shard_files = []
+    for index in range(2):
+        shard_file = os.path.join(tmp_path, "shard%s.json" % index)
+        out, err, rc = cli(["kv", "--count", kv_mount + "/apps",
+                            "--shard", "%s/2" % index,
+                            "--output-file", shard_file])
+        assert rc == 0
+        assert json.loads(out.decode())["shard"] == [index, 2]
+        shard_files.append(shard_file)
+    out, err, rc = cli(["kv", "--merge-shards"] + shard_files)
+    assert rc == 0
+    count = json.loads(out.decode())
+    assert count[kv_mount + "/apps"] == {"secrets_count": 5,
+                                         "values_count": 7}
+
+
+def test_kv_count_all_mounts(kv_mount):
+    out, err, rc = cli(["kv", "--count", "--all-mounts", "--workers", "2"])
+    assert rc == 0
+    count = json.loads(out.decode())
+    assert count[kv_mount] == {"secrets_count": 6, "values_count": 9}
+
+
+def test_kv_count_all_mounts_v2(kv_mount, vault_client):
+    vault_client.enable_secret_backend("kv", mount_point=KV_MOUNT + "2",
+                                       options={"version": "2"})
+    try:
+        vault_client.write(KV_MOUNT + "2/data/apps/app1",
+                           data={"username": "user1", "password": "v1"})
+        out, err, rc = cli(["kv", "--count", "--all-mounts"])
+        assert rc == 0
+        count = json.loads(out.decode())
+        assert count[kv_mount] == {"secrets_count": 6, "values_count": 9}
+        assert count[KV_MOUNT + "2"] == {"secrets_count": 1,
+                                         "values_count": 2}
+        out, err, rc = cli(["kv", "--secrets-tree", KV_MOUNT + "2"])
+        assert rc == 0
+        tree = json.loads(out.decode())
+        assert tree[KV_MOUNT + "2"] == [KV_MOUNT + "2/apps/app1"]
+    finally:
+        vault_client.disable_secret_backend(KV_MOUNT + "2")
+
+
+def test_kv_copy_path_sync(kv_mount, vault_client, monkeypatch, tmp_path):
+    monkeypatch.setenv("VAULT_TARGET_ADDR", os.getenv("VAULT_ADDR"))
+    monkeypatch.setenv("VAULT_TARGET_TOKEN", os.getenv("VAULT_TOKEN"))
+    out, err, rc = cli(["kv", "--copy-path", kv_mount + "/apps",
+                        kv_mount + "/backup"])
+    assert rc == 0
+    vault_client.write(kv_mount + "/backup/app1/prod/db", password="changed")
+    vault_client.write(kv_mount + "/backup/extra", key="value")
+    report_file = os.path.join(tmp_path, "report.json")
+    out, err, rc = cli(["kv", "--copy-path", kv_mount + "/apps",
+                        kv_mount + "/backup", "--sync", "--prune",
+                        "--output-file", report_file])
+    assert rc == 0
+    with open(report_file) as fd:
+        report = json.load(fd)
+    assert report == {"unchanged": 4, "created": 0, "updated": 1,
+                      "deleted": 1}
+    assert vault_client.read(
+        kv_mount + "/backup/app1/prod/db")["data"] == {"password": "secret1"}
+    assert vault_client.read(kv_mount + "/backup/extra") is None
+
+
+def test_kv_copy_path_failures(kv_mount, vault_client, monkeypatch,
+                               tmp_path):
+    vault_client.set_policy("kvtest-copy", """
+path "%s/*" { capabilities = ["read", "list"] }
+path "%s/apps/app1/credentials" { capabilities = ["deny"] }
+""" % (kv_mount, kv_mount))
+    token = vault_client.create_token(policies=["kvtest-copy"])
+    monkeypatch.setenv("VAULT_TARGET_ADDR", os.getenv("VAULT_ADDR"))
+    monkeypatch.setenv("VAULT_TARGET_TOKEN", os.getenv("VAULT_TOKEN"))
+    monkeypatch.setenv("VAULT_TOKEN", token["auth"]["client_token"])
+    report_file = os.path.join(tmp_path, "report.json")
+    out, err, rc = cli(["kv", "--copy-path", kv_mount + "/apps",
+                        kv_mount + "/copy", "--workers", "4",
+                        "--output-file", report_file])
+    with open(report_file) as fd:
+        report = json.load(fd)
+    assert report["secrets_copied"] == 4
+    assert list(report["failed"]) == [kv_mount + "/apps/app1/credentials"]
+    assert report["stopped"] is False
+    assert vault_client.read(kv_mount + "/copy/app2/prod/db")["data"] == \
+        SECRETS["apps/app2/prod/db"]
+    assert vault_client.read(kv_mount + "/copy/app1/credentials") is None
+    vault_client.delete_policy("kvtest-copy")
+
+
+def test_kv_copy_path_resume(kv_mount, vault_client, monkeypatch, tmp_path):
+    monkeypatch.setenv("VAULT_TARGET_ADDR", os.getenv("VAULT_ADDR"))
+    monkeypatch.setenv("VAULT_TARGET_TOKEN", os.getenv("VAULT_TOKEN"))
+    journal_file = os.path.join(tmp_path, "journal.jsonl")
+    with open(journal_file, "w") as fd:
+        fd.write(json.dumps({"from": kv_mount + "/apps/token",
+                             "to": kv_mount + "/resumed/token"}) + "\n")
+    out, err, rc = cli(["kv", "--copy-path", kv_mount + "/apps",
+                        kv_mount + "/resumed", "--journal", journal_file,
+                        "--resume"])
+    assert rc == 0
+    assert "1 secrets already copied skipped" in out.decode()
+    assert vault_client.read(kv_mount + "/resumed/token") is None
+    with open(journal_file) as fd:
+        assert len(fd.readlines()) == 5
+
+
+def test_kv_copy_path_targets(kv_mount, vault_client, monkeypatch, tmp_path):
+    monkeypatch.setenv("TARGET_TOKEN", os.getenv("VAULT_TOKEN"))
+    report_file = os.path.join(tmp_path, "report.json")
+    out, err, rc = cli(["kv", "--copy-path", kv_mount + "/apps",
+                        kv_mount + "/replica", "--targets",
+                        os.getenv("VAULT_ADDR") + "=TARGET_TOKEN@20",
+                        "--output-file", report_file])
+    assert rc == 0
+    with open(report_file) as fd:
+        report = json.load(fd)
+    assert report["secrets_read"] == 5
+    assert report["targets"][os.getenv("VAULT_ADDR")] == {
+        "written": 5, "failed": 0, "errors": []}
+    assert vault_client.read(
+        kv_mount + "/replica/app1/prod/db")["data"] == {"password": "secret1"}
+
+
+def test_kv_copy_path_unavailable_target(kv_mount, vault_client,
+                                         monkeypatch, tmp_path):
+    monkeypatch.setenv("TARGET_TOKEN", os.getenv("VAULT_TOKEN"))
+    report_file = os.path.join(tmp_path, "report.json")
+    out, err, rc = cli(["kv", "--copy-path", kv_mount + "/apps",
+                        kv_mount + "/replica", "--targets",
+                        os.getenv("VAULT_ADDR") + "=TARGET_TOKEN",
+                        "http://127.0.0.1:1=TARGET_TOKEN",
+                        "--output-file", report_file])
+    with open(report_file) as fd:
+        report = json.load(fd)
+    assert report["targets"][os.getenv("VAULT_ADDR")]["written"] == 5
+    assert report["targets"]["http://127.0.0.1:1"]["failed"] == 5
+    assert report["targets"]["http://127.0.0.1:1"]["error"]
+    assert vault_client.read(kv_mount + "/replica/token") is not None
+
+
+def test_kv_copy_path_targets_read_failures(kv_mount, vault_client,
+                                            monkeypatch, tmp_path):
+    vault_client.set_policy("kvtest-copy", """
+path "%s/*" { capabilities = ["read", "list"] }
+path "%s/apps/app1/credentials" { capabilities = ["deny"] }
+""" % (kv_mount, kv_mount))
+    token = vault_client.create_token(policies=["kvtest-copy"])
+    monkeypatch.setenv("TARGET_TOKEN", os.getenv("VAULT_TOKEN"))
+    monkeypatch.setenv("VAULT_TOKEN", token["auth"]["client_token"])
+    report_file = os.path.join(tmp_path, "report.json")
+    out, err, rc = cli(["kv", "--copy-path", kv_mount + "/apps",
+                        kv_mount + "/replica", "--targets",
+                        os.getenv("VAULT_ADDR") + "=TARGET_TOKEN",
+                        "--output-file", report_file])
+    with open(report_file) as fd:
+        report = json.load(fd)
+    assert report["secrets_read"] == 4
+    assert report["targets"][os.getenv("VAULT_ADDR")]["written"] == 4
+    assert report["targets"][os.getenv("VAULT_ADDR")]["dropped"] == 0
+    assert list(report["failed"]) == [kv_mount + "/apps/app1/credentials"]
+    assert report["stopped"] is False
+    assert vault_client.read(kv_mount + "/replica/token") is not None
+    vault_client.delete_policy("kvtest-copy")
+
+
+def test_kv_secrets_tree_ndjson(kv_mount, tmp_path):
+    output_file = os.path.join(tmp_path, "tree.ndjson.gz")
+    out, err, rc = cli(["kv", "--secrets-tree", kv_mount + "/apps/app2",
+                        "--output", "ndjson", "--output-file", output_file])
+    assert rc == 0
+    records = [json.loads(line) for line in out.decode().splitlines()]
+    assert sorted(record["secret"] for record in records) == [
+        kv_mount + "/apps/app2/dev/db",
+        kv_mount + "/apps/app2/prod/db"
+    ]
+    with gzip.open(output_file, "rt") as fd:
+        assert [json.loads(line) for line in fd] == records
+
+
+def test_kv_search(kv_mount):
+    out, err, rc = cli(["kv", "--search", "SECRET1", "prod", "--include",
+                        kv_mount + "/apps", "--ignore-case",
+                        "--processes", "2"])
+    assert rc == 0
+    found = json.loads(out.decode())
+    assert found == {
+        kv_mount + "/apps/app1/credentials/password": ["SECRET1"],
+        kv_mount + "/apps/app1/prod/db/password": ["SECRET1", "prod"],
+        kv_mount + "/apps/app2/prod/db/host": ["prod"],
+        kv_mount + "/apps/app2/prod/db/password": ["prod"],
+    }
+    out, err, rc = cli(["kv", "--search", "^secret[12]$", "--include",
+                        kv_mount + "/apps/app2", "--regex"])
+    assert rc == 0
+    assert sorted(json.loads(out.decode())) == [
+        kv_mount + "/apps/app2/dev/db/password",
+        kv_mount + "/apps/app2/prod/db/password"
+    ]
+
+
+def test_kv_combined_analyses(kv_mount):
+    out, err, rc = cli(["kv", "--count", kv_mount + "/apps",
+                        "--find-duplicates", kv_mount + "/apps",
+                        "--secrets-tree", kv_mount + "/apps/app2/prod",
+                        "--search", "prod", "--include",
+                        kv_mount + "/apps/app2"])
+    assert rc == 0
+    report = json.loads(out.decode())
+    assert sorted(report) == ["count", "find-duplicates", "search",
+                              "secrets-tree"]
+    assert report["count"][kv_mount + "/apps"] == {"secrets_count": 5,
+                                                   "values_count": 7}
+    assert report["secrets-tree"][kv_mount + "/apps/app2/prod"] == [
+        kv_mount + "/apps/app2/prod/db"
+    ]
+    assert sorted(report["search"]) == [
+        kv_mount + "/apps/app2/prod/db/host",
+        kv_mount + "/apps/app2/prod/db/password"
+    ]
+
+
+def test_kv_search_scope(kv_mount):
+    out, err, rc = cli(["kv", "--search", "prod", "--include",
+                        kv_mount + "/apps", "--search-scope", "paths"])
+    assert rc == 0
+    assert json.loads(out.decode()) == {
+        kv_mount + "/apps/app1/prod/db": ["prod"],
+        kv_mount + "/apps/app2/prod/db": ["prod"],
+    }
+    out, err, rc = cli(["kv", "--search", "name", "--include",
+                        kv_mount, "--search-scope", "keys"])
+    assert rc == 0
+    assert json.loads(out.decode()) == {
+        kv_mount + "/apps/app1/credentials/username": ["name"],
+    }
+
+
+def test_kv_search_index(kv_mount, monkeypatch, tmp_path):
+    from cryptography.fernet import Fernet
+    monkeypatch.setenv("VAULT_MANAGER_INDEX_KEY",
+                       Fernet.generate_key().decode())
+    index_file = os.path.join(tmp_path, "kv.idx")
+    out, err, rc = cli(["kv", "--build-index", index_file, "-i", kv_mount,
+                        "--index-values"])
+    assert rc == 0
+    with open(index_file, "rb") as fd:
+        assert b"secret1" not in fd.read()
+    out, err, rc = cli(["kv", "--search", "prod", "secret2", "--index",
+                        index_file, "--exclude", kv_mount + "/apps/app2/dev"])
+    assert rc == 0
+    assert json.loads(out.decode()[out.decode().index("{"):]) == {
+        kv_mount + "/apps/app1/prod/db/password": ["prod"],
+        kv_mount + "/apps/app2/prod/db/host": ["prod"],
+        kv_mount + "/apps/app2/prod/db/password": ["prod"],
+        "__candidates__": {
+            kv_mount + "/apps/app2/prod/db/password": ["secret2"]
+        }
+    }
+    with open(index_file, "wb") as fd:
+        fd.write(b"corrupt")
+    out, err, rc = cli(["kv", "--search", "prod", "--index", index_file])
+    assert b"Traceback" not in out + err
+    assert b"can't be decrypted with this key" in out + err
+
+
+def test_kv_transform(kv_mount, vault_client):
+    out, err, rc = cli(["kv", "--transform", kv_mount + "/apps",
+                        "--match", "secret2", "--replace-with", "rotated2",
+                        "--preview"])
+    assert rc == 0
+    preview = json.loads(out.decode()[out.decode().index("{"):])
+    assert sorted(preview["changes"]) == [
+        kv_mount + "/apps/app2/dev/db:password",
+        kv_mount + "/apps/app2/prod/db:password"
+    ]
+    assert vault_client.read(
+        kv_mount + "/apps/app2/dev/db")["data"] == {"password": "secret2"}
+    out, err, rc = cli(["kv", "--transform", kv_mount + "/apps",
+                        "--match", "secret2", "--replace-with", "rotated2"])
+    assert rc == 0
+    report = json.loads(out.decode()[out.decode().index("{"):])
+    assert report == {"updated": [kv_mount + "/apps/app2/dev/db",
+                                  kv_mount + "/apps/app2/prod/db"],
+                      "unchanged": 3, "skipped": [], "failed": {}}
+    assert vault_client.read(kv_mount + "/apps/app2/prod/db")["data"] == {
+        "password": "rotated2", "host": "db.local"}
+    out, err, rc = cli(["kv", "--transform", kv_mount + "/apps",
+                        "--match", "rotated2", "--replace-with", "secret2",
+                        "--exclude", "unmounted/apps"])
+    assert b"Excluded path 'unmounted/apps' is not on the mount" in out + err
+    assert vault_client.read(kv_mount + "/apps/app2/prod/db")["data"] == {
+        "password": "rotated2", "host": "db.local"}
+
+
+def test_kv_export_import(kv_mount, vault_client, monkeypatch, tmp_path):
+    from cryptography.fernet import Fernet
+    monkeypatch.setenv("VAULT_MANAGER_EXPORT_KEY",
+                       Fernet.generate_key().decode())
+    export_file = os.path.join(tmp_path, "apps.export.gz")
+    out, err, rc = cli(["kv", "--export", kv_mount + "/apps", export_file,
+                        "--encrypt", "--workers", "2"])
+    assert rc == 0
+    report = json.loads(out.decode()[out.decode().index("{"):])
+    assert report == {"secrets_exported": 5}
+    out, err, rc = cli(["kv", "--import", export_file,
+                        kv_mount + "/restored", "--workers", "2"])
+    assert rc == 0
+    out, err, rc = cli(["kv", "--count", kv_mount + "/restored"])
+    assert json.loads(out.decode())[kv_mount + "/restored"] == {
+        "secrets_count": 5, "values_count": 7
+    }
+    assert os.stat(export_file).st_mode & 0o777 == 0o600
+    partial_file = os.path.join(tmp_path, "partial.export.gz")
+    out, err, rc = cli(["kv", "--export", kv_mount + "/apps", partial_file,
+                        "--limit", "2"])
+    out, err, rc = cli(["kv", "--import", partial_file,
+                        kv_mount + "/partial"])
+    assert b"is an incomplete export" in out + err
+    assert vault_client.read(kv_mount + "/partial/token") is None
+
+
+def test_kv_delete(kv_mount, vault_client):
+    out, err, rc = cli(["kv", "--delete", kv_mount + "/apps/app2",
+                        "--workers", "2"])
+    assert rc == 0
+    report = json.loads(out.decode()[out.decode().index("{"):])
+    assert report == {"deleted": [kv_mount + "/apps/app2/dev/db",
+                                  kv_mount + "/apps/app2/prod/db"],
+                      "failed": {}, "stopped": False}
+    assert vault_client.read(kv_mount + "/apps/app2/prod/db") is None
+    assert vault_client.read(kv_mount + "/apps/app1/prod/db") is not None
+
+
+def test_kv_count_metadata_only(vault_client):
+    vault_client.enable_secret_backend("kv", mount_point=KV_MOUNT + "2",
+                                       options={"version": "2"})
+    try:
+        for version in ["v1", "v2"]:
+            vault_client.write(KV_MOUNT + "2/data/apps/app1",
+                               data={"password": version})
+        vault_client.write(KV_MOUNT + "2/data/apps/app2",
+                           data={"password": "v1"})
+        out, err, rc = cli(["kv", "--count", KV_MOUNT + "2/apps",
+                            "--metadata-only"])
+        assert rc == 0
+        count = json.loads(out.decode())
+        assert count[KV_MOUNT + "2/apps"] == {"secrets_count": 2,
+                                              "versions_count": 3}
+    finally:
+        vault_client.disable_secret_backend(KV_MOUNT + "2")
+
+
+def test_kv_delete_all_versions(vault_client):
+    vault_client.enable_secret_backend("kv", mount_point=KV_MOUNT + "2",
+                                       options={"version": "2"})
+    try:
+        for version in ["v1", "v2"]:
+            vault_client.write(KV_MOUNT + "2/data/apps/app1",
+                               data={"password": version})
+        out, err, rc = cli(["kv", "--delete", KV_MOUNT + "2/apps",
+                            "--all-versions"])
+        assert rc == 0
+        assert vault_client.read(KV_MOUNT + "2/metadata/apps/app1") is None
+    finally:
+        vault_client.disable_secret_backend(KV_MOUNT + "2")
+
+
+def test_kv_diff(kv_mount, vault_client, monkeypatch, tmp_path):
+    monkeypatch.setenv("VAULT_TARGET_ADDR", os.getenv("VAULT_ADDR"))
+    monkeypatch.setenv("VAULT_TARGET_TOKEN", os.getenv("VAULT_TOKEN"))
+    for path, secret in SECRETS.items():
+        vault_client.write(kv_mount + "/copy/" + path, **secret)
+    vault_client.write(kv_mount + "/copy/apps/app1/prod/db", password="other")
+    vault_client.delete(kv_mount + "/copy/apps/token")
+    vault_client.write(kv_mount + "/copy/apps/app3/db", password="secret3")
+    report_file = os.path.join(tmp_path, "diff.json")
+    out, err, rc = cli(["kv", "--diff", kv_mount + "/apps",
+                        kv_mount + "/copy/apps", "--output-file", report_file])
+    assert rc == 0
+    with open(report_file) as fd:
+        report = json.load(fd)
+    assert report["added"] == ["app3/db"]
+    assert report["removed"] == ["token"]
+    assert report["changed"] == ["app1/prod/db"]
+    assert not report["in_sync"]
+    assert "secret1" not in out.decode() and "other" not in out.decode()
+
+
+def test_kv_diff_cache(kv_mount, vault_client, monkeypatch, tmp_path):
+    monkeypatch.setenv("VAULT_TARGET_ADDR", os.getenv("VAULT_ADDR"))
+    monkeypatch.setenv("VAULT_TARGET_TOKEN", os.getenv("VAULT_TOKEN"))
+    monkeypatch.setenv("VAULT_MANAGER_DIGEST_KEY", "k" * 32)
+    for path, secret in SECRETS.items():
+        vault_client.write(kv_mount + "/copy/" + path, **secret)
+    vault_client.write(kv_mount + "/copy/apps/app1/prod/db", password="other")
+    cache_file = os.path.join(tmp_path, "cache.json")
+    report_file = os.path.join(tmp_path, "diff.json")
+
+    def diff():
+        out, err, rc = cli(["kv", "--diff", kv_mount + "/apps",
+                            kv_mount + "/copy/apps", "--diff-cache",
+                            cache_file, "--output-file", report_file])
+        assert rc == 0
+        with open(report_file) as fd:
+            return json.load(fd)
+
+    assert diff()["changed"] == ["app1/prod/db"]
+    # changes outside the subtrees which differed
+    vault_client.write(kv_mount + "/copy/apps/app2/new", key="value")
+    vault_client.write(kv_mount + "/copy/apps/app2/prod/db", password="x")
+    report = diff()
+    assert report["added"] == ["app2/new"]
+    assert report["changed"] == ["app1/prod/db", "app2/prod/db"]
+    # KV version 1 secrets have no version to check a cached digest
+    assert report["cached_secrets"] == 0
+    vault_client.write(kv_mount + "/copy/apps/app1/prod/db",
+                       password="secret1")
+    vault_client.write(kv_mount + "/copy/apps/app2/prod/db",
+                       password="secret2")
+    vault_client.delete(kv_mount + "/copy/apps/app2/new")
+    assert diff()["in_sync"] is True
+
+
+def test_kv_diff_cache_versions(vault_client, monkeypatch, tmp_path):
+    monkeypatch.setenv("VAULT_TARGET_ADDR", os.getenv("VAULT_ADDR"))
+    monkeypatch.setenv("VAULT_TARGET_TOKEN", os.getenv("VAULT_TOKEN"))
+    monkeypatch.setenv("VAULT_MANAGER_DIGEST_KEY", "k" * 32)
+    vault_client.enable_secret_backend("kv", mount_point=KV_MOUNT + "2",
+                                       options={"version": "2"})
+    cache_file = os.path.join(tmp_path, "cache.json")
+    report_file = os.path.join(tmp_path, "diff.json")
+
+    def diff():
+        out, err, rc = cli(["kv", "--diff", KV_MOUNT + "2/apps",
+                            KV_MOUNT + "2/copy", "--diff-cache",
+                            cache_file, "--output-file", report_file])
+        assert rc == 0
+        with open(report_file) as fd:
+            return json.load(fd)
+
+    try:
+        for path, secret in SECRETS.items():
+            if path.startswith("apps/"):
+                for folder in ["apps", "copy"]:
+                    vault_client.write(
+                        KV_MOUNT + "2/data/" + folder + path[4:],
+                        data=secret
+                    )
+        assert diff()["in_sync"] is True
+        vault_client.write(KV_MOUNT + "2/data/copy/app2/prod/db",
+                           data={"password": "x"})
+        report = diff()
+        assert report["changed"] == ["app2/prod/db"]
+        # secrets whose version didn't change keep their cached digest
+        assert report["cached_secrets"] == 9
+    finally:
+        vault_client.disable_secret_backend(KV_MOUNT + "2")
@@ -0,0 +1,126 @@
+import subprocess
+import threading
+import json
+import os
+import pytest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+
+NAMESPACES = {
+    "team-a": {
+        "secrets": {
+            "secret/apps/app1": {"password": "secret1"},
+            "secret/apps/app2": {"password": "secret2", "host": "db.local"},
+        },
+        "policies": {"user_alice_policy": 'path "secret/*" {}'},
+    },
+    "team-b": {
+        "secrets": {
+            "secret/apps/app1": {"password": "secret3"},
+        },
+        "policies": {"user_bob_policy": 'path "secret/apps/*" {}',
+                     "service_app1_policy": 'path "secret/apps/app1" {}'},
+    },
+}
+
+
+def cli(args):
+    proc = subprocess.run(
+        ["vault-manager"] + args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    return proc.stdout, proc.stderr, proc.returncode
+
+
+class StandInVault(BaseHTTPRequestHandler):
+    """
+    Minimal Vault API serving a different content for each namespace
+    given in the X-Vault-Namespace header
+    """
+
+    def reply(self, code, body):
+        content = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path[len("/v1/"):].strip("/")
+        listing = parse_qs(url.query).get("list", [""])[0].lower() == "true"
+        namespace = NAMESPACES.get(self.headers.get("X-Vault-Namespace"))
+        if path == "auth/token/lookup-self":
+            return self.reply(200, {"data": {"policies": ["root"]}})
+        if namespace is None:
+            return self.reply(404, {"errors": []})
+        if path == "sys/policy":
+            policies = sorted(namespace["policies"]) + ["default", "root"]
+            return self.reply(200, {"policies": policies, "keys": policies})
+        if path.startswith("sys/policy/"):
+            name = path[len("sys/policy/"):]
+            return self.reply(200, {"name": name,
+                                    "rules": namespace["policies"][name]})
+        if listing:
+            keys = set()
+            for secret in namespace["secrets"]:
+                if secret.startswith(path + "/"):
+                    child = secret[len(path) + 1:].split("/")
+                    keys.add(child[0] + "/" if len(child) > 1 else child[0])
+            if len(keys):
+                return self.reply(200, {"data": {"keys": sorted(keys)}})
+            return self.reply(404, {"errors": []})
+        if path in namespace["secrets"]:
+            return self.reply(200, {"data": namespace["secrets"][path]})
+        return self.reply(404, {"errors": []})
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in_vault(monkeypatch):
+    server = HTTPServer(("127.0.0.1", 0), StandInVault)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    monkeypatch.setenv("VAULT_ADDR",
+                       "http://127.0.0.1:%s" % server.server_address[1])
+    yield server
+    server.shutdown()
+    thread.join()
+
+
+def test_kv_count_namespaces(stand_in_vault):
+    out, err, rc = cli(["kv", "--count", "secret", "--namespaces",
+                        "team-a", "team-b", "--workers", "2"])
+    assert rc == 0
+    count = json.loads(out.decode())
+    assert count["team-a"]["secret"] == {"secrets_count": 2,
+                                         "values_count": 3}
+    assert count["team-b"]["secret"] == {"secrets_count": 1,
+                                         "values_count": 1}
+
+
+def test_kv_secrets_tree_namespaces(stand_in_vault):
+    out, err, rc = cli(["kv", "--secrets-tree", "secret/apps",
+                        "--namespaces", "team-a", "team-b"])
+    assert rc == 0
+    tree = json.loads(out.decode())
+    assert sorted(tree["team-a"]["secret/apps"]) == ["secret/apps/app1",
+                                                     "secret/apps/app2"]
+    assert tree["team-b"]["secret/apps"] == ["secret/apps/app1"]
+
+
+def test_policies_pull_namespaces(stand_in_vault):
+    out, err, rc = cli(["policies", "--pull", "--namespaces",
+                        "team-a", "team-b"])
+    assert rc == 0
+    namespaces_folder = os.path.join(os.getenv("VAULT_CONFIG"), "namespaces")
+    assert os.path.isfile(os.path.join(namespaces_folder, "team-a",
+                                       "policies", "user", "alice.hcl"))
+    assert os.path.isfile(os.path.join(namespaces_folder, "team-b",
+                                       "policies", "service", "app1.hcl"))
+    assert not os.path.isfile(os.path.join(namespaces_folder, "team-a",
+                                           "policies", "user", "bob.hcl"))